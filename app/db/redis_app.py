@@ -1,6 +1,9 @@
+import asyncio
 import os
 import logging
+import weakref
 import redis
+import redis.asyncio as aioredis
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,4 +16,29 @@ def create_redis_client(host: str = REDIS_HOST, port: int = REDIS_PORT , db : in
     logging.info(f"Connected to Redis at {host}:{port}")
     return client
 
+def create_async_redis_client(host: str = REDIS_HOST, port: int = REDIS_PORT , db : int = REDIS_DB) -> aioredis.Redis:
+    client = aioredis.Redis(host=host, port=port ,db=db)
+    logging.info(f"Created async Redis client for {host}:{port}")
+    return client
+
 redis_app = create_redis_client()
+async_redis_app = create_async_redis_client()
+
+# Async clients are bound to the event loop they were created in, code running on several loops gets one per loop
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = weakref.WeakKeyDictionary()
+
+
+def loop_redis_client() -> aioredis.Redis:
+    """Async Redis client of the running event loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    client = _loop_clients.get(loop)
+    if client is None:
+        client = create_async_redis_client()
+        _loop_clients[loop] = client
+    return client
+
+
+async def close_loop_redis_client() -> None:
+    client = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -1,13 +1,26 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.db.redis_app import async_redis_app
+from app.module.github.gh_async import close_shared_client
+from app.module.github.gh_pool import gh_client_pool
 from app.module.github.gh_router import gh_router
 from app.module.pr.pr_router import pr_router
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await async_redis_app.aclose()
+    await close_shared_client()
+    gh_client_pool.close()
+
+
 app = FastAPI(
     title="Code Reviewer for Pull Requests",
     version="1.0",
     description="This is a simple code reviewer for pull requests using langchain and agents.",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -1,17 +1,24 @@
 import operator
 import json
 
-from typing import TypedDict, Annotated, List, Union
+from typing import Optional, TypedDict, Annotated, List, Union
 from pydantic import BaseModel
 from langchain_core.agents import AgentAction
 from langchain_core.messages import BaseMessage
 
+from app.module.ai.agents.tool_call_parser import parse_tool_call
+
 
 class AgentState(TypedDict):
     input: str
     chat_history: list[BaseMessage]
     intermediate_steps: Annotated[list[tuple[AgentAction, str]], operator.add]
     output: dict[str, Union[str, List[str]]]
+    num_ctx: int
+    file_paths: list[str]
+    # Set when the budget ran out and the answer was forced, see ReviewBudget
+    stopped: str
+    llm_calls: Annotated[int, operator.add]
     
 class AgentAction(BaseModel):
     tool_name: str
@@ -19,10 +26,11 @@ class AgentAction(BaseModel):
     tool_output: str | None = None
 
     @classmethod
-    def from_ollama(cls, ollama_response: dict):
+    def from_ollama(cls, ollama_response: dict, tools: Optional[dict] = None):
+        """Parse the tool call of the response, repairing malformed JSON and checking it against `tools`"""
         try:
             # parse the output
-            output = json.loads(ollama_response["message"]["content"])
+            output = parse_tool_call(ollama_response["message"]["content"], tools)
             return cls(
                 tool_name=output["name"],
                 tool_input=output["parameters"],
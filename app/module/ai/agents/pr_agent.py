@@ -1,99 +1,332 @@
 import asyncio
+import inspect
 import json
 import logging
-import ollama
-from typing import Any, List, TypedDict
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from functools import partial
+from typing import Any, Callable, List, Optional, TypedDict
 
 from redis import Redis
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.agents import AgentAction
+from langchain_core.runnables import RunnableConfig
 from semantic_router.utils.function_call import FunctionSchema
 
 from app.module.ai.agents.base_agent import AgentState, AgentAction
 from app.module.github.gh_service import GHService
-from app.module.ai.llm.ollama_llm import OllamaLLM
+from app.module.ai.llm.ollama_llm import OLLAMA_WARM_UP, LLMCancelled, OllamaLLM
+from app.module.ai.agents.tool_call_parser import ToolCallStream
+from app.module.ai.agents.review_budget import REVIEW_FILE_TIMEOUT, STOP_DEADLINE, ReviewBudget
+from app.module.ai.llm.prompt_packer import PROMPT_MIN_NUM_CTX, PromptPack, PromptPacker, TokenCounter
 from langchain_core.runnables.graph import CurveStyle, MermaidDrawMethod, NodeStyles
 
 from app.module.ai.knowledge.internet_search import InternetSearch
-from app.module.ai.knowledge.repo_tree import RepoTree
+from app.module.ai.knowledge.repo_tree import FileNode, RepoTree
 from app.module.pr.pr_model import File
+from app.module.pr.pr_helper import get_issues, summarize_issues
+from app.module.pr.pr_triage import FULL, LIGHT, SKIP, TRIAGE_ENABLED, TRIAGE_MODEL, FileTriage, PRTriage
+
+# Max files reviewed at the same time by one agent (per worker task)
+REVIEW_CONCURRENCY = int(os.getenv("REVIEW_CONCURRENCY", 4))
+# Warm the tool caches (touched files, rendered tree) while the first LLM calls run
+CONTEXT_PREFETCH = os.getenv("CONTEXT_PREFETCH", "true").lower() == "true"
+CONTEXT_PREFETCH_CONCURRENCY = int(os.getenv("CONTEXT_PREFETCH_CONCURRENCY", 8))
+# Touched files fetched ahead per PR, the rest are fetched when a tool asks for them
+CONTEXT_PREFETCH_MAX_FILES = int(os.getenv("CONTEXT_PREFETCH_MAX_FILES", 50))
+
+
+def partial_answer(file_paths : List[str]) -> dict:
+    """final_answer_tool input used when a review is stopped before the model answered"""
+    files = [{"name": file_path, "issues": []} for file_path in file_paths]
+    return {
+        "file": files[0] if len(files) == 1 else files,
+        "summary": {"total_files": len(files), "total_issues": 0, "critical_issues": 0},
+    }
 
 
 class PRAgent():
-    def __init__(self, gh : GHService , repo_url: str , cache : Redis):
+    def __init__(self, gh : GHService , repo_url: str , cache : Redis, runtime : Optional["PRAgentRuntime"] = None):
         """
         Initialize the agent with a GitHub Instance.
+        Only repo and token specific state is built here, the rest comes from the process wide runtime.
         """
+        started = time.perf_counter()
+        self.runtime = runtime or PRAgentRuntime.get()
+        runtime_ready = time.perf_counter()
+
         self.gh = gh
         self.repo_url = repo_url
         self.repo_tree = RepoTree(gh, cache, repo_url)
-        self.internet_search = InternetSearch(search_engine="google")
-        self.memory_saver = MemorySaver()
-        self.tools = [
-            # self.repo_search_tool,
-            self.web_search_tool,
-            self.repo_file_tree_structure_tool,
-            self.repo_file_content_tool,
-            self.final_answer_tool,
-        ]
-        self.to_ollama = []
-        self.workflow = None
-        self.ollama = OllamaLLM()
-
-        self._register_tool()
-        self._build_workflow()
+        # Files of the PR under review, the repo tree is rendered around them
+        self.touched_paths : List[str] = []
+        self.internet_search = self.runtime.internet_search
+        self.to_ollama = self.runtime.to_ollama
+        self.workflow = self.runtime.workflow
+        self.token_counter = self.runtime.token_counter
+        self.packer = self.runtime.packer
+        self.triage = self.runtime.triage
+
+        finished = time.perf_counter()
+        self.setup_seconds = finished - started
+        logging.info(
+            f"PRAgent setup for {repo_url} took {self.setup_seconds:.3f}s "
+            f"(runtime {runtime_ready - started:.3f}s, repo tree {finished - runtime_ready:.3f}s)"
+        )
 
-    def get_pr_review(self , pr_number: int):
+    def get_pr_review(self , pr_number: int, on_result : Optional[Callable] = None, on_token : Optional[Callable] = None,
+                      budget : Optional[ReviewBudget] = None):
         """
         Get the PR review for the given PR number.
         """
         pr_files = self.gh.get_pr_files(self.repo_url, pr_number)
+        files = [file for file in self.gh.get_pr_changed_files(self.repo_url, pr_files) if file.patch]
+        self.checkout(pr_files, files)
+        self.prefetch_context(pr_files, files)
         print("Calling the agent for each file in the PR")
 
-        result = []
-        path_and_content = []
-        for file in pr_files.get_files():
-            if file.patch:
-                file_content = file.patch.replace("\n", " ")
-                file_path = file.filename.replace("\n", " ")
-                path_and_content.append((file_path, file_content))
-                agent_response = self.get_agent_response_for_file(file_path, file_content)
-                result.append(agent_response)
-        # TO SLOW TO RUN IN PARALLEL
-        # result = self.get_agent_response_for_file_parallel(path_and_content)
-        return result
+        path_and_content = [(file.filename, file.patch) for file in files]
+        return self.get_agent_response_for_file_parallel(path_and_content, on_result=on_result, on_token=on_token, budget=budget)
+
+    def checkout(self , pr : Any, files : List[Any]) -> None:
+        """Review `files` of the PR against the tree of its head commit rather than the default branch"""
+        self.repo_tree.set_ref(pr.head.sha)
+        self.touched_paths = [file.filename for file in files]
+
+    def render_repo_tree(self) -> str:
+        """The repo tree as the tree tool returns it: around the files under review, sized for the tool result budget"""
+        return self.repo_tree.get_tree_readable_for_llm(
+            focus_paths=self.touched_paths,
+            max_tokens=self.packer.reserve_tokens // 2,
+            count_tokens=self.token_counter.count,
+        )
+
+    def prefetch_context(self , pr : Any, files : List[Any]) -> List[Future]:
+        """
+            Speculatively fetch what the tools will most likely ask for, without waiting for it:
+            the post-change content of the touched files (into the blob cache) and the rendered tree.
+            A tool call made while a fetch is in flight waits for it instead of fetching again.
+        """
+        if not CONTEXT_PREFETCH:
+            return []
+        head_repo = pr.head.repo or pr.base.repo
+        executor = self.runtime.prefetch_executor
+        futures = [executor.submit(self._prefetch, "repo tree", self.render_repo_tree)]
+        head_files = [file for file in files if file.status != "removed" and file.sha]
+        for file in head_files:
+            file_node = FileNode(name=file.filename, blob_url=f"{head_repo.url}/git/blobs/{file.sha}", sha=file.sha)
+            self.repo_tree.set_head_file(file.filename, file_node)
+        # One bulk fetch of all of them, tool calls asking for one of them meanwhile wait for it
+        paths = [file.filename for file in head_files[:CONTEXT_PREFETCH_MAX_FILES]]
+        if paths:
+            futures.append(executor.submit(self._prefetch, "head contents", self.repo_tree.get_files_content, paths))
+        logging.info(f"Prefetching context for {len(paths)} files of {self.repo_url}#{pr.number}")
+        return futures
+
+    @staticmethod
+    def _prefetch(name : str, fetch : Callable, *args) -> None:
+        try:
+            fetch(*args)
+        except Exception as e:
+            logging.warning(f"Prefetch of {name} failed: {e}")
 
-    def get_agent_response_for_file(self , file_path : str , file_content : str):
+    def get_agent_response_for_pack(self , pack : PromptPack, on_token : Optional[Callable] = None,
+                                    budget : Optional[ReviewBudget] = None, max_steps : Optional[int] = None):
         """
-            Get the agent response for the given file.
+            Get the agent response for the files of a prompt pack.
+            `on_token(file_paths, token)` receives the LLM output as it is generated.
+            The pack gets its own deadline (within the PR one) starting now, when the budget runs
+            out the answer is forced and `stopped` is set in the response.
+            `max_steps=1` makes it a single shot review without tools.
         """
+        config = {"configurable": {
+            "agent": self,
+            "on_token": partial(on_token, pack.file_paths) if on_token else None,
+            "budget": (budget or ReviewBudget()).child(REVIEW_FILE_TIMEOUT, max_steps=max_steps),
+        }}
         agent_response = self.workflow.invoke({
-                "input": f"""
-                    file_path: {file_path}
-                    file_content: {file_content}
-                """,
+                "input": pack.render(),
                 "chat_history": [],
-                "intermediate_steps": []
-         })
+                "intermediate_steps": [],
+                "num_ctx": pack.num_ctx,
+                "file_paths": pack.file_paths,
+         }, config=config)
         return agent_response
 
 
-    def get_agent_response_for_file_parallel(self , path_and_content : List[tuple[str, str]]) -> str:
+    def get_agent_response_for_file_parallel(self , path_and_content : List[tuple[str, str]], max_workers : int = REVIEW_CONCURRENCY,
+                                             on_result : Optional[Callable] = None, on_token : Optional[Callable] = None,
+                                             budget : Optional[ReviewBudget] = None) -> List[dict]:
         """
-            Get the agent response for the given file.
+            Review the given files concurrently with at most `max_workers` requests in flight.
+            Files are first packed into token budgeted requests (big patches split, small ones batched).
+            Results keep the order of `path_and_content` and a failing request only fails its own files.
+            `on_result(index, result)` is called as soon as every request covering a file is done.
+            Files not done by the deadline of `budget` get a `partial` result instead of being waited on.
+            Files are triaged first: skipped ones are settled right away, light ones get a single LLM call.
         """
-        agent_response = self.workflow.batch(
-            [{
-                "input": f"""
-                    file_path: {file_path}
-                    file_content: {file_content}
-                """,
-                "chat_history": [],
-                "intermediate_steps": []
-            } for file_path, file_content in path_and_content]
+        if not path_and_content:
+            return []
+
+        index_of = {file_path: index for index, (file_path, _) in enumerate(path_and_content)}
+        results: List[dict] = [None] * len(path_and_content)
+        triage_of = {
+            file_triage.file_path: self._triage_info(file_triage, patch)
+            for file_triage, (_, patch) in zip(self.triage.triage(path_and_content) if self.triage else [], path_and_content)
+        }
+
+        def _settle(file_path : str, result : dict) -> None:
+            if file_path in triage_of:
+                result["triage"] = triage_of[file_path]
+            results[index_of[file_path]] = result
+            if on_result:
+                try:
+                    on_result(index_of[file_path], result)
+                except Exception as e:
+                    logging.error(f"Error in on_result callback for {file_path}: {e}")
+
+        to_review = {FULL: [], LIGHT: []}
+        for file_path, patch in path_and_content:
+            label = triage_of[file_path]["label"] if file_path in triage_of else FULL
+            if label == SKIP:
+                _settle(file_path, {"file_path": file_path, "output": partial_answer([file_path])})
+            else:
+                to_review[label].append((file_path, patch))
+
+        packs, pack_steps = [], []
+        for label, max_steps in ((FULL, None), (LIGHT, 1)):
+            label_packs = self.packer.pack(to_review[label]) if to_review[label] else []
+            packs += label_packs
+            pack_steps += [max_steps] * len(label_packs)
+        logging.info(
+            f"Packed {len(path_and_content)} files into {len(packs)} LLM requests "
+            f"({len(to_review[FULL])} full, {len(to_review[LIGHT])} light, "
+            f"{len(path_and_content) - len(to_review[FULL]) - len(to_review[LIGHT])} skipped)"
         )
-        return agent_response
+        if not packs:
+            return results
+        packs_left = Counter(file_path for pack in packs for file_path in pack.file_paths)
+        pack_results: List[dict] = [None] * len(packs)
+
+        def _finish(pack_index : int, pack_result : dict) -> None:
+            pack_results[pack_index] = pack_result
+            for file_path in packs[pack_index].file_paths:
+                packs_left[file_path] -= 1
+                if not packs_left[file_path]:
+                    _settle(file_path, self._assemble_file_result(file_path, pack_results))
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(packs))))
+        futures = {
+            executor.submit(self._review_pack, pack, on_token, budget, pack_steps[index]): index
+            for index, pack in enumerate(packs)
+        }
+        try:
+            for future in as_completed(futures, timeout=budget.remaining() if budget else None):
+                _finish(futures[future], future.result())
+        except FuturesTimeout:
+            # Packs still running stop at their next step or LLM chunk since they share the expired deadline
+            unfinished = [index for future, index in futures.items() if pack_results[index] is None]
+            logging.warning(f"PR review deadline reached with {len(unfinished)} of {len(packs)} LLM requests unfinished")
+            for pack_index in unfinished:
+                pack = packs[pack_index]
+                _finish(pack_index, self._split_pack_output(pack, partial_answer(pack.file_paths), stopped=STOP_DEADLINE))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    def _assemble_file_result(self , file_path : str , pack_results : List[dict]) -> dict:
+        """
+            Build the result of a file out of every pack that reviewed a part of it.
+        """
+        outputs, errors, stopped = [], [], []
+        cost = {"seconds": 0.0, "llm_calls": 0.0}
+        for pack_result in pack_results:
+            if pack_result and file_path in pack_result:
+                outputs.append(pack_result[file_path].get("output"))
+                for key, value in (pack_result[file_path].get("cost") or {}).items():
+                    cost[key] += value
+                if pack_result[file_path].get("error"):
+                    errors.append(pack_result[file_path]["error"])
+                if pack_result[file_path].get("partial"):
+                    stopped.append(pack_result[file_path]["partial"])
+        result = {
+            "file_path": file_path,
+            "output": outputs[0] if len(outputs) == 1 else self._merge_outputs(file_path, outputs),
+            "cost": cost,
+        }
+        if errors:
+            result["error"] = "; ".join(errors)
+        if stopped:
+            # The review was cut short (cancelled, deadline or step budget), findings may be missing
+            result["partial"] = "; ".join(sorted(set(stopped)))
+        return result
+
+    def _review_pack(self , pack : PromptPack, on_token : Optional[Callable] = None, budget : Optional[ReviewBudget] = None,
+                     max_steps : Optional[int] = None) -> dict:
+        """
+            Run the agent for one pack, turning any failure into error entries for its files.
+            Each file is charged an equal share of the pack's time and LLM calls.
+        """
+        started = time.perf_counter()
+        llm_calls = 0
+        try:
+            agent_response = self.get_agent_response_for_pack(pack, on_token, budget, max_steps)
+            llm_calls = agent_response.get("llm_calls", 0)
+            split = self._split_pack_output(pack, agent_response.get("output"), stopped=agent_response.get("stopped"))
+        except Exception as e:
+            logging.error(f"Error reviewing {pack.file_paths}: {e}")
+            split = {file_path: {"output": None, "error": str(e)} for file_path in pack.file_paths}
+        share = len(pack.file_paths)
+        for entry in split.values():
+            entry["cost"] = {"seconds": (time.perf_counter() - started) / share, "llm_calls": llm_calls / share}
+        return split
+
+    def _triage_info(self , file_triage : FileTriage, patch : str) -> dict:
+        return {
+            "label": file_triage.label,
+            "reason": file_triage.reason,
+            "tokens": self.token_counter.count(patch),
+        }
+
+    def _split_pack_output(self , pack : PromptPack , output : Any, stopped : Optional[str] = None) -> dict:
+        """
+            Map the final answer of a pack back to each of its files.
+        """
+        file_paths = pack.file_paths
+        if len(file_paths) == 1:
+            split = {file_paths[0]: {"output": output}}
+            if stopped:
+                split[file_paths[0]]["partial"] = stopped
+            return split
+
+        entries = output.get("file") if isinstance(output, dict) else None
+        if isinstance(entries, dict):
+            entries = [entries]
+        entries = [entry for entry in entries or [] if isinstance(entry, dict)]
+        by_name = {entry.get("name"): entry for entry in entries}
+
+        split = {}
+        for index, file_path in enumerate(file_paths):
+            entry = by_name.get(file_path)
+            if entry is None and len(entries) == len(file_paths):
+                # The model did not echo file names back, trust the order
+                entry = entries[index]
+            issues = get_issues({"file": entry})
+            split[file_path] = {"output": {"file": {"name": file_path, "issues": issues}, "summary": summarize_issues(issues)}}
+            if stopped:
+                split[file_path]["partial"] = stopped
+        return split
+
+    def _merge_outputs(self , file_path : str , outputs : List[Any]) -> dict:
+        """
+            Merge the answers for the parts of a file that was split across packs.
+        """
+        issues = [issue for output in outputs for issue in get_issues(output)]
+        return {"file": {"name": file_path, "issues": issues}, "summary": summarize_issues(issues)}
 
 
     def web_search_tool(self , query: str) -> list[str]:
@@ -110,11 +343,12 @@ class PRAgent():
 
     def repo_file_tree_structure_tool(self) -> str:
         """
-            Returns the tree structure of the repository.
+            Returns the tree structure of the repository around the files under review,
+            folders further away are collapsed with their number of files.
             input for this tool -> (no input needed)
         """
         try:
-            result = self.repo_tree.get_tree_readable_for_llm()
+            result = self.render_repo_tree()
             return result
         except Exception as e:
             logging.error(f"Error in repo_file_tree_structure_tool: {e}")
@@ -134,6 +368,7 @@ class PRAgent():
                 "suggestion": "suggested fix" in string
             }]
         },
+        (when several files are reviewed at once "file" is a list of these objects, one per file)
 
         "summary": {
             "total_files": total_files in integer,
@@ -154,18 +389,70 @@ class PRAgent():
             logging.error(f"Error in repo_file_content_tool: {e}")
             return "repo_file_content_tool currenly not working don't use this tool again"
 
+
+class PRAgentRuntime():
+    """
+    Everything the agent needs that does not depend on the repo or the token:
+    tool schemas, the rendered system prompt, the compiled graph and the LLM client.
+    Built once per process (at worker start) and shared by every task.
+    """
+    _instance : Optional["PRAgentRuntime"] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        started = time.perf_counter()
+        self.internet_search = InternetSearch(search_engine="google")
+        self.memory_saver = MemorySaver()
+        self.to_ollama = []
+        self.workflow = None
+        self.ollama = OllamaLLM()
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=CONTEXT_PREFETCH_CONCURRENCY, thread_name_prefix="prefetch")
+
+        self._register_tool()
+        self.system_tools_prompt = self._render_system_tools_prompt()
+        self._build_workflow()
+        self.token_counter = TokenCounter()
+        self.packer = PromptPacker(self.token_counter, prefix_tokens=self.token_counter.count(self.system_tools_prompt))
+        self.triage = None
+        if TRIAGE_ENABLED:
+            self.triage = PRTriage(classifier=OllamaLLM(model_name=TRIAGE_MODEL) if TRIAGE_MODEL else None)
+        logging.info(f"PRAgentRuntime built in {time.perf_counter() - started:.3f}s")
+
+    def warm_up(self) -> Optional[threading.Thread]:
+        """
+            Load the model and prefill the system prompt in the background, worker start must not wait for it.
+        """
+        if not OLLAMA_WARM_UP:
+            return None
+        thread = threading.Thread(target=self._warm_up, name="ollama-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_up(self):
+        try:
+            self.ollama.warm_up(
+                messages=[{"role": "system", "content": self._get_system_tools_prompt()}],
+                options={"num_ctx": self.packer.get_num_ctx(self.packer.content_tokens)},
+            )
+        except Exception as e:
+            logging.warning(f"Failed to warm up {self.ollama.model_name}: {e}")
+
+    @classmethod
+    def get(cls) -> "PRAgentRuntime":
+        """Return the process wide runtime, building it on first use"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
     def _register_tool(self):
-        # self.search_schema = FunctionSchema(search).to_ollama()
-        # self.final_answer_schema = FunctionSchema(final_answer).to_ollama()
-        # self.tool_str_to_func = {
-        #     "search": search,
-        #     "final_answer": final_answer
-        # }
-        self.web_search_schema = FunctionSchema(self.web_search_tool).to_ollama()
-        # self.repo_search_schema = FunctionSchema(self.repo_search_tool).to_ollama()
-        self.repo_file_tree_structure_schema = FunctionSchema(self.repo_file_tree_structure_tool).to_ollama()
-        self.repo_file_content_schema = FunctionSchema(self.repo_file_content_tool).to_ollama()
-        self.final_answer_schema = FunctionSchema(self.final_answer_tool).to_ollama()
+        # Schemas are built from the unbound tool methods so they can be shared by every PRAgent
+        self.web_search_schema = self._tool_schema(PRAgent.web_search_tool)
+        # self.repo_search_schema = self._tool_schema(PRAgent.repo_search_tool)
+        self.repo_file_tree_structure_schema = self._tool_schema(PRAgent.repo_file_tree_structure_tool)
+        self.repo_file_content_schema = self._tool_schema(PRAgent.repo_file_content_tool)
+        self.final_answer_schema = self._tool_schema(PRAgent.final_answer_tool)
 
         self.to_ollama = [
             self.web_search_schema,
@@ -174,15 +461,29 @@ class PRAgent():
             self.final_answer_schema,
             # self.repo_search_schema,
         ]
+        # name -> schema, tool calls of the model are validated against it
+        self.tool_schemas = {tool["function"]["name"]: tool for tool in self.to_ollama}
 
         self.tool_str_to_func = {
-            "web_search_tool": self.web_search_tool,
-        #   "repo_search": self.repo_search_tool,
-            "repo_file_tree_structure_tool": self.repo_file_tree_structure_tool,
-            "repo_file_content_tool": self.repo_file_content_tool,
-            "final_answer_tool": self.final_answer_tool
+            "web_search_tool": PRAgent.web_search_tool,
+        #   "repo_search": PRAgent.repo_search_tool,
+            "repo_file_tree_structure_tool": PRAgent.repo_file_tree_structure_tool,
+            "repo_file_content_tool": PRAgent.repo_file_content_tool,
+            "final_answer_tool": PRAgent.final_answer_tool
         }
 
+    @staticmethod
+    def _tool_schema(tool : Callable) -> dict:
+        schema = FunctionSchema(tool).to_ollama()
+        parameters = schema["function"]["parameters"]
+        parameters["properties"].pop("self", None)
+        # semantic_router leaves `required` empty, tool calls are validated against it
+        parameters["required"] = [
+            name for name, parameter in inspect.signature(tool).parameters.items()
+            if name != "self" and parameter.default is inspect.Parameter.empty
+        ]
+        return schema
+
     def _build_workflow(self):
         try:
             graph = StateGraph(AgentState)
@@ -245,17 +546,24 @@ class PRAgent():
         """
         return system_prompt
 
-    def _get_system_tools_prompt(self):
+    def _render_system_tools_prompt(self):
         """
-            Get the system prompt for the tools.
+            Render the system prompt for the tools, done once when the runtime is built.
+            Tools are serialized with sorted keys so the prefix is byte identical in every process.
         """
-        tools_str = "\n".join([str(tool) for tool in self.to_ollama])
+        tools_str = "\n".join([json.dumps(tool, sort_keys=True) for tool in self.to_ollama])
 
         return (
             f"{self._get_system_prompt()}\n\n"
             f"You can strictly only use the following tools:\n{tools_str}"
         )
 
+    def _get_system_tools_prompt(self):
+        """
+            Get the system prompt for the tools.
+        """
+        return self.system_tools_prompt
+
     def _create_scratchpad(self ,intermediate_steps: list[AgentAction]):
         """
             Create a scratchpad of the intermediate steps.
@@ -275,55 +583,97 @@ class PRAgent():
         user_message = {"role": "user", "content": action.tool_output}
         return [assistant_message, user_message]
 
-    def _call_llm(self ,user_input: str, chat_history: list[dict], intermediate_steps: list[AgentAction]) -> AgentAction:
-        # format the intermediate steps into a scratchpad
+    def _call_llm(self ,user_input: str, chat_history: list[dict], intermediate_steps: list[AgentAction], num_ctx: int = PROMPT_MIN_NUM_CTX,
+                  on_token: Optional[Callable] = None, last_step: bool = False,
+                  cancelled: Optional[Callable[[], bool]] = None) -> AgentAction:
+        # Layout, most stable first so each call reuses the prompt cache of the previous one:
+        # system + tools (identical for every call), the pack input, the append only tool
+        # steps and finally the short instructions that change from call to call
         scratchpad = self._create_scratchpad(intermediate_steps)
 
+        tail = []
         # if the scratchpad is not empty, we add a small reminder message to the agent
         if scratchpad:
-            tools_used = [action.tool_name for action in intermediate_steps]
-            scratchpad += [{
+            tools_used = sorted({action.tool_name for action in intermediate_steps})
+            tail.append({
                 "role": "user",
                 "content": (
-                    f"""Please continue, as a reminder my query was '{user_input}'.
-                    Only answer to the original query, and nothing else — but use the
-                    information I provided to you to do so
-                    dont use the following tools : {tools_used}
-                    """
+                    "Please continue with the review of the files above. Only answer to the original query, "
+                    "and nothing else — but use the information I provided to you to do so. "
+                    f"dont use the following tools : {tools_used}"
                 )
-            }]
+            })
+        if last_step:
+            tail.append({
+                "role": "user",
+                "content": "No more tools can be used, answer now with the final_answer_tool.",
+            })
 
         messages = [
             {"role": "system", "content": self._get_system_tools_prompt()},
             *chat_history,
             {"role": "user", "content": user_input},
             *scratchpad,
+            *tail,
         ]
         print("#LLM_CALL : ", messages)
-        res = ollama.chat(
-            model="llama3.1",
+        # Streamed so the tool can run as soon as the call's JSON object is closed,
+        # whatever the model would have generated after it is dropped
+        res = self.ollama.chat(
             messages=messages,
             format="json",
-            options={"num_ctx" : 1000}
+            options={"num_ctx" : num_ctx},
+            on_token=on_token,
+            stop_when=ToolCallStream().feed,
+            cancelled=cancelled,
         )
 
-        # res = self.ollama.get_ollama_ollama(
-        #     messages=messages,
-        #     format="json",
-        # )
-
-        return AgentAction.from_ollama(res)
+        return AgentAction.from_ollama(res, tools=self.tool_schemas)
 
-    def _run_oracle(self , state: TypedDict): # type: ignore
+    def _run_oracle(self , state: TypedDict, config: RunnableConfig): # type: ignore
         print(f"Running the oracle")
+        configurable = (config or {}).get("configurable", {})
+        budget = configurable.get("budget") or ReviewBudget()
+        # Oracle calls so far, tool results are the steps carrying an output
+        steps = sum(1 for action in state["intermediate_steps"] if action.tool_output is None)
+        reason = budget.stop_reason(steps)
+        if reason:
+            return self._stop(state, reason)
+
         chat_history = state["chat_history"]
-        out = self._call_llm(
-            user_input=state["input"],
-            chat_history=chat_history,
-            intermediate_steps=state["intermediate_steps"]
-        )
+        try:
+            out = self._call_llm(
+                user_input=state["input"],
+                chat_history=chat_history,
+                intermediate_steps=state["intermediate_steps"],
+                num_ctx=state.get("num_ctx") or PROMPT_MIN_NUM_CTX,
+                on_token=configurable.get("on_token"),
+                last_step=budget.is_last_step(steps),
+                cancelled=budget.is_over,
+            )
+        except LLMCancelled as e:
+            logging.info(str(e))
+            return {**self._stop(state, budget.stop_reason(steps) or STOP_DEADLINE), "llm_calls": 1}
+        if out.tool_name != "final_answer_tool":
+            # Don't run a tool whose result could never be used
+            reason = budget.stop_reason(steps + 1)
+            if reason:
+                return {**self._stop(state, reason), "llm_calls": 1}
+        return {
+            "intermediate_steps": [out],
+            "llm_calls": 1,
+        }
+
+    def _stop(self , state: TypedDict, reason: str): # type: ignore
+        """
+            Force a final answer without findings once the budget of the review ran out.
+        """
+        file_paths = state.get("file_paths") or []
+        logging.warning(f"Stopping review of {file_paths} early: {reason}")
+        action = AgentAction(tool_name="final_answer_tool", tool_input=partial_answer(file_paths))
         return {
-            "intermediate_steps": [out]
+            "intermediate_steps": [action],
+            "stopped": reason,
         }
 
     def _router(self, state: TypedDict): # type: ignore
@@ -339,15 +689,17 @@ class PRAgent():
             print("Router error", e)
             return "final_answer_tool"
 
-    def _run_tool(self,state: TypedDict): # type: ignore
+    def _run_tool(self,state: TypedDict, config: RunnableConfig): # type: ignore
         tool_name = state["intermediate_steps"][-1].tool_name
         tool_args = state["intermediate_steps"][-1].tool_input
         print(f"run_tool | {tool_name}.invoke(input={tool_args})")
-        out = self.tool_str_to_func[tool_name](**tool_args)
+        agent = config["configurable"]["agent"]
+        out = self.tool_str_to_func[tool_name](agent, **tool_args)
         action_out = AgentAction(
             tool_name=tool_name,
             tool_input=tool_args,
-            tool_output=str(out),
+            # Keep tool results inside the reserve the pack's num_ctx was sized with
+            tool_output=self.token_counter.truncate(str(out), self.packer.reserve_tokens // 2),
         )
         if tool_name == "final_answer_tool":
             return {"output": out}
@@ -0,0 +1,66 @@
+import os
+import time
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Max oracle (LLM) calls per pack, tools can each be used once so 4 covers every tool + the answer
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", 4))
+# Wall-clock seconds a pack of files may take once it started, 0 disables the deadline
+REVIEW_FILE_TIMEOUT = float(os.getenv("REVIEW_FILE_TIMEOUT", 300))
+# Wall-clock seconds a whole PR review may take, 0 disables the deadline
+REVIEW_PR_TIMEOUT = float(os.getenv("REVIEW_PR_TIMEOUT", 1800))
+
+STOP_CANCELLED = "cancelled"
+STOP_DEADLINE = "deadline"
+STOP_STEPS = "step_budget"
+
+
+class ReviewBudget():
+    """
+    Deadline, oracle step budget and cancellation check of a review.
+    The budget is checked between agent steps and on every chunk of a streamed LLM call, which is
+    dropped once the budget runs out. Before its first chunk a call is only bounded by
+    OLLAMA_REQUEST_TIMEOUT.
+    """
+    def __init__(self, timeout: Optional[float] = None, max_steps: int = AGENT_MAX_STEPS,
+                 cancelled: Optional[Callable[[], bool]] = None, deadline: Optional[float] = None):
+        self.deadline = deadline
+        if timeout and timeout > 0:
+            own_deadline = time.monotonic() + timeout
+            self.deadline = own_deadline if deadline is None else min(deadline, own_deadline)
+        self.max_steps = max_steps
+        self.cancelled = cancelled
+
+    def child(self, timeout: Optional[float] = REVIEW_FILE_TIMEOUT, max_steps: Optional[int] = None) -> "ReviewBudget":
+        """Budget for one part of the review, never outliving this one"""
+        return ReviewBudget(timeout=timeout, max_steps=max_steps or self.max_steps, cancelled=self.cancelled,
+                            deadline=self.deadline)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, None when there is none"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def is_cancelled(self) -> bool:
+        return bool(self.cancelled and self.cancelled())
+
+    def is_over(self) -> bool:
+        """True once the review was cancelled or its deadline passed"""
+        return self.is_cancelled() or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def is_last_step(self, steps: int) -> bool:
+        return bool(self.max_steps) and steps + 1 >= self.max_steps
+
+    def stop_reason(self, steps: int = 0) -> Optional[str]:
+        """Why the review must stop now after `steps` oracle calls, None when it may go on"""
+        if self.is_cancelled():
+            return STOP_CANCELLED
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return STOP_DEADLINE
+        if self.max_steps and steps >= self.max_steps:
+            return STOP_STEPS
+        return None
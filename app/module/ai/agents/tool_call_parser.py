@@ -0,0 +1,191 @@
+import difflib
+import json
+import re
+from typing import Any, Dict, Optional
+
+# Keys models use for the tool name and its arguments, first match wins
+NAME_KEYS = ("name", "tool_name", "tool", "function", "action")
+PARAMETER_KEYS = ("parameters", "arguments", "args", "params", "input", "tool_input", "action_input")
+
+FENCE_RE = re.compile(r"```[a-zA-Z]*\s*(.*?)(?:```|$)", re.S)
+LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+
+
+class ToolCallParseError(ValueError):
+    pass
+
+
+class JSONObjectScanner:
+    """
+    Follows strings, escapes and bracket nesting of JSON-ish text fed piece by piece,
+    to know where the first top level object starts and whether it was closed.
+    Single quoted strings are followed too since models produce them.
+    """
+    def __init__(self):
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self.stack: list[str] = []
+        self.quote: Optional[str] = None
+        self.escape = False
+        self.length = 0
+
+    def feed(self, text: str) -> bool:
+        """Consume text, returns True once the first object is closed"""
+        for offset, char in enumerate(text):
+            if self.end is not None:
+                break
+            position = self.length + offset
+            if self.start is None:
+                if char == "{":
+                    self.start = position
+                    self.stack.append(char)
+                continue
+            if self.quote:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == self.quote:
+                    self.quote = None
+            elif char in ("\"", "'"):
+                self.quote = char
+            elif char in CLOSERS:
+                self.stack.append(char)
+            elif char in ("}", "]") and self.stack:
+                self.stack.pop()
+                if not self.stack:
+                    self.end = position + 1
+        self.length += len(text)
+        return self.end is not None
+
+    def closing_suffix(self) -> str:
+        """What a truncated object is missing to be closed"""
+        suffix = self.quote or ""
+        return suffix + "".join(CLOSERS[opener] for opener in reversed(self.stack))
+
+
+class ToolCallStream:
+    """Fed with streamed LLM tokens, tells when the tool call JSON is complete so the rest can be dropped"""
+    def __init__(self):
+        self.scanner = JSONObjectScanner()
+
+    def feed(self, token: str) -> bool:
+        return self.scanner.feed(token)
+
+
+def extract_object(text: str) -> str:
+    """The first JSON object of text without fences or trailing text, closed if it was truncated"""
+    fenced = FENCE_RE.search(text)
+    if fenced and "{" in fenced.group(1):
+        text = fenced.group(1)
+    scanner = JSONObjectScanner()
+    scanner.feed(text)
+    if scanner.start is None:
+        raise ToolCallParseError("no JSON object in the response")
+    if scanner.end is not None:
+        return text[scanner.start:scanner.end]
+    return re.sub(r"[,:\s]+$", "", text[scanner.start:]) + scanner.closing_suffix()
+
+
+def normalize_json(text: str) -> str:
+    """Rewrite single quoted strings, Python literals and trailing commas into valid JSON"""
+    out = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char in ("\"", "'"):
+            end = index + 1
+            while end < len(text) and text[end] != char:
+                end += 2 if text[end] == "\\" else 1
+            body = text[index + 1:end]
+            if char == "'":
+                body = body.replace("\\'", "'").replace("\"", "\\\"")
+            out.append(f"\"{body}\"")
+            index = end + 1
+            continue
+        word = re.match(r"[A-Za-z]+", text[index:])
+        if word:
+            out.append(LITERALS.get(word.group(0), word.group(0)))
+            index += len(word.group(0))
+            continue
+        if char == ",":
+            following = text[index + 1:].lstrip()
+            if following[:1] in ("}", "]"):
+                index += 1
+                continue
+        out.append(char)
+        index += 1
+    return "".join(out)
+
+
+def loads_tolerant(text: str) -> Any:
+    candidate = extract_object(text)
+    try:
+        return json.loads(candidate, strict=False)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(normalize_json(candidate), strict=False)
+    except json.JSONDecodeError as e:
+        raise ToolCallParseError(f"unrecoverable JSON: {e}") from e
+
+
+def _find_call(obj: Any) -> tuple[Optional[str], Any]:
+    """Pull the tool name and arguments out of the shapes models answer with"""
+    if isinstance(obj, list) and obj:
+        obj = obj[0]
+    if not isinstance(obj, dict):
+        raise ToolCallParseError("tool call is not an object")
+    function = obj.get("function")
+    if isinstance(function, dict) and "name" in function:
+        # {"function": {"name": ..., "arguments": ...}}
+        return _find_call(function)
+
+    name = next((obj[key] for key in NAME_KEYS if isinstance(obj.get(key), str)), None)
+    parameters = next((obj[key] for key in PARAMETER_KEYS if key in obj), None)
+    if isinstance(parameters, str):
+        try:
+            parameters = loads_tolerant(parameters)
+        except ToolCallParseError:
+            pass
+    if parameters is None:
+        # Arguments flattened next to the name
+        parameters = {key: value for key, value in obj.items() if key not in NAME_KEYS}
+    return name, parameters
+
+
+def parse_tool_call(text: str, tools: Optional[Dict[str, dict]] = None) -> dict:
+    """
+    Parse a tool call answered by the model into {"name", "parameters"}, repairing code fences,
+    trailing text, single quotes, truncated closing braces and renamed keys. When `tools`
+    (name -> ollama function schema) is given the call is validated against it.
+    """
+    name, parameters = _find_call(loads_tolerant(text))
+    if not isinstance(parameters, dict):
+        raise ToolCallParseError("tool parameters are not an object")
+    if name is None and tools and "final_answer_tool" in tools and "file" in parameters:
+        # The model skipped the envelope and answered with the final answer itself
+        name = "final_answer_tool"
+    if name is None:
+        raise ToolCallParseError("no tool name in the response")
+    if not tools:
+        return {"name": name, "parameters": parameters}
+
+    if name not in tools:
+        match = difflib.get_close_matches(name, list(tools), n=1, cutoff=0.8)
+        if not match:
+            raise ToolCallParseError(f"unknown tool {name}")
+        name = match[0]
+    schema = tools[name]["function"]["parameters"]
+    properties = schema.get("properties", {})
+    required = schema.get("required", [])
+    missing = [key for key in required if key not in parameters]
+    unknown = [key for key in parameters if key not in properties]
+    if len(missing) == 1 and len(unknown) == 1:
+        # e.g. {"path": ...} for {"file_path": ...}
+        parameters = {**parameters, missing[0]: parameters[unknown[0]]}
+        missing = []
+    if missing:
+        raise ToolCallParseError(f"{name} is missing {missing}")
+    return {"name": name, "parameters": {key: value for key, value in parameters.items() if key in properties}}
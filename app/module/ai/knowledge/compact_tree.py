@@ -0,0 +1,174 @@
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+from typing import Iterable, List, Optional, Tuple
+
+import msgpack
+
+FORMAT_VERSION = 1
+MAGIC = b"RT1"
+FILE = 0
+FOLDER = 1
+NO_SHA = bytes(20)
+
+
+def _native(buffer: bytes, typecode: str, byteorder: str):
+    """Zero-copy view of a packed array, copied and swapped only on a host of the other endianness"""
+    if byteorder == sys.byteorder:
+        return memoryview(buffer).cast(typecode)
+    values = array(typecode)
+    values.frombytes(buffer)
+    values.byteswap()
+    return values
+
+
+def _sha_bytes(sha: Optional[str]) -> bytes:
+    try:
+        packed = bytes.fromhex(sha or "")
+    except ValueError:
+        return NO_SHA
+    return packed if len(packed) == 20 else NO_SHA
+
+
+class CompactTree:
+    """
+    Columnar form of a repository tree for the Redis cache. Entries are kept in tree order
+    (parents before children) as parallel arrays: concatenated UTF-8 paths with their offsets,
+    parent indices (-1 for the root), types, binary SHAs and sizes. `order` lists the entries
+    sorted by path so a single path is found by bisection on the raw buffers, without decoding
+    anything but the probed paths.
+    """
+    def __init__(self, root_sha: str, paths: bytes, offsets, parents, order, types: bytes, shas: bytes,
+                 sizes, url_prefix: Optional[str] = None, urls: Optional[List[Optional[str]]] = None):
+        self.root_sha = root_sha
+        self.paths = paths
+        self.offsets = offsets
+        self.parents = parents
+        self.order = order
+        self.types = types
+        self.shas = shas
+        self.sizes = sizes
+        # blob_url is url_prefix + sha when every file follows the same pattern, else urls holds them
+        self.url_prefix = url_prefix
+        self.urls = urls
+
+    @classmethod
+    def from_entries(cls, root_sha: str,
+                     entries: Iterable[Tuple[str, int, Optional[str], Optional[int], Optional[str]]]) -> "CompactTree":
+        """Build from (path, type, sha, size, blob_url) tuples in tree order"""
+        encoded_paths: List[bytes] = []
+        parents, types, shas, sizes, urls = array("i"), bytearray(), [], array("q"), []
+        index: dict[str, int] = {}
+        for path, kind, sha, size, blob_url in entries:
+            index[path] = len(encoded_paths)
+            encoded_paths.append(path.encode("utf-8"))
+            parents.append(index.get(path.rpartition("/")[0], -1))
+            types.append(kind)
+            shas.append(sha)
+            sizes.append(-1 if size is None else size)
+            urls.append(blob_url)
+
+        url_prefix = None
+        first = next((i for i, url in enumerate(urls) if url), None)
+        if first is not None and shas[first] and urls[first].endswith(shas[first]):
+            url_prefix = urls[first][:-len(shas[first])]
+            if all(url is None or (sha and url == url_prefix + sha) for url, sha in zip(urls, shas)):
+                urls = None
+            else:
+                url_prefix = None
+
+        offsets = array("I", [0])
+        offsets.extend(accumulate(map(len, encoded_paths)))
+        order = array("I", sorted(range(len(encoded_paths)), key=encoded_paths.__getitem__))
+        return cls(root_sha, b"".join(encoded_paths), offsets, parents, order, bytes(types),
+                   b"".join(map(_sha_bytes, shas)), sizes, url_prefix, urls)
+
+    def encode(self, compress: bool = True) -> bytes:
+        payload = msgpack.packb({
+            "v": FORMAT_VERSION,
+            "byteorder": sys.byteorder,
+            "root_sha": self.root_sha,
+            "paths": self.paths,
+            "offsets": bytes(self.offsets),
+            "parents": bytes(self.parents),
+            "order": bytes(self.order),
+            "types": self.types,
+            "shas": self.shas,
+            "sizes": bytes(self.sizes),
+            "url_prefix": self.url_prefix,
+            "urls": self.urls,
+        }, use_bin_type=True)
+        if compress:
+            # Level 1: paths and SHAs compress about as well as at the default level, in half the time
+            return MAGIC + b"z" + zlib.compress(payload, 1)
+        return MAGIC + b"r" + payload
+
+    @classmethod
+    def decode(cls, raw: bytes) -> Optional["CompactTree"]:
+        """The tree stored by encode, None when raw is not in this format"""
+        if raw[:len(MAGIC)] != MAGIC:
+            return None
+        payload = raw[len(MAGIC) + 1:]
+        if raw[len(MAGIC):len(MAGIC) + 1] == b"z":
+            payload = zlib.decompress(payload)
+        data = msgpack.unpackb(payload, raw=False)
+        if data.get("v") != FORMAT_VERSION:
+            return None
+        byteorder = data["byteorder"]
+        return cls(
+            root_sha=data["root_sha"],
+            paths=data["paths"],
+            offsets=_native(data["offsets"], "I", byteorder),
+            parents=_native(data["parents"], "i", byteorder),
+            order=_native(data["order"], "I", byteorder),
+            types=data["types"],
+            shas=data["shas"],
+            sizes=_native(data["sizes"], "q", byteorder),
+            url_prefix=data["url_prefix"],
+            urls=data["urls"],
+        )
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def _path_bytes(self, index: int) -> bytes:
+        return self.paths[self.offsets[index]:self.offsets[index + 1]]
+
+    def path(self, index: int) -> str:
+        return self._path_bytes(index).decode("utf-8")
+
+    def find(self, path: str) -> Optional[int]:
+        """Index of the entry at `path`, None when there is none"""
+        target = path.encode("utf-8")
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._path_bytes(self.order[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.order) and self._path_bytes(self.order[low]) == target:
+            return self.order[low]
+        return None
+
+    def is_folder(self, index: int) -> bool:
+        return self.types[index] == FOLDER
+
+    def name(self, index: int) -> str:
+        return self.path(index).rpartition("/")[2]
+
+    def sha(self, index: int) -> Optional[str]:
+        sha = self.shas[index * 20:index * 20 + 20]
+        return None if sha == NO_SHA else sha.hex()
+
+    def size(self, index: int) -> Optional[int]:
+        size = self.sizes[index]
+        return None if size < 0 else size
+
+    def blob_url(self, index: int) -> Optional[str]:
+        if self.urls is not None:
+            return self.urls[index]
+        if self.is_folder(index) or self.url_prefix is None:
+            return None
+        return self.url_prefix + self.sha(index)
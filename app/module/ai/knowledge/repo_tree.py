@@ -1,12 +1,36 @@
 import logging
-from typing import List, Optional
-from app.module.github.gh_service import GHService
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Union
+from app.module.github.gh_service import BLOB_URL, GH_COMPARE_MAX_FILES, GHService, blob_text
+from app.module.github.gh_cache import BlobCache, blob_cache
+from app.module.ai.knowledge.compact_tree import FILE, FOLDER, CompactTree
+from app.module.ai.knowledge.tree_renderer import TreeRenderer, estimate_tokens
+from app.module.utils.lru import LRUCache
 from redis import Redis
-import json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REPO_TREE_CACHE_COMPRESS = os.getenv("REPO_TREE_CACHE_COMPRESS", "true").lower() == "true"
+REPO_TREE_CACHE_TTL = int(os.getenv("REPO_TREE_CACHE_TTL", 7 * 24 * 3600))
+# Trees kept per repository, the least recently used ones are evicted beyond it
+REPO_TREE_CACHE_MAX_PER_REPO = int(os.getenv("REPO_TREE_CACHE_MAX_PER_REPO", 4))
+# Derive the tree of a new commit from a cached ancestor's tree and the compare between them
+REPO_TREE_DERIVE = os.getenv("REPO_TREE_DERIVE", "true").lower() == "true"
+# Recently used commits tried as the ancestor, each costs a compare call
+REPO_TREE_DERIVE_CANDIDATES = int(os.getenv("REPO_TREE_DERIVE_CANDIDATES", 3))
+REPO_TREE_RENDER_CACHE_BYTES = int(os.getenv("REPO_TREE_RENDER_CACHE_BYTES", 16 * 1024 * 1024))
+
+# Rendered trees of the process by (repo, tree SHA, focus paths, token budget)
+rendered_trees = LRUCache(max_bytes=REPO_TREE_RENDER_CACHE_BYTES)
 
 
 class FileNode:
     """Represents a file in the repository"""
+    __slots__ = ("name", "blob_url", "sha", "size")
+
     def __init__(self, name: str, blob_url: Optional[str] = None, 
                  sha: Optional[str] = None, size: Optional[int] = None):
         self.name = name
@@ -25,100 +49,312 @@ class FileNode:
 
 
 class FolderTree:
-    """Represents a directory in the repository"""
+    """Represents a directory in the repository, children are keyed by name in insertion order"""
+    __slots__ = ("name", "sha", "files", "folders")
+
     def __init__(self, name: str, sha: str):
         self.name = name
         self.sha = sha
-        self.fileNodes: List[FileNode] = []
-        self.folderNodes: List['FolderTree'] = []
+        self.files: Dict[str, FileNode] = {}
+        self.folders: Dict[str, 'FolderTree'] = {}
+
+    @property
+    def fileNodes(self) -> List[FileNode]:
+        return list(self.files.values())
+
+    @property
+    def folderNodes(self) -> List['FolderTree']:
+        return list(self.folders.values())
 
     def find_folder(self, folder_name: str) -> Optional['FolderTree']:
         """Find a folder by name in the current folder's children"""
-        for folder in self.folderNodes:
-            if folder.name == folder_name:
-                return folder
-        return None
+        return self.folders.get(folder_name)
 
     def to_dict(self) -> dict:
         return {
             'name': self.name,
             'sha': self.sha,
             'type': 'folder',
-            'files': [file.to_dict() for file in self.fileNodes],
-            'folders': [folder.to_dict() for folder in self.folderNodes]
+            'files': [file.to_dict() for file in self.files.values()],
+            'folders': [folder.to_dict() for folder in self.folders.values()]
         }
 
 
 class RepoTree:
-    """Manages the entire repository tree structure"""
-    def __init__(self, gh: GHService, cache: Redis, repo_url: str):
+    """
+    Manages the entire repository tree structure.
+    The tree is the one of commit `ref` (the default branch head when None), loaded on first use.
+    Cache entries are keyed by tree SHA, so every commit sharing a tree shares the entry and a
+    push never serves a stale tree. A tree loaded from the cache stays in its compact form until
+    something needs the whole structure (rendering it), single paths are looked up in the
+    compact form directly.
+    """
+    def __init__(self, gh: GHService, cache: Redis, repo_url: str, blobs: BlobCache = blob_cache,
+                 ref: Optional[str] = None):
         self.gh = gh
         self.repo_url = repo_url
         self.cache = cache
-        self.root: Optional[FolderTree] = None
-        self.create_repo_tree()
+        self.blobs = blobs
+        self.ref = ref
+        self.tree_sha: Optional[str] = None
+        self.compact: Optional[CompactTree] = None
+        self._root: Optional[FolderTree] = None
+        self._root_lock = threading.Lock()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        # Every file and folder by its path from the repository root, the root itself is ""
+        self.paths: Dict[str, Union[FileNode, FolderTree]] = {}
+        # Files as of the PR head, they win over the tree in get_file_content
+        self.head_files: Dict[str, FileNode] = {}
+        self._renderer: Optional[TreeRenderer] = None
+        self._readable_lock = threading.Lock()
+
+    def set_ref(self, ref: Optional[str]) -> None:
+        """Use the tree of commit `ref` from now on, dropping a tree loaded for another commit"""
+        with self._load_lock:
+            if ref == self.ref:
+                return
+            self.ref = ref
+            self.tree_sha = None
+            self.compact = None
+            self._root = None
+            self.paths = {}
+            self._loaded = False
+        with self._readable_lock:
+            self._renderer = None
+
+    def load(self) -> None:
+        """Load the tree from the cache or GitHub, once"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.create_repo_tree()
+                self._loaded = True
+
+    @property
+    def root(self) -> Optional[FolderTree]:
+        """Root folder, materialized from the compact tree on first use"""
+        self.load()
+        if self._root is None and self.compact is not None:
+            with self._root_lock:
+                if self._root is None:
+                    self._root = self.build_tree_from_compact(self.compact)
+        return self._root
 
     def get_cache_key(self) -> str:
-        return f"{self.repo_url}_tree"
+        return f"repo_tree:{self.repo_url}:{self.tree_sha}"
+
+    def get_index_key(self) -> str:
+        """Sorted set of the cached tree SHAs of the repository, scored by last use"""
+        return f"repo_tree_index:{self.repo_url}"
+
+    def get_commit_key(self, commit_sha: str) -> str:
+        return f"repo_tree_commit:{self.repo_url}:{commit_sha}"
+
+    def get_commits_key(self) -> str:
+        """Sorted set of the commits whose tree was used, scored by last use: the ancestors to derive from"""
+        return f"repo_tree_commits:{self.repo_url}"
+
+    def resolve_tree_sha(self) -> str:
+        """Tree SHA of `ref`. Commits are immutable so their tree is remembered, a branch is resolved every time"""
+        if self.ref is None:
+            return self.gh.get_tree_sha(self.repo_url)
+        commit_key = self.get_commit_key(self.ref)
+        cached = self.cache.get(commit_key)
+        if cached:
+            return cached.decode() if isinstance(cached, bytes) else cached
+        tree_sha = self.gh.get_tree_sha(self.repo_url, self.ref)
+        self.cache.set(commit_key, tree_sha, ex=REPO_TREE_CACHE_TTL)
+        return tree_sha
+
+    def touch(self) -> None:
+        """Mark the tree as just used so it is the last one evicted"""
+        now = time.time()
+        pipe = self.cache.pipeline()
+        pipe.zadd(self.get_index_key(), {self.tree_sha: now})
+        pipe.expire(self.get_index_key(), REPO_TREE_CACHE_TTL)
+        pipe.expire(self.get_cache_key(), REPO_TREE_CACHE_TTL)
+        if self.ref is not None:
+            pipe.zadd(self.get_commits_key(), {self.ref: now})
+            pipe.expire(self.get_commits_key(), REPO_TREE_CACHE_TTL)
+        pipe.execute()
+
+    def evict_old_trees(self) -> None:
+        """Drop the least recently used trees of the repository beyond REPO_TREE_CACHE_MAX_PER_REPO"""
+        # Keep a few more commits than trees, several commits often share a tree
+        self.cache.zremrangebyrank(self.get_commits_key(), 0, -(2 * REPO_TREE_CACHE_MAX_PER_REPO + 1))
+        stale = self.cache.zrange(self.get_index_key(), 0, -(REPO_TREE_CACHE_MAX_PER_REPO + 1))
+        if not stale:
+            return
+        stale = [sha.decode() if isinstance(sha, bytes) else sha for sha in stale]
+        pipe = self.cache.pipeline()
+        pipe.delete(*[f"repo_tree:{self.repo_url}:{sha}" for sha in stale])
+        pipe.zrem(self.get_index_key(), *stale)
+        pipe.execute()
+        logging.info(f"Evicted {len(stale)} cached trees of {self.repo_url}")
+
+    def to_compact(self) -> CompactTree:
+        return CompactTree.from_entries(self._root.sha, (
+            (path, FOLDER, node.sha, None, None) if isinstance(node, FolderTree)
+            else (path, FILE, node.sha, node.size, node.blob_url)
+            for path, node in self.paths.items() if path
+        ))
 
     def save_to_cache(self) -> None:
         """Save the tree structure to Redis cache"""
-        if self.root:
-            tree_dict = self.root.to_dict()
-            self.cache.set(self.get_cache_key(), json.dumps(tree_dict))
+        if self._root:
+            self.cache.set(self.get_cache_key(), self.to_compact().encode(compress=REPO_TREE_CACHE_COMPRESS),
+                           ex=REPO_TREE_CACHE_TTL)
+            self.touch()
+            self.evict_old_trees()
 
-    def load_from_cache(self) -> Optional[dict]:
+    def load_from_cache(self) -> Optional[CompactTree]:
         """Load the tree structure from Redis cache"""
         cached_data = self.cache.get(self.get_cache_key())
-        if cached_data:
-            return json.loads(cached_data)
-        return None
-
-    def build_tree_from_dict(self, tree_dict: dict) -> FolderTree:
-        """Reconstruct tree structure from dictionary representation"""
-        folder = FolderTree(name=tree_dict['name'], sha=tree_dict['sha'])
-        
-        for file_dict in tree_dict.get('files', []):
-            file = FileNode(
-                name=file_dict['name'],
-                blob_url=file_dict['blob_url'],
-                sha=file_dict['sha'],
-                size=file_dict['size']
-            )
-            folder.fileNodes.append(file)
-        
-        for subfolder_dict in tree_dict.get('folders', []):
-            subfolder = self.build_tree_from_dict(subfolder_dict)
-            folder.folderNodes.append(subfolder)
-        
+        if not cached_data:
+            return None
+        try:
+            return CompactTree.decode(cached_data)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable cached tree of {self.repo_url}: {e}")
+            return None
+
+    def build_tree_from_compact(self, compact: CompactTree) -> FolderTree:
+        """Reconstruct tree structure from its compact form in one pass, indexing every node by path"""
+        root = FolderTree(name=self.repo_url, sha=compact.root_sha)
+        paths: Dict[str, Union[FileNode, FolderTree]] = {"": root}
+        nodes: List[Union[FileNode, FolderTree]] = []
+        for index in range(len(compact)):
+            parent_index = compact.parents[index]
+            parent = root if parent_index < 0 else nodes[parent_index]
+            path = compact.path(index)
+            name = path.rpartition("/")[2]
+            if compact.is_folder(index):
+                node = FolderTree(name=name, sha=compact.sha(index))
+                parent.folders[name] = node
+            else:
+                node = FileNode(name=name, blob_url=compact.blob_url(index), sha=compact.sha(index),
+                                size=compact.size(index))
+                parent.files[name] = node
+            nodes.append(node)
+            paths[path] = node
+        self.paths = paths
+        return root
+
+    def derive_from_ancestor(self) -> bool:
+        """
+        Build the tree of `ref` from the cached tree of a recently used ancestor commit plus the
+        files changed between them, instead of listing the whole tree again.
+        False when no candidate is a cached ancestor with a complete compare.
+        Folder SHAs of a derived tree are the ancestor's, only file entries are kept exact.
+        """
+        if not REPO_TREE_DERIVE or self.ref is None:
+            return False
+        candidates = self.cache.zrevrange(self.get_commits_key(), 0, REPO_TREE_DERIVE_CANDIDATES - 1)
+        for commit in candidates:
+            commit = commit.decode() if isinstance(commit, bytes) else commit
+            if commit == self.ref:
+                continue
+            base_tree_sha = self.cache.get(self.get_commit_key(commit))
+            if not base_tree_sha:
+                continue
+            base_tree_sha = base_tree_sha.decode() if isinstance(base_tree_sha, bytes) else base_tree_sha
+            cached_data = self.cache.get(f"repo_tree:{self.repo_url}:{base_tree_sha}")
+            base = CompactTree.decode(cached_data) if cached_data else None
+            if base is None:
+                continue
+            try:
+                comparison = self.gh.compare_commits(self.repo_url, commit, self.ref)
+                status, files = comparison.status, comparison.files
+            except Exception as e:
+                logging.warning(f"Could not compare {commit}...{self.ref} to derive the tree: {e}")
+                continue
+            # Only the files of an ancestor -> descendant compare turn the ancestor's tree into ours
+            if status not in ("ahead", "identical") or len(files) >= GH_COMPARE_MAX_FILES:
+                continue
+            self._root = self.build_tree_from_compact(base)
+            self._root.sha = self.tree_sha
+            self.apply_changes(files)
+            logging.info(f"Derived the tree of {self.repo_url}@{self.ref} from {commit} with {len(files)} changed files")
+            return True
+        return False
+
+    def apply_changes(self, files: List) -> None:
+        """Apply the files of a compare (PyGithub File objects) to the materialized tree"""
+        for file in files:
+            if file.status == "removed":
+                self._remove_path(file.filename)
+                continue
+            if file.status == "unchanged":
+                continue
+            if file.status == "renamed" and file.previous_filename:
+                self._remove_path(file.previous_filename)
+            self._put_file(file.filename, file.sha)
+
+    def _put_file(self, path: str, sha: str) -> None:
+        if isinstance(self.paths.get(path), FolderTree):
+            self._remove_path(path)
+        parent_path, _, name = path.rpartition("/")
+        parent = self._ensure_folder(parent_path, None)
+        file_node = FileNode(name=name, blob_url=self.gh.get_blob_url(self.repo_url, sha), sha=sha)
+        parent.files[name] = file_node
+        self.paths[path] = file_node
+
+    def _remove_path(self, path: str) -> None:
+        """Remove a file or folder, and the folders left empty by it since git has no empty folders"""
+        node = self.paths.pop(path, None)
+        if node is None:
+            return
+        if isinstance(node, FolderTree):
+            prefix = f"{path}/"
+            for child_path in [child_path for child_path in self.paths if child_path.startswith(prefix)]:
+                del self.paths[child_path]
+        parent_path, _, name = path.rpartition("/")
+        parent = self.paths.get(parent_path)
+        if not isinstance(parent, FolderTree):
+            return
+        parent.files.pop(name, None)
+        parent.folders.pop(name, None)
+        if parent_path and not parent.files and not parent.folders:
+            self._remove_path(parent_path)
+
+    def _ensure_folder(self, path: str, sha: Optional[str]) -> FolderTree:
+        """The folder at `path`, created with its missing parents when the listing skipped them"""
+        folder = self.paths.get(path)
+        if isinstance(folder, FolderTree):
+            return folder
+        parent_path, _, name = path.rpartition("/")
+        parent = self._ensure_folder(parent_path, sha)
+        folder = FolderTree(name=name, sha=sha)
+        parent.folders[name] = folder
+        self.paths[path] = folder
         return folder
 
     def create_repo_tree(self) -> None:
         """Create the repository tree structure"""
+        self.tree_sha = self.resolve_tree_sha()
         # Try loading from cache first
         cached_tree = self.load_from_cache()
         if cached_tree:
-            self.root = self.build_tree_from_dict(cached_tree)
+            self.compact = cached_tree
+            self.touch()
+            return
+
+        if self.derive_from_ancestor():
+            self.save_to_cache()
             return
 
-        # If not in cache, fetch from GitHub
-        repo_structure = self.gh.get_repo_file_structure(self.repo_url)
-        self.root = FolderTree(name=self.repo_url, sha=repo_structure.sha)
+        # If not in cache, fetch from GitHub. The listing is sorted by path so parents come
+        # before their children and each entry is placed with a single index lookup
+        repo_structure = self.gh.get_repo_file_structure(self.repo_url, self.tree_sha)
+        self._root = FolderTree(name=self.repo_url, sha=repo_structure.sha)
+        self.paths = {"": self._root}
 
         for file_entry in repo_structure.tree:
-            path_parts = file_entry.path.split("/")
-            current_folder = self.root
-
-            # Navigate through the path
-            for i, part in enumerate(path_parts[:-1]):
-                next_folder = current_folder.find_folder(part)
-                if not next_folder:
-                    next_folder = FolderTree(name=part, sha=file_entry.sha)
-                    current_folder.folderNodes.append(next_folder)
-                current_folder = next_folder
-
-            # Handle the last part of the path
-            last_part = path_parts[-1]
+            parent_path, _, last_part = file_entry.path.rpartition("/")
+            current_folder = self._ensure_folder(parent_path, file_entry.sha)
+
             if file_entry.type == "blob":
                 file_node = FileNode(
                     name=last_part,
@@ -126,46 +362,97 @@ class RepoTree:
                     sha=file_entry.sha,
                     size=file_entry.size
                 )
-                current_folder.fileNodes.append(file_node)
+                current_folder.files[last_part] = file_node
+                self.paths[file_entry.path] = file_node
             elif file_entry.type == "tree":
-                folder_node = FolderTree(name=last_part, sha=file_entry.sha)
-                current_folder.folderNodes.append(folder_node)
+                folder_node = self.paths.get(file_entry.path)
+                if isinstance(folder_node, FolderTree):
+                    folder_node.sha = file_entry.sha
+                else:
+                    folder_node = FolderTree(name=last_part, sha=file_entry.sha)
+                    current_folder.folders[last_part] = folder_node
+                    self.paths[file_entry.path] = folder_node
 
         # Save the newly created tree to cache
         self.save_to_cache()
 
-    def get_tree_readable_for_llm(self) -> str:
-        """Convert the tree structure to a string readable by LLM"""
-        def _convert_folder(folder: FolderTree, indent: int) -> str:
-            result = ""
-            for file_node in folder.fileNodes:
-                result += f"{' ' * (indent)}-{file_node.name}\n"
-            for subfolder in folder.folderNodes:
-                result += f"{' ' * (indent)}|{subfolder.name}\n"
-                result += _convert_folder(subfolder, indent + 1)
-            return result
+    def get_tree_readable_for_llm(self, focus_paths: Iterable[str] = (), max_tokens: Optional[int] = None,
+                                  count_tokens: Callable[[str], int] = estimate_tokens) -> str:
+        """
+        Convert the tree structure to a string readable by LLM. With a token budget the folders
+        around `focus_paths` are expanded first and the rest collapsed (see TreeRenderer).
+        Renders are memoized per tree SHA, focus paths and budget.
+        """
+        self.load()
+        key = (self.repo_url, self.tree_sha, tuple(sorted(set(focus_paths))), max_tokens)
+        readable = rendered_trees.get(key)
+        if readable is not None:
+            return readable
+        with self._readable_lock:
+            readable = rendered_trees.get(key)
+            if readable is None:
+                if self._renderer is None:
+                    self._renderer = TreeRenderer(self.get_tree(), count_tokens=count_tokens)
+                readable = self._renderer.render(key[2], max_tokens)
+                rendered_trees.set(key, readable)
+            return readable
 
-        return _convert_folder(self.get_tree(), 0)
+    def set_head_file(self, file_path: str, file_node: FileNode) -> None:
+        """Serve `file_path` from the PR head version instead of the default branch"""
+        self.head_files[file_path] = file_node
 
     def get_file_content(self, file_path: str) -> Optional[str]:
         """Fetch the content of a file in the repository"""
         print(f"Fetching file content for {file_path}")
-        path_parts = file_path.split("/")
-        current_folder = self.root
+        if file_path in self.head_files:
+            return self.get_file_node_content(self.head_files[file_path])
+
+        file_node = self.get_node(file_path)
+        if not isinstance(file_node, FileNode):
+            return None
+        return self.get_file_node_content(file_node)
 
-        # Navigate through the path
-        for _, part in enumerate(path_parts[:-1]):
-            next_folder = current_folder.find_folder(part)
-            if not next_folder:
+    def get_node(self, path: str) -> Optional[Union[FileNode, FolderTree]]:
+        """The file or folder at `path` relative to the repository root"""
+        path = path.strip("/")
+        if path.startswith("./"):
+            path = path[2:]
+        self.load()
+        if self._root is None and self.compact is not None and path:
+            index = self.compact.find(path)
+            if index is None:
                 return None
-            current_folder = next_folder
-
-        # Handle the last part of the path
-        last_part = path_parts[-1]
-        for file_node in current_folder.fileNodes:
-            if file_node.name == last_part:
-                return self.gh.get_file_content(file_node.blob_url)
-        return None
+            if not self.compact.is_folder(index):
+                return FileNode(name=self.compact.name(index), blob_url=self.compact.blob_url(index),
+                                sha=self.compact.sha(index), size=self.compact.size(index))
+        return self.paths.get(path) if self.root else None
+
+    def get_file_node_content(self, file_node: FileNode) -> Optional[str]:
+        """Fetch the content of a file node, going through the blob cache"""
+        if not file_node.sha:
+            return self.gh.get_file_content(file_node.blob_url)
+        content = self.blobs.get_or_fetch(file_node.sha, lambda: self.gh.get_blob(file_node.blob_url))
+        return blob_text(content)
+
+    def get_files_content(self, file_paths: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Content of many files at once, their blobs fetched together per repository (see GHService.get_blob_contents)"""
+        contents: Dict[str, Optional[str]] = {}
+        shas_by_repo: Dict[str, Dict[str, str]] = {}
+        for file_path in dict.fromkeys(file_paths):
+            file_node = self.head_files.get(file_path) or self.get_node(file_path)
+            if not isinstance(file_node, FileNode):
+                contents[file_path] = None
+                continue
+            # Head files of a PR from a fork are blobs of the fork
+            match = BLOB_URL.match(file_node.blob_url) if file_node.sha else None
+            if match is None:
+                contents[file_path] = self.get_file_node_content(file_node)
+                continue
+            shas_by_repo.setdefault(f"https://github.com/{match.group(1)}", {})[file_path] = file_node.sha
+        for repo_url, shas in shas_by_repo.items():
+            texts = self.gh.get_blob_contents(repo_url, shas.values(), blobs=self.blobs)
+            contents.update({file_path: texts[sha] for file_path, sha in shas.items()})
+        return contents
 
     def get_tree(self) -> Optional[FolderTree]:
         """Return the root of the tree structure"""
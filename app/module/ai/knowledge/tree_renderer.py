@@ -0,0 +1,178 @@
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from app.module.ai.knowledge.repo_tree import FolderTree
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 3 + 1
+
+
+class FolderInfo:
+    __slots__ = ("folder", "parent", "depth", "file_count")
+
+    def __init__(self, folder: "FolderTree", parent: Optional[str], depth: int):
+        self.folder = folder
+        self.parent = parent
+        self.depth = depth
+        # Files in the folder and every folder under it
+        self.file_count = len(folder.files)
+
+
+def _child_path(path: str, name: str) -> str:
+    return f"{path}/{name}" if path else name
+
+
+class TreeRenderer:
+    """
+    Renders a repository tree for the LLM ("-file", "|folder", one space of indent per level)
+    within a token budget. Folders are expanded nearest first from the folders of the focus
+    paths, or from the root when there are none. The focus paths and their ancestors are always
+    shown, then siblings and nearby folders while the budget lasts. Folders left collapsed show
+    how many files they hold. Built in time linear in the size of the tree.
+    """
+    def __init__(self, root: "FolderTree", count_tokens: Callable[[str], int] = estimate_tokens):
+        self.root = root
+        self.count_tokens = count_tokens
+        self.folders: Dict[str, FolderInfo] = {}
+        self._index()
+
+    def _index(self) -> None:
+        """Path, parent and depth of every folder, and the files under it, in one pass"""
+        order: List[str] = []
+        stack: List[Tuple[str, "FolderTree", Optional[str], int]] = [("", self.root, None, -1)]
+        while stack:
+            path, folder, parent, depth = stack.pop()
+            self.folders[path] = FolderInfo(folder, parent, depth)
+            order.append(path)
+            for name, subfolder in folder.folders.items():
+                stack.append((_child_path(path, name), subfolder, path, depth + 1))
+        # Children come after their parent in a pre-order, summing in reverse rolls counts up
+        for path in reversed(order):
+            info = self.folders[path]
+            if info.parent is not None:
+                self.folders[info.parent].file_count += info.file_count
+
+    def _entries(self, path: str) -> List[Tuple[str, str]]:
+        """(name, line) of the children of a folder, files first as get_tree_readable_for_llm always did"""
+        info = self.folders[path]
+        indent = " " * (info.depth + 1)
+        entries = [(name, f"{indent}-{name}") for name in info.folder.files]
+        entries += [(name, f"{indent}|{name} ({self.folders[_child_path(path, name)].file_count} files)")
+                    for name in info.folder.folders]
+        return entries
+
+    def _focus_folders(self, focus_paths: Iterable[str]) -> Tuple[Dict[str, Set[str]], List[str]]:
+        """
+        Folders on the way to each focus path with the children that must be shown in them,
+        and the folders the focus paths are in (or are), where expansion starts from.
+        """
+        required: Dict[str, Set[str]] = {}
+        sources: List[str] = []
+        for path in focus_paths:
+            path = path.strip("/")
+            parent, _, name = path.rpartition("/")
+            info = self.folders.get(parent)
+            if not path or info is None or (name not in info.folder.files and name not in info.folder.folders):
+                continue
+            if path in self.folders:
+                required.setdefault(path, set())
+                sources.append(path)
+            else:
+                sources.append(parent)
+            while True:
+                required.setdefault(parent, set()).add(name)
+                if not parent:
+                    break
+                parent, _, name = parent.rpartition("/")
+        return required, sources
+
+    def render(self, focus_paths: Iterable[str] = (), max_tokens: Optional[int] = None) -> str:
+        if max_tokens is None:
+            return "\n".join(self._lines(dict.fromkeys(self.folders))) + "\n"
+
+        # Shown children per expanded folder, None when all of them are
+        expanded: Dict[str, Optional[Set[str]]] = {}
+        remaining = max_tokens
+
+        def _cost(entries: List[Tuple[str, str]]) -> int:
+            return sum(self.count_tokens(line) + 1 for _, line in entries)
+
+        def _visible(path: str, parent: Optional[str]) -> bool:
+            if parent is None:
+                return True
+            if parent not in expanded:
+                return False
+            return expanded[parent] is None or path.rpartition("/")[2] in expanded[parent]
+
+        # The way to the focus paths first, only what must be shown
+        required, sources = self._focus_folders(focus_paths)
+        for path, names in required.items():
+            expanded[path] = set(names)
+            remaining -= _cost([entry for entry in self._entries(path) if entry[0] in names])
+
+        # Then whole folders by distance from the focus, starting with the siblings of the focus
+        # paths. Folders on the way to the focus are filled as far as the budget goes when they
+        # do not fit whole, others are left collapsed.
+        queue = deque(dict.fromkeys(sources or [""]))
+        seen = set(queue)
+        while queue and remaining > 0:
+            path = queue.popleft()
+            info = self.folders[path]
+            shown = expanded.get(path, set())
+            if shown is not None and _visible(path, info.parent):
+                entries = [entry for entry in self._entries(path) if entry[0] not in shown]
+                cost = _cost(entries)
+                if cost <= remaining:
+                    expanded[path] = None
+                    remaining -= cost
+                elif path in expanded:
+                    for name, line in entries:
+                        if self.count_tokens(line) + 1 > remaining:
+                            break
+                        shown.add(name)
+                        remaining -= self.count_tokens(line) + 1
+            neighbors = [info.parent] if info.parent is not None else []
+            if path in expanded:
+                neighbors += [_child_path(path, name) for name in info.folder.folders]
+            for neighbor in neighbors:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+        return "\n".join(self._lines(expanded)) + "\n"
+
+    def _lines(self, expanded: Dict[str, Optional[Set[str]]]) -> List[str]:
+        lines: List[str] = []
+        if "" not in expanded:
+            return [f"|{self.root.name} ({self.folders[''].file_count} files)"]
+        # Depth first without recursion: items are lines to emit or folders to open, popped in order
+        stack: List[Tuple[bool, str]] = [(True, "")]
+        while stack:
+            is_folder, item = stack.pop()
+            if not is_folder:
+                lines.append(item)
+                continue
+            info = self.folders[item]
+            shown = expanded[item]
+            indent = " " * (info.depth + 1)
+            children: List[Tuple[bool, str]] = []
+            hidden_files = hidden_folders = 0
+            for name in info.folder.files:
+                if shown is None or name in shown:
+                    children.append((False, f"{indent}-{name}"))
+                else:
+                    hidden_files += 1
+            for name in info.folder.folders:
+                path = _child_path(item, name)
+                if shown is not None and name not in shown:
+                    hidden_folders += 1
+                elif path in expanded:
+                    children += [(False, f"{indent}|{name}"), (True, path)]
+                else:
+                    children.append((False, f"{indent}|{name} ({self.folders[path].file_count} files)"))
+            hidden = [f"{count} more {kind}" for count, kind in ((hidden_files, "files"), (hidden_folders, "folders")) if count]
+            if hidden:
+                children.append((False, f"{indent}... {', '.join(hidden)}"))
+            stack.extend(reversed(children))
+        return lines
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from redis import Redis
+from dotenv import load_dotenv
+
+from app.db.redis_app import redis_app
+from app.module.utils.lru import LRUCache
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+# Total bytes of responses kept in Redis before the least recently used are evicted
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+LLM_CACHE_MAX_ENTRY_BYTES = int(os.getenv("LLM_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", 512))
+
+# KEYS: entry, index, sizes, bytes. ARGV: key, response, ttl, now, size.
+# Replaces the entry and moves the byte total by the change of its size in one step, so
+# concurrent stores of the same key cannot both count their size
+STORE_SCRIPT = """
+local previous = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0')
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[5])
+return redis.call('INCRBY', KEYS[4], tonumber(ARGV[5]) - previous)
+"""
+
+# KEYS: index, sizes, bytes. ARGV: entry key prefix, max bytes, count.
+# Forgets the entries of the `count` coldest whose TTL already expired (their bytes still count
+# in the total), then drops up to `count` least recently used entries while the total is over
+# max bytes. Returns the total. Popped entries that already expired are subtracted the same way.
+EVICT_SCRIPT = """
+local max_bytes = tonumber(ARGV[2])
+local count = tonumber(ARGV[3])
+local freed = 0
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, count - 1)) do
+  if redis.call('EXISTS', ARGV[1] .. member) == 0 then
+    freed = freed + tonumber(redis.call('HGET', KEYS[2], member) or '0')
+    redis.call('HDEL', KEYS[2], member)
+    redis.call('ZREM', KEYS[1], member)
+  end
+end
+local total = redis.call('DECRBY', KEYS[3], freed)
+while total > max_bytes and count > 0 do
+  local oldest = redis.call('ZPOPMIN', KEYS[1])
+  if #oldest == 0 then
+    break
+  end
+  local member = oldest[1]
+  local size = tonumber(redis.call('HGET', KEYS[2], member) or '0')
+  redis.call('DEL', ARGV[1] .. member)
+  redis.call('HDEL', KEYS[2], member)
+  total = redis.call('DECRBY', KEYS[3], size)
+  count = count - 1
+end
+return total
+"""
+
+
+class LLMCache:
+    """
+    Content addressed cache of LLM responses.
+    An in-process LRU sits in front of a Redis tier shared by every worker.
+    """
+    PREFIX = "llm_cache"
+
+    def __init__(self, cache: Redis, ttl: int = LLM_CACHE_TTL, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = LLM_CACHE_MAX_ENTRY_BYTES, memory_items: int = LLM_CACHE_MEMORY_ITEMS):
+        self.cache = cache
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.memory = LRUCache(max_items=memory_items)
+        self.stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, messages: list, **kwargs) -> str:
+        """Stable hash of everything that influences the model output"""
+        payload = json.dumps(
+            {"model": model, "messages": messages, **kwargs},
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self.PREFIX}:{key}"
+
+    def _count(self, stat: str) -> None:
+        with self._stats_lock:
+            self.stats[stat] += 1
+        try:
+            self.cache.hincrby(f"{self.PREFIX}:stats", stat, 1)
+        except Exception as e:
+            logging.debug(f"Failed to update llm cache stats: {e}")
+
+    def get(self, key: str) -> Optional[Any]:
+        response = self.memory.get(key)
+        if response is not None:
+            self._count("memory_hits")
+            return response
+        try:
+            raw = self.cache.get(self._entry_key(key))
+            if raw is not None:
+                response = json.loads(raw)
+                self.memory.set(key, response)
+                # Touch the entry so size based eviction drops the coldest responses first
+                self.cache.zadd(f"{self.PREFIX}:index", {key: time.time()}, xx=True)
+                self._count("redis_hits")
+                return response
+        except Exception as e:
+            logging.error(f"Failed to read llm cache entry {key}: {e}")
+        self._count("misses")
+        return None
+
+    def set(self, key: str, response: Any) -> None:
+        self.memory.set(key, response)
+        try:
+            raw = json.dumps(response, default=str)
+            size = len(raw)
+            if size > self.max_entry_bytes:
+                return
+            total = self.cache.eval(
+                STORE_SCRIPT, 4, self._entry_key(key), f"{self.PREFIX}:index", f"{self.PREFIX}:sizes",
+                f"{self.PREFIX}:bytes", key, raw, self.ttl, time.time(), size,
+            )
+            self._count("stores")
+            if int(total) > self.max_bytes:
+                self._evict()
+        except Exception as e:
+            logging.error(f"Failed to store llm cache entry {key}: {e}")
+
+    def _evict(self, batch: int = 64) -> None:
+        """
+        Drop least recently used entries until the Redis tier fits in max_bytes, `batch` per
+        script run so Redis is never blocked for long. Expired entries are only looked for at the
+        cold end of the index, where eviction would reach them first anyway.
+        """
+        while True:
+            total = self.cache.eval(EVICT_SCRIPT, 3, f"{self.PREFIX}:index", f"{self.PREFIX}:sizes",
+                                    f"{self.PREFIX}:bytes", f"{self.PREFIX}:", self.max_bytes, batch)
+            if int(total) <= self.max_bytes or not self.cache.zcard(f"{self.PREFIX}:index"):
+                return
+
+    def get_stats(self) -> dict:
+        """Hit/miss counters of this process and of the whole shared cache"""
+        try:
+            shared = {k.decode(): int(v) for k, v in self.cache.hgetall(f"{self.PREFIX}:stats").items()}
+        except Exception as e:
+            logging.error(f"Failed to read llm cache stats: {e}")
+            shared = {}
+        with self._stats_lock:
+            return {"process": dict(self.stats), "shared": shared}
+
+
+llm_cache = LLMCache(redis_app) if LLM_CACHE_ENABLED else None
@@ -1,14 +1,195 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
 import ollama
+from typing import Callable, Optional
 from langchain_ollama.llms import OllamaLLM as ollama_llm
 
+from dotenv import load_dotenv
+
+from app.module.ai.llm.llm_cache import LLMCache, llm_cache
+
+load_dotenv()
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1")
+# Max in-flight requests this process sends to a single Ollama host
+OLLAMA_HOST_CONCURRENCY = int(os.getenv("OLLAMA_HOST_CONCURRENCY", 2))
+# How long Ollama keeps the model (and its prompt cache) loaded after a request, -1 pins it
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Load the model and prefill the agent prompt prefix when a worker process starts
+OLLAMA_WARM_UP = os.getenv("OLLAMA_WARM_UP", "true").lower() == "true"
+# Seconds a request may wait on Ollama (to connect, or between two chunks of a response), 0 disables it
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", 300))
+
+# Request arguments that do not change the answer, left out of the response cache key
+_NON_OUTPUT_KWARGS = ("keep_alive",)
+# done_reason of a streamed response cut short by `stop_when`, before Ollama's final chunk
+DONE_ABANDONED = "abandoned"
+
+class LLMCancelled(Exception):
+    """The caller gave up on the response while it was generated"""
+
+
+_host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def get_host_semaphore(host: str, limit: int = OLLAMA_HOST_CONCURRENCY) -> threading.BoundedSemaphore:
+    """Return the process wide semaphore guarding requests to an Ollama host"""
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(max(1, limit))
+            _host_semaphores[host] = semaphore
+        return semaphore
+
 
 class OllamaLLM():
-    def __init__(self):
-        self.model_name = "llama3.1"
-        pass
-    
+    def __init__(self, host: str = OLLAMA_HOST, model_name: str = OLLAMA_MODEL,
+                 cache: Optional[LLMCache] = llm_cache, keep_alive: Optional[str] = OLLAMA_KEEP_ALIVE):
+        self.model_name = model_name
+        self.host = host
+        self.cache = cache
+        self.keep_alive = keep_alive
+        # Without a timeout a hung request holds its host slot and its thread forever
+        self.client = ollama.Client(host=host, timeout=OLLAMA_REQUEST_TIMEOUT or None)
+        self.semaphore = get_host_semaphore(host)
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
     def get_langchain_ollama(self):
-        return ollama_llm(model=self.model_name)
-    
+        return ollama_llm(model=self.model_name, base_url=self.host)
+
+    def chat(self, messages: list, on_token: Optional[Callable[[str], None]] = None,
+             stop_when: Optional[Callable[[str], bool]] = None,
+             cancelled: Optional[Callable[[], bool]] = None, **kwargs):
+        """
+        Run a chat completion, waiting for a free slot on the host first.
+        Identical requests are answered from the response cache.
+        When `on_token` or `stop_when` is given the response is streamed, each chunk is passed to
+        `on_token` and generation is abandoned as soon as `stop_when(chunk)` returns True.
+        An abandoned response has `done_reason` DONE_ABANDONED and is only served from the cache
+        to callers that would have abandoned it too.
+        With `cancelled` the response is streamed as well, and LLMCancelled is raised (freeing the
+        host slot) as soon as `cancelled()` returns True.
+        """
+        cache_key = None
+        if self.cache is not None and not kwargs.get("stream"):
+            cache_kwargs = {key: value for key, value in kwargs.items() if key not in _NON_OUTPUT_KWARGS}
+            cache_key = LLMCache.make_key(self.model_name, messages, **cache_kwargs)
+            cached = self.cache.get(cache_key)
+            if cached is not None and (stop_when or cached.get("done_reason") != DONE_ABANDONED):
+                if on_token:
+                    on_token(cached["message"]["content"])
+                return cached
+
+        if self.keep_alive is not None:
+            kwargs.setdefault("keep_alive", self.keep_alive)
+        with self.semaphore:
+            if cancelled and cancelled():
+                raise LLMCancelled(f"Request to {self.model_name} cancelled before it was sent")
+            if on_token or stop_when or cancelled:
+                response = self._stream_chat(messages, on_token, stop_when, cancelled, **kwargs)
+            else:
+                response = self.client.chat(model=self.model_name, messages=messages, **kwargs)
+        if response.get("done_reason") == DONE_ABANDONED:
+            # Timings only come with the final chunk, counting the call would skew the averages
+            with self._stats_lock:
+                self.stats["abandoned"] += 1
+            logging.info(f"Ollama {self.model_name}: stream abandoned early, no timings for this call")
+        else:
+            self._record_timings(response)
+
+        if cache_key is not None:
+            self.cache.set(cache_key, dict(response))
+        return response
+
+    def _stream_chat(self, messages: list, on_token: Optional[Callable[[str], None]] = None,
+                     stop_when: Optional[Callable[[str], bool]] = None,
+                     cancelled: Optional[Callable[[], bool]] = None, **kwargs) -> dict:
+        """
+        Stream a chat completion and assemble it into a regular response. A stream stopped by
+        `stop_when` never gets Ollama's final chunk (the one carrying `done` and the timings),
+        it is returned with `done` False and `done_reason` DONE_ABANDONED. `cancelled` is checked
+        on every chunk, the stream is closed and LLMCancelled raised once it returns True.
+        """
+        content = []
+        last_chunk = {}
+        abandoned = False
+        stream = self.client.chat(model=self.model_name, messages=messages, stream=True, **kwargs)
+        try:
+            for chunk in stream:
+                if cancelled and cancelled():
+                    raise LLMCancelled(f"Generation of {self.model_name} cancelled after {len(content)} chunks")
+                token = chunk["message"]["content"]
+                content.append(token)
+                if on_token:
+                    on_token(token)
+                last_chunk = chunk
+                if stop_when and stop_when(token):
+                    abandoned = not chunk.get("done")
+                    break
+        finally:
+            # Closing the stream drops the connection, which makes Ollama stop generating
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+        response = {**dict(last_chunk), "message": {"role": "assistant", "content": "".join(content)}}
+        if abandoned:
+            response.update(done=False, done_reason=DONE_ABANDONED)
+        return response
+
+    def warm_up(self, messages: list, options: Optional[dict] = None) -> None:
+        """
+        Load the model and prefill `messages` so the first real requests sharing that prefix hit
+        Ollama's prompt cache. `options` must hold the same num_ctx as the real requests,
+        any other context size makes Ollama reload the model.
+        """
+        started = time.perf_counter()
+        with self.semaphore:
+            response = self.client.chat(
+                model=self.model_name,
+                messages=messages,
+                keep_alive=self.keep_alive,
+                options={**(options or {}), "num_predict": 1},
+            )
+        self._record_timings(response)
+        logging.info(f"Warmed up {self.model_name} on {self.host} in {time.perf_counter() - started:.3f}s")
+
+    def _record_timings(self, response) -> None:
+        """
+        Track prefill (prompt_eval) and model load time per call. With a warm prompt cache
+        prompt_eval_count only counts the tokens after the reused prefix.
+        """
+        try:
+            prompt_tokens = response.get("prompt_eval_count") or 0
+            prompt_seconds = (response.get("prompt_eval_duration") or 0) / 1e9
+            load_seconds = (response.get("load_duration") or 0) / 1e9
+            eval_seconds = (response.get("eval_duration") or 0) / 1e9
+        except Exception as e:
+            logging.debug(f"No timings in Ollama response: {e}")
+            return
+        with self._stats_lock:
+            self.stats["calls"] += 1
+            self.stats["prompt_eval_count"] += prompt_tokens
+            self.stats["prompt_eval_seconds"] += prompt_seconds
+            self.stats["eval_seconds"] += eval_seconds
+            self.stats["load_seconds"] += load_seconds
+        logging.info(
+            f"Ollama {self.model_name}: prefill {prompt_tokens} tokens in {prompt_seconds:.3f}s, "
+            f"generation {eval_seconds:.3f}s, load {load_seconds:.3f}s"
+        )
+
+    def get_stats(self) -> dict:
+        """
+        Prefill, generation and load time summed over the calls made by this client. Abandoned
+        streams have no timings, they are counted apart and not in `calls`.
+        """
+        with self._stats_lock:
+            return dict(self.stats)
+
     def get_ollama_ollama_chat(self , **kwargs):
-        return ollama.chat(model=self.model_name , **kwargs)
\ No newline at end of file
+        return self.chat(**kwargs)
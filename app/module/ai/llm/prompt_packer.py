@@ -0,0 +1,180 @@
+import logging
+import os
+from typing import List
+
+import tiktoken
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+from app.module.pr.pr_diff import parse_hunks
+
+load_dotenv()
+
+# Max tokens of diff content sent in one request
+PROMPT_CONTENT_TOKENS = int(os.getenv("PROMPT_CONTENT_TOKENS", 3000))
+# Tokens kept free for tool results and the answer on top of prefix + content
+PROMPT_RESERVE_TOKENS = int(os.getenv("PROMPT_RESERVE_TOKENS", 3072))
+PROMPT_MAX_FILES_PER_PACK = int(os.getenv("PROMPT_MAX_FILES_PER_PACK", 8))
+PROMPT_MIN_NUM_CTX = int(os.getenv("PROMPT_MIN_NUM_CTX", 2048))
+PROMPT_MAX_NUM_CTX = int(os.getenv("PROMPT_MAX_NUM_CTX", 16384))
+# Give every request the num_ctx of a full pack, so Ollama never reloads the model (and drops its
+# prompt cache) because two requests asked for different context sizes
+PROMPT_PIN_NUM_CTX = os.getenv("PROMPT_PIN_NUM_CTX", "true").lower() == "true"
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken, a close enough proxy for the llama3 tokenizer"""
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        try:
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            # The BPE file is downloaded on first use, fall back to an estimate when offline
+            logging.error(f"Failed to load tiktoken encoding {encoding_name}: {e}")
+            self.encoding = None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is None:
+            return len(text) // 3 + 1
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text down to max_tokens, marking that it was cut"""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is None:
+            return text[:max_tokens * 3] + "\n...[truncated]"
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens]) + "\n...[truncated]"
+
+
+class PromptPart(BaseModel):
+    file_path: str
+    content: str
+    tokens: int
+    part: int = 1
+    parts: int = 1
+
+
+class PromptPack(BaseModel):
+    parts: List[PromptPart]
+    tokens: int
+    num_ctx: int
+
+    @property
+    def file_paths(self) -> List[str]:
+        return list(dict.fromkeys(part.file_path for part in self.parts))
+
+    def render(self) -> str:
+        """Build the user input of the agent for every file part in this pack"""
+        sections = []
+        for part in self.parts:
+            label = part.file_path if part.parts == 1 else f"{part.file_path} (part {part.part}/{part.parts})"
+            sections.append(f"file_path: {label}\nfile_content:\n{part.content}")
+        text = "\n\n".join(sections)
+        if len(self.file_paths) > 1:
+            text = (
+                f"Review each of the following {len(self.file_paths)} files. "
+                "Call final_answer_tool once, with `file` being a list holding one entry per file_path.\n\n"
+                + text
+            )
+        return text
+
+
+class PromptPacker:
+    """
+    Turns PR file patches into as few LLM requests as possible without truncating them.
+    Oversized patches are split on hunk boundaries and small ones are bin-packed together,
+    each request getting a num_ctx sized for its prefix, content and reserve.
+    """
+    def __init__(self, counter: TokenCounter, prefix_tokens: int,
+                 content_tokens: int = PROMPT_CONTENT_TOKENS,
+                 reserve_tokens: int = PROMPT_RESERVE_TOKENS,
+                 max_files_per_pack: int = PROMPT_MAX_FILES_PER_PACK,
+                 pin_num_ctx: bool = PROMPT_PIN_NUM_CTX):
+        self.counter = counter
+        self.prefix_tokens = prefix_tokens
+        self.content_tokens = content_tokens
+        self.reserve_tokens = reserve_tokens
+        self.max_files_per_pack = max_files_per_pack
+        self.pin_num_ctx = pin_num_ctx
+
+    def get_num_ctx(self, content_tokens: int) -> int:
+        """
+        Context size for a request, rounded up to a power of two so that requests
+        share a handful of sizes (Ollama reloads the model whenever num_ctx changes).
+        """
+        needed = self.prefix_tokens + content_tokens + self.reserve_tokens
+        num_ctx = PROMPT_MIN_NUM_CTX
+        while num_ctx < needed and num_ctx < PROMPT_MAX_NUM_CTX:
+            num_ctx *= 2
+        return min(num_ctx, PROMPT_MAX_NUM_CTX)
+
+    def split(self, file_path: str, patch: str) -> List[PromptPart]:
+        """Split a patch into parts that each fit the content budget"""
+        tokens = self.counter.count(patch)
+        if tokens <= self.content_tokens:
+            return [PromptPart(file_path=file_path, content=patch, tokens=tokens)]
+
+        chunks, current, current_tokens = [], [], 0
+        for hunk in parse_hunks(patch) or []:
+            for piece in self._split_hunk(hunk.to_patch()):
+                piece_tokens = self.counter.count(piece)
+                if current and current_tokens + piece_tokens > self.content_tokens:
+                    chunks.append(("\n".join(current), current_tokens))
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += piece_tokens
+        if current:
+            chunks.append(("\n".join(current), current_tokens))
+        if not chunks:
+            chunks = [(piece, self.counter.count(piece)) for piece in self._split_hunk(patch)]
+
+        return [
+            PromptPart(file_path=file_path, content=content, tokens=chunk_tokens, part=index + 1, parts=len(chunks))
+            for index, (content, chunk_tokens) in enumerate(chunks)
+        ]
+
+    def _split_hunk(self, text: str) -> List[str]:
+        """Last resort for a single hunk above the budget: split it on line boundaries"""
+        if self.counter.count(text) <= self.content_tokens:
+            return [text]
+        pieces, current, current_tokens = [], [], 0
+        for line in text.split("\n"):
+            line_tokens = self.counter.count(line) + 1
+            if current and current_tokens + line_tokens > self.content_tokens:
+                pieces.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current:
+            pieces.append("\n".join(current))
+        return pieces
+
+    def pack(self, path_and_content: List[tuple[str, str]]) -> List[PromptPack]:
+        """First fit decreasing bin packing of every file part into requests"""
+        order = {file_path: index for index, (file_path, _) in enumerate(path_and_content)}
+        parts = [part for file_path, patch in path_and_content for part in self.split(file_path, patch)]
+        parts.sort(key=lambda part: part.tokens, reverse=True)
+
+        bins: List[List[PromptPart]] = []
+        bin_tokens: List[int] = []
+        for part in parts:
+            for index, parts_in_bin in enumerate(bins):
+                if (bin_tokens[index] + part.tokens <= self.content_tokens
+                        and len(parts_in_bin) < self.max_files_per_pack):
+                    parts_in_bin.append(part)
+                    bin_tokens[index] += part.tokens
+                    break
+            else:
+                bins.append([part])
+                bin_tokens.append(part.tokens)
+
+        return [
+            PromptPack(
+                parts=sorted(parts_in_bin, key=lambda part: (order[part.file_path], part.part)),
+                tokens=tokens,
+                num_ctx=self.get_num_ctx(max(tokens, self.content_tokens) if self.pin_num_ctx else tokens),
+            )
+            for parts_in_bin, tokens in zip(bins, bin_tokens)
+        ]
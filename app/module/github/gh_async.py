@@ -0,0 +1,301 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, Coroutine, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from app.db.redis_app import close_loop_redis_client
+from app.module.github.gh_http_cache import HTTPCache, gh_http_cache
+from app.module.github.gh_rate_limit import BULK, INTERACTIVE, RateLimiter, gh_rate_limiter
+
+load_dotenv()
+
+GH_API_URL = os.getenv("GH_API_URL", "https://api.github.com")
+GH_HTTP_TIMEOUT = float(os.getenv("GH_HTTP_TIMEOUT", 30))
+GH_HTTP_CONNECT_TIMEOUT = float(os.getenv("GH_HTTP_CONNECT_TIMEOUT", 5))
+# Connections of the pool shared by every request of the process (per event loop)
+GH_HTTP_MAX_CONNECTIONS = int(os.getenv("GH_HTTP_MAX_CONNECTIONS", 100))
+GH_HTTP_MAX_KEEPALIVE = int(os.getenv("GH_HTTP_MAX_KEEPALIVE", 20))
+GH_HTTP2 = os.getenv("GH_HTTP2", "true").lower() == "true"
+# Retries of a request failing with a transport error, a 5xx, 429 or a rate limited 403
+GH_HTTP_RETRIES = int(os.getenv("GH_HTTP_RETRIES", 3))
+# Exponential backoff between retries starts here (seconds), Retry-After wins when GitHub sends it
+GH_HTTP_BACKOFF = float(os.getenv("GH_HTTP_BACKOFF", 0.5))
+GH_HTTP_BACKOFF_MAX = float(os.getenv("GH_HTTP_BACKOFF_MAX", 60))
+
+try:
+    # httpx only speaks HTTP/2 with the h2 package installed
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Content with a NUL byte in its first 8000 bytes is binary, the heuristic git uses
+BINARY_SNIFF_BYTES = 8000
+
+# One pooled client per event loop, httpx clients cannot be shared between loops
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+# Event loop running the requests of synchronous callers, by process so a forked worker starts its own
+_background: Optional[Tuple[int, asyncio.AbstractEventLoop]] = None
+_background_lock = threading.Lock()
+
+
+def shared_client() -> httpx.AsyncClient:
+    """The pooled client of the running event loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=GH_API_URL,
+            http2=GH_HTTP2 and HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(GH_HTTP_TIMEOUT, connect=GH_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=GH_HTTP_MAX_CONNECTIONS, max_keepalive_connections=GH_HTTP_MAX_KEEPALIVE),
+            headers={"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"},
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_shared_client() -> None:
+    """Close the pooled client of the running event loop (and its Redis client), on application shutdown"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+    await close_loop_redis_client()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _background
+    with _background_lock:
+        if _background is None or _background[0] != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="gh-http", daemon=True).start()
+            _background = (os.getpid(), loop)
+        return _background[1]
+
+
+def is_binary(content: bytes) -> bool:
+    return b"\0" in content[:BINARY_SNIFF_BYTES]
+
+
+def run_sync(coroutine: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine of the client from synchronous code (Celery tasks, agent threads) and wait for it.
+    Every caller of the process shares one background event loop, and with it one connection pool.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop()).result(timeout)
+
+
+class GHAsyncClient:
+    """
+    GitHub REST calls on the pooled httpx client of the running event loop (keep-alive, HTTP/2
+    when h2 is installed, timeouts). Idempotent reads are retried with exponential backoff and
+    jitter on transport errors, 5xx, 429 and rate limited 403 answers. JSON reads go through the
+    conditional request cache when there is one, and every request waits for the rate limiter
+    of its token at its priority (`priority` unless given, blobs are always bulk). Methods return
+    the JSON payloads of the API, the shape FastAPI returns as is. Requests are counted in
+    `stats` (the counters of the token in the client pool) when given.
+    """
+    def __init__(self, gh_token: Optional[str] = None, retries: int = GH_HTTP_RETRIES,
+                 cache: Optional[HTTPCache] = gh_http_cache, limiter: Optional[RateLimiter] = gh_rate_limiter,
+                 priority: str = INTERACTIVE, stats=None):
+        if not gh_token:
+            gh_token = os.getenv("GH_TOKEN_TEST")
+        self.headers = {"Authorization": f"Bearer {gh_token}"} if gh_token else {}
+        self.retries = retries
+        self.cache = cache
+        self.limiter = limiter
+        self.priority = priority
+        self.scope = HTTPCache.scope(gh_token)
+        self.stats = stats
+
+    def _count(self, stat: str, amount: float = 1) -> None:
+        if self.stats is not None:
+            self.stats.count(stat, amount)
+
+    @staticmethod
+    def _repo_path(repo_url: str) -> str:
+        return repo_url.replace("https://github.com/", "")
+
+    @staticmethod
+    def _is_rate_limited(response: httpx.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        # Primary (remaining 0) and secondary (Retry-After) rate limits answer 403
+        return response.status_code == 403 and (
+            "Retry-After" in response.headers or response.headers.get("X-RateLimit-Remaining") == "0"
+        )
+
+    @classmethod
+    def _should_retry(cls, response: httpx.Response) -> bool:
+        return response.status_code in RETRY_STATUS or cls._is_rate_limited(response)
+
+    @staticmethod
+    def _backoff(attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            try:
+                if "Retry-After" in response.headers:
+                    return min(GH_HTTP_BACKOFF_MAX, float(response.headers["Retry-After"]))
+                if response.headers.get("X-RateLimit-Remaining") == "0":
+                    return min(GH_HTTP_BACKOFF_MAX, max(0.0, float(response.headers["X-RateLimit-Reset"]) - time.time()))
+            except (KeyError, ValueError):
+                pass
+        delay = min(GH_HTTP_BACKOFF_MAX, GH_HTTP_BACKOFF * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def request(self, method: str, url: str, priority: Optional[str] = None, stream: bool = False,
+                      **kwargs) -> httpx.Response:
+        """
+        Send a request (path relative to the API or absolute URL), paced and retried as described above.
+        With `stream` the body is not read, the caller reads it and closes the response.
+        """
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                self._count("wait_seconds", await self.limiter.acquire(self.scope, priority or self.priority))
+            if attempt:
+                self._count("retries")
+            self._count("requests")
+            try:
+                client = shared_client()
+                response = await client.send(client.build_request(method, url, headers=headers, **kwargs), stream=stream)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    self._count("errors")
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(f"GitHub {method} {url} failed ({e!r}), retrying in {delay:.2f}s")
+            else:
+                retry = self._should_retry(response)
+                delay = self._backoff(attempt, response) if retry else 0.0
+                if self._is_rate_limited(response):
+                    self._count("rate_limited")
+                if self.limiter is not None:
+                    # A rate limited answer pauses the token for every worker, not only this request
+                    await self.limiter.observe(self.scope, response, delay if self._is_rate_limited(response) else None)
+                if attempt == self.retries or not retry:
+                    if response.is_error:
+                        self._count("errors")
+                        await response.aclose()
+                    if response.status_code != 304:
+                        response.raise_for_status()
+                    return response
+                await response.aclose()
+                logging.warning(f"GitHub {method} {url} answered {response.status_code}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, params: Optional[dict] = None) -> httpx.Response:
+        """GET a JSON resource, revalidating the cached copy instead of downloading it again"""
+        if self.cache is None:
+            return await self.request("GET", url, params=params)
+        request = shared_client().build_request("GET", url, params=params)
+        key = f"{request.url} {request.headers.get('Accept')}"
+        cached = await self.cache.get(self.scope, key)
+        if cached is not None and self.cache.is_immutable(str(request.url)):
+            await self.cache.count("hits")
+            self._count("cache_hits")
+            return httpx.Response(200, headers=cached.headers, content=cached.body, request=request)
+
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        response = await self.request("GET", request.url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            await self.cache.count("revalidated")
+            self._count("not_modified")
+            await self.cache.touch(self.scope, key)
+            return httpx.Response(200, headers=cached.headers, content=cached.body, request=response.request)
+        await self.cache.count("misses" if cached is None else "changed")
+        await self.cache.set(self.scope, key, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                             dict(response.headers), response.content)
+        return response
+
+    async def get_json(self, url: str, params: Optional[dict] = None) -> Any:
+        return (await self.get(url, params=params)).json()
+
+    async def get_paginated(self, url: str, params: Optional[dict] = None) -> List[Any]:
+        """Every item of a paginated list, following the Link headers"""
+        items: List[Any] = []
+        next_url: Optional[str] = url
+        while next_url:
+            response = await self.get(next_url, params=params)
+            items.extend(response.json())
+            # The next link already carries the query
+            next_url, params = response.links.get("next", {}).get("url"), None
+        return items
+
+    async def get_repo_meta(self, repo_url: str) -> dict:
+        """Fetch metadata for a repository."""
+        logging.info(f"Fetching repo metadata for {repo_url}")
+        return await self.get_json(f"/repos/{self._repo_path(repo_url)}")
+
+    async def get_pr_meta(self, repo_url: str, pr_number: int) -> dict:
+        """Fetch metadata for a pull request."""
+        logging.info(f"Fetching PR metadata for {repo_url}#{pr_number}")
+        return await self.get_json(f"/repos/{self._repo_path(repo_url)}/pulls/{pr_number}")
+
+    async def get_pr_files(self, repo_url: str, pr_number: int) -> List[dict]:
+        """Fetch files changed in a pull request, every page of them."""
+        logging.info(f"Fetching PR files for {repo_url}#{pr_number}")
+        return await self.get_paginated(f"/repos/{self._repo_path(repo_url)}/pulls/{pr_number}/files",
+                                        params={"per_page": 100})
+
+    async def get_branch(self, repo_url: str, branch: str) -> dict:
+        return await self.get_json(f"/repos/{self._repo_path(repo_url)}/branches/{branch}")
+
+    async def get_git_commit(self, repo_url: str, sha: str) -> dict:
+        return await self.get_json(f"/repos/{self._repo_path(repo_url)}/git/commits/{sha}")
+
+    async def compare(self, repo_url: str, base: str, head: str) -> dict:
+        return await self.get_json(f"/repos/{self._repo_path(repo_url)}/compare/{base}...{head}")
+
+    async def get_tree(self, repo_url: str, sha: str, recursive: bool = True) -> dict:
+        """Fetch a git tree, with every entry under it when recursive (unless GitHub truncates it)."""
+        logging.info(f"Fetching tree {sha} of {repo_url}")
+        return await self.get_json(f"/repos/{self._repo_path(repo_url)}/git/trees/{sha}",
+                                   params={"recursive": "1"} if recursive else None)
+
+    async def get_blob(self, blob_url: str, max_bytes: Optional[int] = None, skip_binary: bool = False) -> Optional[bytes]:
+        """
+        Fetch the raw bytes of a blob from its API URL, as raw content when GitHub serves it so (no base64).
+        The body is streamed: a blob larger than `max_bytes`, or binary with `skip_binary`, is given up
+        (None) as soon as that shows, without downloading the rest of it.
+        """
+        response = await self.request("GET", blob_url, priority=BULK, stream=True,
+                                      headers={"Accept": "application/vnd.github.raw+json"})
+        try:
+            encoded = response.headers.get("Content-Type", "").startswith("application/json")
+            # base64 takes 4/3 of the content, plus the JSON around it
+            limit = None if max_bytes is None else (max_bytes * 4 // 3 + 4096 if encoded else max_bytes)
+            length = response.headers.get("Content-Length")
+            if limit is not None and length is not None and int(length) > limit:
+                logging.info(f"Skipping blob {blob_url} of {length} bytes, over {max_bytes}")
+                return None
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                if skip_binary and not encoded and size < BINARY_SNIFF_BYTES and is_binary(chunk[:BINARY_SNIFF_BYTES - size]):
+                    return None
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    logging.info(f"Skipping blob {blob_url}, over {max_bytes} bytes")
+                    return None
+                chunks.append(chunk)
+        finally:
+            await response.aclose()
+        content = b"".join(chunks)
+        if encoded:
+            content = base64.b64decode(json.loads(content)["content"])
+            if (max_bytes is not None and len(content) > max_bytes) or (skip_binary and is_binary(content)):
+                return None
+        return content
@@ -0,0 +1,226 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from redis import Redis
+from dotenv import load_dotenv
+
+from app.db.redis_app import redis_app
+from app.module.utils.lru import LRUCache
+
+load_dotenv()
+
+GH_BLOB_CACHE_MEMORY_BYTES = int(os.getenv("GH_BLOB_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+GH_BLOB_CACHE_TTL = int(os.getenv("GH_BLOB_CACHE_TTL", 7 * 24 * 3600))
+GH_BLOB_CACHE_COMPRESS = os.getenv("GH_BLOB_CACHE_COMPRESS", "true").lower() == "true"
+# Blobs smaller than this are stored uncompressed, zlib would not pay for itself
+GH_BLOB_CACHE_COMPRESS_MIN_BYTES = int(os.getenv("GH_BLOB_CACHE_COMPRESS_MIN_BYTES", 1024))
+# Blobs a fetch could not return (missing, binary, oversized) are not fetched again for this long
+GH_BLOB_CACHE_NEGATIVE_TTL = int(os.getenv("GH_BLOB_CACHE_NEGATIVE_TTL", 60))
+
+# Redis value of a blob known to be unavailable, real entries start with "z" or "r"
+MISSING = b"n"
+
+
+class _KeyLock:
+    """Lock of one blob SHA, counting the threads holding or waiting for it"""
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+class BlobCache:
+    """
+    Content addressed cache of git blobs keyed by blob SHA.
+    Blobs are immutable, so entries never need invalidation: an in-process LRU
+    bounded by bytes sits in front of a Redis tier shared by every worker.
+    """
+    PREFIX = "gh_blob"
+
+    def __init__(self, cache: Redis, memory_bytes: int = GH_BLOB_CACHE_MEMORY_BYTES,
+                 ttl: int = GH_BLOB_CACHE_TTL, compress: bool = GH_BLOB_CACHE_COMPRESS,
+                 negative_ttl: int = GH_BLOB_CACHE_NEGATIVE_TTL):
+        self.cache = cache
+        self.ttl = ttl
+        self.compress = compress
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(max_bytes=memory_bytes)
+        # SHA -> monotonic time until which the blob is known to be unavailable
+        self._missing: Dict[str, float] = {}
+        self._fetch_locks: Dict[str, _KeyLock] = {}
+        self._fetch_locks_lock = threading.Lock()
+
+    def _entry_key(self, sha: str) -> str:
+        return f"{self.PREFIX}:{sha}"
+
+    def _encode(self, content: bytes) -> bytes:
+        if self.compress and len(content) >= GH_BLOB_CACHE_COMPRESS_MIN_BYTES:
+            return b"z" + zlib.compress(content)
+        return b"r" + content
+
+    def _decode(self, raw: bytes) -> bytes:
+        if raw[:1] == b"z":
+            return zlib.decompress(raw[1:])
+        return raw[1:]
+
+    def get(self, sha: str) -> Optional[bytes]:
+        content = self.memory.get(sha)
+        if content is not None:
+            return content
+        try:
+            raw = self.cache.get(self._entry_key(sha))
+            if raw == MISSING:
+                self._remember_missing(sha)
+            elif raw is not None:
+                content = self._decode(raw)
+                self.memory.set(sha, content)
+                return content
+        except Exception as e:
+            logging.error(f"Failed to read blob {sha} from cache: {e}")
+        return None
+
+    def _remember_missing(self, sha: str) -> None:
+        now = time.monotonic()
+        with self._fetch_locks_lock:
+            if len(self._missing) >= 10000:
+                self._missing = {key: until for key, until in self._missing.items() if until > now}
+            self._missing[sha] = now + self.negative_ttl
+
+    def is_missing(self, sha: str) -> bool:
+        """True when a recent fetch of the blob returned nothing (see get(), which also learns it from Redis)"""
+        with self._fetch_locks_lock:
+            until = self._missing.get(sha)
+            if until is not None and until <= time.monotonic():
+                del self._missing[sha]
+                until = None
+            return until is not None
+
+    def set_missing(self, sha: str) -> None:
+        """Record for GH_BLOB_CACHE_NEGATIVE_TTL that the blob could not be fetched"""
+        self._remember_missing(sha)
+        try:
+            self.cache.set(self._entry_key(sha), MISSING, ex=self.negative_ttl, nx=True)
+        except Exception as e:
+            logging.error(f"Failed to store missing blob {sha} in cache: {e}")
+
+    def get_many(self, shas: Iterable[str]) -> Dict[str, bytes]:
+        """The cached blobs among `shas`, those missing from memory read from Redis in one MGET"""
+        found: Dict[str, bytes] = {}
+        missing = []
+        for sha in dict.fromkeys(shas):
+            content = self.memory.get(sha)
+            if content is not None:
+                found[sha] = content
+            else:
+                missing.append(sha)
+        if not missing:
+            return found
+        try:
+            raws = self.cache.mget([self._entry_key(sha) for sha in missing])
+        except Exception as e:
+            logging.error(f"Failed to read {len(missing)} blobs from cache: {e}")
+            return found
+        for sha, raw in zip(missing, raws):
+            if raw == MISSING:
+                self._remember_missing(sha)
+            elif raw is not None:
+                found[sha] = self._decode(raw)
+                self.memory.set(sha, found[sha])
+        return found
+
+    def set(self, sha: str, content: bytes) -> None:
+        self.memory.set(sha, content)
+        with self._fetch_locks_lock:
+            self._missing.pop(sha, None)
+        try:
+            self.cache.set(self._entry_key(sha), self._encode(content), ex=self.ttl)
+        except Exception as e:
+            logging.error(f"Failed to store blob {sha} in cache: {e}")
+
+    @contextmanager
+    def _locked(self, shas: List[str]) -> Iterator[None]:
+        """
+        Hold the locks of `shas`, taken in sorted order so overlapping callers cannot deadlock.
+        A lock is dropped once no thread holds or waits for it, so every caller asking for a blob
+        while it is being fetched waits on that same lock.
+        """
+        shas = sorted(set(shas))
+        with self._fetch_locks_lock:
+            key_locks = []
+            for sha in shas:
+                key_lock = self._fetch_locks.get(sha)
+                if key_lock is None:
+                    key_lock = self._fetch_locks[sha] = _KeyLock()
+                key_lock.users += 1
+                key_locks.append(key_lock)
+        acquired = []
+        try:
+            for key_lock in key_locks:
+                key_lock.lock.acquire()
+                acquired.append(key_lock)
+            yield
+        finally:
+            for key_lock in acquired:
+                key_lock.lock.release()
+            with self._fetch_locks_lock:
+                for sha, key_lock in zip(shas, key_locks):
+                    key_lock.users -= 1
+                    if key_lock.users == 0:
+                        del self._fetch_locks[sha]
+
+    def get_or_fetch(self, sha: str, fetch: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+        """
+        Return the cached blob, fetching it once even when several threads ask for it together.
+        A blob the fetch could not return is not asked for again for GH_BLOB_CACHE_NEGATIVE_TTL.
+        """
+        content = self.get(sha)
+        if content is not None or self.is_missing(sha):
+            return content
+        with self._locked([sha]):
+            content = self.get(sha)
+            if content is not None or self.is_missing(sha):
+                return content
+            content = fetch()
+            if content is None:
+                self.set_missing(sha)
+            else:
+                self.set(sha, content)
+            return content
+
+    def get_or_fetch_many(self, shas: Iterable[str],
+                          fetch: Callable[[List[str]], Dict[str, bytes]]) -> Dict[str, bytes]:
+        """
+        The cached blobs among `shas`, fetching the missing ones with a single call of `fetch`.
+        Their keys stay locked meanwhile, so a get_or_fetch of one of them waits for it instead of
+        fetching it again. Blobs `fetch` leaves out are missing from the result, and are not asked
+        for again for GH_BLOB_CACHE_NEGATIVE_TTL.
+        """
+        shas = list(dict.fromkeys(shas))
+        found = self.get_many(shas)
+        missing = [sha for sha in shas if sha not in found and not self.is_missing(sha)]
+        if not missing:
+            return found
+        with self._locked(missing):
+            # Some may have been fetched (or found missing) while waiting for their lock
+            fetched = self.get_many(missing)
+            still_missing = [sha for sha in missing if sha not in fetched and not self.is_missing(sha)]
+            if still_missing:
+                contents = fetch(still_missing)
+                for sha in still_missing:
+                    content = contents.get(sha)
+                    if content is None:
+                        self.set_missing(sha)
+                    else:
+                        self.set(sha, content)
+                        fetched[sha] = content
+            found.update(fetched)
+            return found
+
+
+blob_cache = BlobCache(redis_app)
@@ -1,13 +1,15 @@
 import logging
 from fastapi import HTTPException
-from app.module.github.gh_service import GHService
+from app.module.github.gh_http_cache import gh_http_cache
+from app.module.github.gh_pool import gh_client_pool
+from app.module.github.gh_rate_limit import gh_rate_limiter
 
 class GHController:
     @classmethod
     async def get_repo_meta(cls, repo_url: str):
         try:
             logging.info(f"Fetching repository metadata for {repo_url}")
-            return await GHService().get_repo_meta(repo_url).raw_data
+            return await gh_client_pool.get().http().get_repo_meta(repo_url)
         except Exception as e:
             logging.error(f"Error in controller while fetching repo metadata: {e}")
             raise HTTPException(status_code=500, detail=f"Error fetching repository metadata: {e}")
@@ -16,7 +18,7 @@ class GHController:
     async def get_pr_meta(cls, repo_url: str, pr_number: int):
         try:
             logging.info(f"Fetching PR metadata for {repo_url} PR #{pr_number}")
-            return await GHService().get_pr_meta(repo_url, pr_number).raw_data
+            return await gh_client_pool.get().http().get_pr_meta(repo_url, pr_number)
         except Exception as e:
             logging.error(f"Error in controller while fetching PR metadata: {e}")
             raise HTTPException(status_code=500, detail=f"Error fetching PR metadata: {e}")
@@ -25,7 +27,19 @@ class GHController:
     async def get_pr_files(cls, repo_url: str, pr_number: int):
         try:
             logging.info(f"Fetching PR files for {repo_url} PR #{pr_number}")
-            return await GHService().get_pr_files(repo_url, pr_number)
+            return await gh_client_pool.get().http().get_pr_files(repo_url, pr_number)
         except Exception as e:
             logging.error(f"Error in controller while fetching PR files: {e}")
-            raise HTTPException(status_code=500, detail=f"Error fetching PR files: {e}")
\ No newline at end of file
+            raise HTTPException(status_code=500, detail=f"Error fetching PR files: {e}")
+
+    @classmethod
+    async def get_cache_stats(cls):
+        """Hits, revalidations (304s) and misses of the GitHub HTTP cache, and the waits of the rate limiter"""
+        cache = {"enabled": True, **await gh_http_cache.get_stats()} if gh_http_cache else {"enabled": False}
+        rate_limit = {"enabled": True, "process": gh_rate_limiter.get_stats()} if gh_rate_limiter else {"enabled": False}
+        return {**cache, "rate_limit": rate_limit}
+
+    @classmethod
+    async def get_client_stats(cls):
+        """Pooled GitHub clients and the request counters of each token (by token hash)"""
+        return gh_client_pool.get_stats()
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from app.module.github.gh_async import GH_API_URL, GHAsyncClient
+
+load_dotenv()
+
+GH_GRAPHQL_ENABLED = os.getenv("GH_GRAPHQL_ENABLED", "false").lower() == "true"
+# https://api.github.com/graphql, GitHub Enterprise serves it at <host>/api/graphql
+GH_GRAPHQL_URL = os.getenv("GH_GRAPHQL_URL", f"{GH_API_URL}/graphql")
+# Blobs fetched per query, each is one aliased field of it
+GH_GRAPHQL_BLOB_BATCH = int(os.getenv("GH_GRAPHQL_BLOB_BATCH", 50))
+
+PULL_REQUEST_QUERY = """
+query PullRequest($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    nameWithOwner
+    pullRequest(number: $number) {
+      number title body state url
+      headRefName headRefOid baseRefName baseRefOid
+      changedFiles additions deletions
+      headRepository { nameWithOwner }
+      baseRepository { nameWithOwner }
+    }
+  }
+}
+"""
+
+BLOB_FIELDS = "... on Blob { oid byteSize isBinary isTruncated text }"
+
+
+class GraphQLError(Exception):
+    pass
+
+
+def _git_blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class GHGraphQLClient:
+    """
+    Reads of the GitHub GraphQL API batched into as few queries as it allows: a pull request's
+    metadata in one query, and the contents of many blobs in one query of aliased `object` fields.
+    Queries go through the async REST client, so they share its connections, retries and rate
+    limiter. GraphQL has no per-file patches, the changed files of a PR still come from REST.
+    """
+    def __init__(self, http: GHAsyncClient, url: str = GH_GRAPHQL_URL, blob_batch: int = GH_GRAPHQL_BLOB_BATCH):
+        self.http = http
+        self.url = url
+        self.blob_batch = blob_batch
+
+    @staticmethod
+    def _owner_and_name(repo_url: str):
+        owner, name = GHAsyncClient._repo_path(repo_url).split("/")[:2]
+        return owner, name
+
+    async def query(self, query: str, variables: dict, priority: Optional[str] = None) -> dict:
+        """`data` of a query, GraphQLError when GitHub answers with errors instead"""
+        operation = query.split("(")[0].split()[-1]
+        response = await self.http.request("POST", self.url, priority=priority,
+                                           json={"query": query, "variables": variables, "operationName": operation})
+        payload = response.json()
+        if payload.get("errors") or not payload.get("data"):
+            messages = "; ".join(error.get("message", "") for error in payload.get("errors") or [])
+            raise GraphQLError(f"{operation} failed: {messages or 'no data'}")
+        return payload["data"]
+
+    async def get_pull_request(self, repo_url: str, number: int) -> dict:
+        """PR metadata shaped like the REST payload of /pulls/{number}, for the PyGithub PullRequest"""
+        owner, name = self._owner_and_name(repo_url)
+        repository = (await self.query(PULL_REQUEST_QUERY, {"owner": owner, "name": name, "number": number}))["repository"]
+        pr = (repository or {}).get("pullRequest")
+        if pr is None:
+            raise GraphQLError(f"Pull request {repo_url}#{number} not found")
+
+        def _side(ref: str, sha: str, repo: Optional[dict]) -> dict:
+            # A deleted fork has no head repository, like REST returns it
+            full_name = repo["nameWithOwner"] if repo else None
+            return {"ref": ref, "sha": sha, "repo": {"full_name": full_name, "url": f"{GH_API_URL}/repos/{full_name}"}
+                    if full_name else None}
+
+        return {
+            "number": pr["number"],
+            "title": pr["title"],
+            "body": pr["body"],
+            "state": pr["state"].lower(),
+            "html_url": pr["url"],
+            "url": f"{GH_API_URL}/repos/{repository['nameWithOwner']}/pulls/{pr['number']}",
+            "head": _side(pr["headRefName"], pr["headRefOid"], pr["headRepository"]),
+            "base": _side(pr["baseRefName"], pr["baseRefOid"], pr["baseRepository"]),
+            "changed_files": pr["changedFiles"],
+            "additions": pr["additions"],
+            "deletions": pr["deletions"],
+        }
+
+    async def get_blobs(self, repo_url: str, shas: Iterable[str], priority: Optional[str] = None) -> Dict[str, bytes]:
+        """
+        Contents of blobs by SHA, GH_GRAPHQL_BLOB_BATCH per query. Blobs GraphQL cannot return as
+        they are (binary, truncated by GitHub, or text that does not hash back to the SHA) are
+        left out, for the caller to read through REST.
+        """
+        owner, name = self._owner_and_name(repo_url)
+        shas = list(dict.fromkeys(shas))
+        contents: Dict[str, bytes] = {}
+        for start in range(0, len(shas), self.blob_batch):
+            batch = shas[start:start + self.blob_batch]
+            params = "".join(f", $o{index}: GitObjectID!" for index in range(len(batch)))
+            fields = "\n".join(f"    o{index}: object(oid: $o{index}) {{ {BLOB_FIELDS} }}" for index in range(len(batch)))
+            query = f"query Blobs($owner: String!, $name: String!{params}) {{\n  repository(owner: $owner, name: $name) {{\n{fields}\n  }}\n}}"
+            variables: Dict[str, Any] = {"owner": owner, "name": name,
+                                         **{f"o{index}": sha for index, sha in enumerate(batch)}}
+            repository = (await self.query(query, variables, priority=priority))["repository"] or {}
+            for index, sha in enumerate(batch):
+                blob = repository.get(f"o{index}")
+                if not blob or blob.get("isBinary") or blob.get("isTruncated") or blob.get("text") is None:
+                    continue
+                content = blob["text"].encode("utf-8")
+                if _git_blob_sha(content) != sha:
+                    # Not UTF-8 on disk, the text GitHub decoded is not the blob
+                    logging.debug(f"GraphQL text of blob {sha} of {repo_url} does not match it, leaving it to REST")
+                    continue
+                contents[sha] = content
+        return contents
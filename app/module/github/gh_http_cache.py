@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import zlib
+from typing import Dict, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from app.db.redis_app import loop_redis_client
+
+load_dotenv()
+
+GH_HTTP_CACHE_ENABLED = os.getenv("GH_HTTP_CACHE_ENABLED", "true").lower() == "true"
+GH_HTTP_CACHE_TTL = int(os.getenv("GH_HTTP_CACHE_TTL", 7 * 24 * 3600))
+# Bodies larger than this once compressed (huge recursive trees) are not cached
+GH_HTTP_CACHE_MAX_ENTRY_BYTES = int(os.getenv("GH_HTTP_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024))
+GH_HTTP_CACHE_COMPRESS_MIN_BYTES = int(os.getenv("GH_HTTP_CACHE_COMPRESS_MIN_BYTES", 1024))
+
+# Resources addressed by commit, tree or blob SHA never change, they are served without revalidating
+IMMUTABLE_URL = re.compile(r"/git/(?:trees|blobs|commits)/[0-9a-f]{40}(?:\?|$)|/compare/[0-9a-f]{40}\.\.\.[0-9a-f]{40}(?:\?|$)")
+# Response headers kept with a body, what callers of a cached response read
+KEPT_HEADERS = ("Content-Type", "Link")
+
+
+class CachedResponse(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    headers: Dict[str, str]
+    body: bytes
+
+
+class HTTPCache:
+    """
+    Conditional request cache of GitHub API reads in Redis, shared by every worker.
+    Entries are keyed by URL (with its query and Accept header) and a hash of the token, since
+    what a token may see differs. Each holds the ETag and Last-Modified of the response with its
+    compressed body, so a read is revalidated with If-None-Match / If-Modified-Since and a
+    `304 Not Modified` (which costs no rate limit) is answered from the cache. Stats count
+    `hits` (immutable URLs served without a request), `revalidated` (304s), `changed` (200s
+    replacing an entry) and `misses`.
+    """
+    PREFIX = "gh_http"
+
+    def __init__(self, ttl: int = GH_HTTP_CACHE_TTL, max_entry_bytes: int = GH_HTTP_CACHE_MAX_ENTRY_BYTES,
+                 redis_factory=loop_redis_client):
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        # Called on the event loop of each request, for the async Redis client of that loop
+        self._redis = redis_factory
+        self.stats = {"hits": 0, "revalidated": 0, "changed": 0, "misses": 0, "stores": 0}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def scope(token: Optional[str]) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()[:16] if token else "anonymous"
+
+    @staticmethod
+    def is_immutable(url: str) -> bool:
+        return IMMUTABLE_URL.search(url) is not None
+
+    def _entry_key(self, scope: str, url: str) -> str:
+        return f"{self.PREFIX}:{scope}:{hashlib.sha256(url.encode()).hexdigest()}"
+
+    async def count(self, stat: str) -> None:
+        with self._stats_lock:
+            self.stats[stat] += 1
+        try:
+            await self._redis().hincrby(f"{self.PREFIX}:stats", stat, 1)
+        except Exception as e:
+            logging.debug(f"Failed to update GitHub HTTP cache stats: {e}")
+
+    async def get(self, scope: str, url: str) -> Optional[CachedResponse]:
+        try:
+            fields = await self._redis().hgetall(self._entry_key(scope, url))
+        except Exception as e:
+            logging.error(f"Failed to read GitHub HTTP cache entry of {url}: {e}")
+            return None
+        if not fields or b"body" not in fields:
+            return None
+        body = fields[b"body"]
+        body = zlib.decompress(body[1:]) if body[:1] == b"z" else body[1:]
+        headers = {name: fields[name.encode()].decode() for name in KEPT_HEADERS if name.encode() in fields}
+        etag, last_modified = fields.get(b"etag"), fields.get(b"last_modified")
+        return CachedResponse(etag=etag.decode() if etag else None,
+                              last_modified=last_modified.decode() if last_modified else None,
+                              headers=headers, body=body)
+
+    async def set(self, scope: str, url: str, etag: Optional[str], last_modified: Optional[str],
+                  headers: Dict[str, str], body: bytes) -> None:
+        if not etag and not last_modified and not self.is_immutable(url):
+            return
+        stored = b"z" + zlib.compress(body, 1) if len(body) >= GH_HTTP_CACHE_COMPRESS_MIN_BYTES else b"r" + body
+        if len(stored) > self.max_entry_bytes:
+            return
+        fields = {"body": stored, **{name: headers[name] for name in KEPT_HEADERS if name in headers}}
+        if etag:
+            fields["etag"] = etag
+        if last_modified:
+            fields["last_modified"] = last_modified
+        key = self._entry_key(scope, url)
+        try:
+            pipe = self._redis().pipeline()
+            pipe.delete(key)
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+            await self.count("stores")
+        except Exception as e:
+            logging.error(f"Failed to store GitHub HTTP cache entry of {url}: {e}")
+
+    async def touch(self, scope: str, url: str) -> None:
+        """Keep a revalidated entry for another TTL"""
+        try:
+            await self._redis().expire(self._entry_key(scope, url), self.ttl)
+        except Exception as e:
+            logging.debug(f"Failed to refresh GitHub HTTP cache entry of {url}: {e}")
+
+    async def get_stats(self) -> dict:
+        """Hit/revalidation/miss counters of this process and of the whole shared cache"""
+        try:
+            shared = {k.decode(): int(v) for k, v in (await self._redis().hgetall(f"{self.PREFIX}:stats")).items()}
+        except Exception as e:
+            logging.error(f"Failed to read GitHub HTTP cache stats: {e}")
+            shared = {}
+        with self._stats_lock:
+            return {"process": dict(self.stats), "shared": shared}
+
+
+gh_http_cache = HTTPCache() if GH_HTTP_CACHE_ENABLED else None
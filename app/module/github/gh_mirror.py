@@ -0,0 +1,460 @@
+import base64
+import fcntl
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Serve trees, blobs and diffs of the repos in GH_MIRROR_REPOS from local bare mirrors instead of the REST API
+GH_MIRROR_ENABLED = os.getenv("GH_MIRROR_ENABLED", "false").lower() == "true"
+# Comma separated owner/name of the mirrored repos, "*" for every repo reviewed
+GH_MIRROR_REPOS = [repo.strip() for repo in os.getenv("GH_MIRROR_REPOS", "*").split(",") if repo.strip()]
+GH_MIRROR_DIR = os.getenv("GH_MIRROR_DIR") or os.path.join(tempfile.gettempdir(), "code-reviewer-mirrors")
+# Disk used by all mirrors together, the least recently used mirrors are removed beyond it
+GH_MIRROR_MAX_BYTES = int(os.getenv("GH_MIRROR_MAX_BYTES", 20 * 1024 ** 3))
+# Clone URL of a repo, {repo} is owner/name. file:///srv/git/{repo}.git mirrors local repositories
+GH_MIRROR_REMOTE = os.getenv("GH_MIRROR_REMOTE", "https://github.com/{repo}.git")
+# The default branch is fetched again at most this often, commits are fetched whenever one is missing
+GH_MIRROR_FETCH_INTERVAL = int(os.getenv("GH_MIRROR_FETCH_INTERVAL", 60))
+GH_MIRROR_GIT_TIMEOUT = int(os.getenv("GH_MIRROR_GIT_TIMEOUT", 600))
+
+BRANCHES = "+refs/heads/*:refs/heads/*"
+# Files in each mirror (next to HEAD) recording its last use, last fetch and size on disk
+USED_FILE = "mirror-used"
+FETCHED_FILE = "mirror-fetched"
+SIZE_FILE = "mirror-size"
+DIFF_STATUS = {"A": "added", "D": "removed", "M": "modified", "R": "renamed", "C": "copied", "T": "changed"}
+
+
+class MirrorError(Exception):
+    """The mirror cannot serve a request, callers fall back to the REST API"""
+
+
+class GitDiffFile(NamedTuple):
+    """A file changed between two commits, shaped like a PyGithub File"""
+    filename: str
+    status: str
+    sha: Optional[str]
+    previous_filename: Optional[str]
+    additions: int
+    deletions: int
+    changes: int
+    patch: Optional[str]
+
+
+class GitComparison(NamedTuple):
+    """Comparison of two commits, shaped like a PyGithub Comparison"""
+    status: str
+    merge_base: str
+    files: List[GitDiffFile]
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def _split_patches(output: bytes) -> List[bytes]:
+    """Per file sections of a `git diff` patch. Lines inside hunks start with " ", "+" or "-", never with "diff --git" """
+    if not output:
+        return []
+    sections = output.split(b"\ndiff --git ")
+    return [sections[0]] + [b"diff --git " + section for section in sections[1:]]
+
+
+_QUOTE_ESCAPES = {b"a": b"\a", b"b": b"\b", b"t": b"\t", b"n": b"\n", b"v": b"\v", b"f": b"\f", b"r": b"\r"}
+
+
+def _unquote(path: bytes) -> bytes:
+    """A path as git writes it in patch headers, C-quoted (octal bytes) when it has special characters"""
+    if not path.startswith(b'"'):
+        return path
+    unquoted, index = bytearray(), 1
+    while index < len(path) - 1:
+        char = path[index:index + 1]
+        if char == b"\\":
+            escaped = path[index + 1:index + 2]
+            if escaped.isdigit():
+                unquoted.append(int(path[index + 1:index + 4], 8))
+                index += 4
+                continue
+            unquoted += _QUOTE_ESCAPES.get(escaped, escaped)
+            index += 2
+            continue
+        unquoted += char
+        index += 1
+    return bytes(unquoted)
+
+
+def _patch_path(section: bytes) -> bytes:
+    """New path of the file a patch section is about"""
+    lines = section.split(b"\n")
+    for line in lines[1:]:
+        if line.startswith((b"@@", b"--- ", b"+++ ", b"Binary files ")):
+            break
+        if line.startswith((b"rename to ", b"copy to ")):
+            return _unquote(line.split(b" to ", 1)[1])
+    # Without a rename or copy both sides of "diff --git a/<path> b/<path>" are the same path
+    paths = lines[0][len(b"diff --git "):]
+    return _unquote(paths[(len(paths) + 1) // 2:])[len(b"b/"):]
+
+
+def _hunks(section: bytes) -> Optional[str]:
+    """The hunks of a file's patch without its headers, as GitHub returns them. None for binary or mode only changes"""
+    start = section.find(b"\n@@ ")
+    if start < 0:
+        return None
+    return section[start + 1:].rstrip(b"\n").decode("utf-8", errors="replace")
+
+
+class GitMirror:
+    """
+    Local bare mirrors of GitHub repositories, one per repo under `root` as <owner>/<name>.git.
+    A mirror is cloned on first use and fetched incrementally when a commit it is asked for is
+    missing (PR heads through their refs/pull/<n>/head ref), or when the default branch is
+    older than `fetch_interval`. Trees, blobs and diffs are then read from the packfiles on disk.
+    Clones and fetches of a repo are serialized across processes by a lock file next to its
+    mirror. Mirrors beyond `max_bytes` in total are removed least recently used first, a read
+    racing a removal fails with MirrorError like any other miss.
+    """
+    def __init__(self, root: str = GH_MIRROR_DIR, max_bytes: int = GH_MIRROR_MAX_BYTES,
+                 remote: str = GH_MIRROR_REMOTE, repos: Iterable[str] = GH_MIRROR_REPOS,
+                 enabled: bool = GH_MIRROR_ENABLED, fetch_interval: int = GH_MIRROR_FETCH_INTERVAL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.remote = remote
+        self.repos = set(repos)
+        self.enabled = enabled
+        self.fetch_interval = fetch_interval
+
+    @staticmethod
+    def _repo(repo_url: str) -> str:
+        return repo_url.replace("https://github.com/", "").strip("/")
+
+    def serves(self, repo_url: str) -> bool:
+        return self.enabled and ("*" in self.repos or self._repo(repo_url) in self.repos)
+
+    def mirror_dir(self, repo_url: str) -> str:
+        return os.path.join(self.root, f"{self._repo(repo_url)}.git")
+
+    def _run(self, git_dir: Optional[str], *args: str, input: Optional[bytes] = None,
+             token: Optional[str] = None) -> subprocess.CompletedProcess:
+        env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+        if token and self.remote.startswith("https://"):
+            # Passed through the environment rather than the URL so the token is neither in argv nor in the mirror's config
+            credentials = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+            env.update({"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "http.extraHeader",
+                        "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}"})
+        command = ["git"] + ([f"--git-dir={git_dir}"] if git_dir else []) + list(args)
+        try:
+            return subprocess.run(command, input=input, capture_output=True, env=env, timeout=GH_MIRROR_GIT_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise MirrorError(f"git {args[0]} failed: {e}") from e
+
+    def _git(self, git_dir: Optional[str], *args: str, input: Optional[bytes] = None,
+             token: Optional[str] = None) -> bytes:
+        result = self._run(git_dir, *args, input=input, token=token)
+        if result.returncode != 0:
+            raise MirrorError(f"git {args[0]} failed in {git_dir}: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout
+
+    def _has(self, git_dir: str, spec: str) -> bool:
+        return os.path.isdir(git_dir) and self._run(git_dir, "cat-file", "-e", spec).returncode == 0
+
+    @contextmanager
+    def _locked(self, repo: str, blocking: bool = True) -> Iterator[bool]:
+        """Hold the lock of a repo's mirror, yields False when not blocking and another holder has it"""
+        path = os.path.join(self.root, f"{repo}.lock")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _mark(self, git_dir: str, name: str, content: Optional[str] = None) -> None:
+        path = os.path.join(git_dir, name)
+        try:
+            if content is not None:
+                with open(path, "w") as marker:
+                    marker.write(content)
+            elif os.path.exists(path):
+                os.utime(path)
+            else:
+                open(path, "w").close()
+        except OSError as e:
+            logging.warning(f"Could not update {path}: {e}")
+
+    def _marked_at(self, git_dir: str, name: str) -> float:
+        try:
+            return os.stat(os.path.join(git_dir, name)).st_mtime
+        except OSError:
+            return 0.0
+
+    def ensure_commit(self, repo_url: str, sha: Optional[str] = None, token: Optional[str] = None,
+                      refs: Iterable[str] = ()) -> str:
+        """
+        The mirror of `repo_url` holding commit `sha` (a recent default branch head when None),
+        cloned or fetched as needed. `refs` are extra refspecs fetched along with the branches
+        when the commit is missing, e.g. the head ref of the PR it belongs to.
+        """
+        repo = self._repo(repo_url)
+        git_dir = self.mirror_dir(repo_url)
+        if sha is not None and self._has(git_dir, f"{sha}^{{commit}}"):
+            self._mark(git_dir, USED_FILE)
+            return git_dir
+        with self._locked(repo):
+            if not os.path.isdir(git_dir):
+                self._clone(repo, git_dir, token)
+            if sha is not None and not self._has(git_dir, f"{sha}^{{commit}}"):
+                self._fetch(git_dir, token, list(refs))
+                if not self._has(git_dir, f"{sha}^{{commit}}"):
+                    # No branch or PR ref points at it any more (e.g. a force-pushed PR head), ask for the commit itself
+                    self._fetch(git_dir, token, [f"+{sha}:refs/commits/{sha}"], branches=False)
+            elif sha is None and time.time() - self._marked_at(git_dir, FETCHED_FILE) > self.fetch_interval:
+                self._fetch(git_dir, token, [])
+            if sha is not None and not self._has(git_dir, f"{sha}^{{commit}}"):
+                raise MirrorError(f"Commit {sha} not found in the mirror of {repo_url}")
+            self._mark(git_dir, USED_FILE)
+        return git_dir
+
+    def _clone(self, repo: str, git_dir: str, token: Optional[str]) -> None:
+        started = time.perf_counter()
+        os.makedirs(os.path.dirname(git_dir), exist_ok=True)
+        # Cloned next to its final place and renamed into it, a half done clone is never used
+        staging = tempfile.mkdtemp(prefix=".clone-", dir=os.path.dirname(git_dir))
+        try:
+            self._git(None, "clone", "--bare", "--quiet", "--no-tags", self.remote.format(repo=repo), staging,
+                      token=token)
+            self._git(staging, "config", "remote.origin.fetch", BRANCHES)
+            self._mark(staging, FETCHED_FILE)
+            self._mark(staging, SIZE_FILE, str(_dir_size(staging)))
+            os.rename(staging, git_dir)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        logging.info(f"Cloned a mirror of {repo} in {time.perf_counter() - started:.2f}s")
+        self.evict(keep=git_dir)
+
+    def _fetch(self, git_dir: str, token: Optional[str], refspecs: List[str], branches: bool = True) -> None:
+        started = time.perf_counter()
+        # Branches deleted on the remote are pruned, refspecs naming a single ref or commit prune nothing
+        base = ["--prune", BRANCHES] if branches else []
+        result = self._run(git_dir, "fetch", "--quiet", "--no-tags", "origin", *base, *refspecs, token=token)
+        if result.returncode != 0 and branches and refspecs:
+            # A ref the remote does not have fails the whole fetch, the branches alone may still bring the commit
+            logging.warning(f"Fetching {refspecs} into {git_dir} failed: {result.stderr.decode(errors='replace').strip()}")
+            result = self._run(git_dir, "fetch", "--quiet", "--no-tags", "origin", *base, token=token)
+        if result.returncode != 0:
+            message = result.stderr.decode(errors="replace").strip()
+            if branches:
+                raise MirrorError(f"git fetch failed in {git_dir}: {message}")
+            logging.warning(f"Fetching {refspecs} into {git_dir} failed: {message}")
+            return
+        self._mark(git_dir, FETCHED_FILE)
+        self._mark(git_dir, SIZE_FILE, str(_dir_size(git_dir)))
+        logging.info(f"Fetched {git_dir} in {time.perf_counter() - started:.2f}s")
+        self.evict(keep=git_dir)
+
+    def mirrors(self) -> List[Tuple[float, int, str, str]]:
+        """(last used, size, mirror dir, owner/name) of every mirror on disk"""
+        found = []
+        if not os.path.isdir(self.root):
+            return found
+        for owner in os.listdir(self.root):
+            owner_dir = os.path.join(self.root, owner)
+            if not os.path.isdir(owner_dir):
+                continue
+            for name in os.listdir(owner_dir):
+                git_dir = os.path.join(owner_dir, name)
+                if name.startswith(".clone-") or not name.endswith(".git") or not os.path.isdir(git_dir):
+                    continue
+                try:
+                    with open(os.path.join(git_dir, SIZE_FILE)) as marker:
+                        size = int(marker.read() or 0)
+                except (OSError, ValueError):
+                    size = _dir_size(git_dir)
+                found.append((self._marked_at(git_dir, USED_FILE), size, git_dir, f"{owner}/{name[:-len('.git')]}"))
+        return found
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove the least recently used mirrors until all of them fit in max_bytes"""
+        mirrors = sorted(self.mirrors())
+        total = sum(size for _, size, _, _ in mirrors)
+        for _, size, git_dir, repo in mirrors:
+            if total <= self.max_bytes:
+                break
+            if git_dir == keep:
+                continue
+            # Mirrors being cloned or fetched are skipped, they are in use
+            with self._locked(repo, blocking=False) as locked:
+                if not locked:
+                    continue
+                shutil.rmtree(git_dir, ignore_errors=True)
+            total -= size
+            logging.info(f"Evicted the mirror of {repo} ({size} bytes), mirrors now use {total} bytes")
+
+    def tree_sha(self, repo_url: str, commit_sha: Optional[str] = None, token: Optional[str] = None) -> str:
+        """Tree SHA of a commit, the default branch head when None"""
+        git_dir = self.ensure_commit(repo_url, commit_sha, token)
+        return self._git(git_dir, "rev-parse", "--verify", f"{commit_sha or 'HEAD'}^{{tree}}").decode().strip()
+
+    def list_tree(self, repo_url: str, sha: Optional[str] = None,
+                  token: Optional[str] = None) -> Tuple[str, List[Tuple[str, str, str, Optional[int]]]]:
+        """
+        Tree SHA and (path, type, sha, size) of every entry of tree or commit `sha` (the default
+        branch head when None), recursively and in the order of GitHub's recursive listing.
+        """
+        git_dir = self.mirror_dir(repo_url)
+        if sha is None or not self._has(git_dir, sha):
+            # Only commits can be fetched, a missing tree is a miss once the commit of that SHA is not found either
+            git_dir = self.ensure_commit(repo_url, sha, token)
+        else:
+            self._mark(git_dir, USED_FILE)
+        tree_sha = self._git(git_dir, "rev-parse", "--verify", f"{sha or 'HEAD'}^{{tree}}").decode().strip()
+        output = self._git(git_dir, "ls-tree", "-r", "-t", "-l", "-z", "--full-tree", tree_sha)
+        entries = []
+        for record in output.split(b"\0"):
+            if not record:
+                continue
+            meta, _, path = record.partition(b"\t")
+            _, kind, object_sha, size = meta.split()
+            entries.append((path.decode("utf-8", errors="replace"), kind.decode(), object_sha.decode(),
+                            None if size == b"-" else int(size)))
+        return tree_sha, entries
+
+    def read_blobs(self, repo_url: str, shas: Iterable[str], max_bytes: Optional[int] = None) -> Dict[str, Optional[bytes]]:
+        """
+        Contents of the blobs among `shas` that the mirror holds, read in one `git cat-file --batch`.
+        Their sizes are checked first (`--batch-check`), blobs over `max_bytes` map to None without
+        being read. Never fetches.
+        """
+        git_dir = self.mirror_dir(repo_url)
+        shas = list(dict.fromkeys(shas))
+        if not shas or not os.path.isdir(git_dir):
+            return {}
+        checked = self._git(git_dir, "cat-file", "--batch-check", input="".join(f"{sha}\n" for sha in shas).encode())
+        self._mark(git_dir, USED_FILE)
+        blobs, wanted = {}, []
+        # "<sha> <type> <size>" per SHA, "<sha> missing" and "<sha> ambiguous" for the ones not held
+        for sha, line in zip(shas, checked.decode().splitlines()):
+            header = line.split()
+            if len(header) < 3 or header[1] != "blob":
+                continue
+            if max_bytes is not None and int(header[2]) > max_bytes:
+                logging.info(f"Skipping blob {sha} of {repo_url} of {header[2]} bytes, over {max_bytes}")
+                blobs[sha] = None
+            else:
+                wanted.append(sha)
+        if not wanted:
+            return blobs
+        output = self._git(git_dir, "cat-file", "--batch", input="".join(f"{sha}\n" for sha in wanted).encode())
+        position = 0
+        for sha in wanted:
+            end = output.index(b"\n", position)
+            header = output[position:end].split()
+            position = end + 1
+            # "<sha> missing" and "<sha> ambiguous" have no content
+            if len(header) < 3:
+                continue
+            size = int(header[2])
+            if header[1] == b"blob":
+                blobs[sha] = output[position:position + size]
+            position += size + 1
+        return blobs
+
+    def compare(self, repo_url: str, base_sha: str, head_sha: str, token: Optional[str] = None,
+                refs: Iterable[str] = ()) -> GitComparison:
+        """Files changed from the merge base of the two commits to `head_sha`, like GitHub's base...head compare"""
+        git_dir = self.ensure_commit(repo_url, head_sha, token, refs)
+        self.ensure_commit(repo_url, base_sha, token)
+        if base_sha == head_sha:
+            return GitComparison(status="identical", merge_base=base_sha, files=[])
+        merge_base = self._git(git_dir, "merge-base", base_sha, head_sha).decode().strip()
+        head = self._git(git_dir, "rev-parse", "--verify", f"{head_sha}^{{commit}}").decode().strip()
+        base = self._git(git_dir, "rev-parse", "--verify", f"{base_sha}^{{commit}}").decode().strip()
+        if merge_base == base:
+            status = "ahead"
+        elif merge_base == head:
+            status = "behind"
+        else:
+            status = "diverged"
+        return GitComparison(status=status, merge_base=merge_base, files=self.diff(git_dir, merge_base, head))
+
+    def pr_files(self, repo_url: str, pr_number: int, base_sha: str, head_sha: str,
+                 token: Optional[str] = None) -> List[GitDiffFile]:
+        """Files changed by a pull request, as GitHub lists them"""
+        refs = [f"+refs/pull/{pr_number}/head:refs/pull/{pr_number}/head"]
+        return self.compare(repo_url, base_sha, head_sha, token, refs).files
+
+    def diff(self, git_dir: str, base: str, head: str) -> List[GitDiffFile]:
+        """Changed files between two commits with their patches, renames detected like GitHub does"""
+        options = ("--no-color", "--no-ext-diff", "--find-renames", "--src-prefix=a/", "--dst-prefix=b/")
+        output = self._git(git_dir, "diff", *options, "--raw", "--patch", "-z", "--no-abbrev", base, head)
+        # Records are ":<modes> <old sha> <new sha> <status>", then the path, or the old and new paths
+        # of a rename or copy, all NUL terminated. The patch follows them.
+        records, position = [], 0
+        while output.startswith(b":", position):
+            fields = []
+            for _ in range(2):
+                end = output.index(b"\0", position)
+                fields.append(output[position:end])
+                position = end + 1
+            if fields[0].split()[-1][:1] in (b"R", b"C"):
+                end = output.index(b"\0", position)
+                fields.append(output[position:end])
+                position = end + 1
+            records.append(fields)
+        # A type change has two sections (removal and addition) for its one record, so sections
+        # are matched to the records by path, not by position
+        patches: Dict[bytes, List[str]] = {}
+        for section in _split_patches(output[position:].lstrip(b"\0")):
+            hunks = _hunks(section)
+            if hunks is not None:
+                patches.setdefault(_patch_path(section), []).append(hunks)
+        files = []
+        for meta, *paths in records:
+            _, _, old_sha, new_sha, status = meta[1:].split()
+            status = status.decode()
+            previous = paths[0].decode(errors="replace") if len(paths) == 2 else None
+            path = paths[-1].decode(errors="replace")
+            patch = "\n".join(patches[paths[-1]]) if paths[-1] in patches else None
+            additions = deletions = 0
+            for line in (patch or "").split("\n"):
+                if line.startswith("+"):
+                    additions += 1
+                elif line.startswith("-"):
+                    deletions += 1
+            files.append(GitDiffFile(
+                filename=path,
+                status=DIFF_STATUS.get(status[0], "modified"),
+                sha=(old_sha if status[0] == "D" else new_sha).decode(),
+                previous_filename=previous,
+                additions=additions,
+                deletions=deletions,
+                changes=additions + deletions,
+                patch=patch,
+            ))
+        return files
+
+
+gh_mirror = GitMirror()
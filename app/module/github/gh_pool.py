@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from github import Auth, Github
+from dotenv import load_dotenv
+
+from app.module.github.gh_async import GH_API_URL, GHAsyncClient
+from app.module.github.gh_http_cache import HTTPCache
+from app.module.github.gh_rate_limit import INTERACTIVE
+
+load_dotenv()
+
+# Tokens whose clients are kept at most, the least recently used one is dropped past it
+GH_CLIENT_POOL_MAX = int(os.getenv("GH_CLIENT_POOL_MAX", 64))
+# Clients of a token unused for this long are dropped
+GH_CLIENT_POOL_IDLE_SECONDS = float(os.getenv("GH_CLIENT_POOL_IDLE_SECONDS", 15 * 60))
+
+
+class TokenStats:
+    """Request counters of one token, updated from every thread and event loop using it"""
+    def __init__(self):
+        self.counters: Dict[str, float] = {
+            "requests": 0, "errors": 0, "retries": 0, "rate_limited": 0,
+            "not_modified": 0, "cache_hits": 0, "wait_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def count(self, stat: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[stat] = self.counters.get(stat, 0) + amount
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.counters)
+
+
+class PooledClient:
+    """
+    GitHub clients of one token: the PyGithub client (its requests session and the objects it
+    builds) shared by every service of the token, and the counters of its requests.
+    """
+    def __init__(self, token: Optional[str]):
+        self.token = token
+        self.scope = HTTPCache.scope(token)
+        self.github = Github(auth=Auth.Token(token) if token else None, base_url=GH_API_URL)
+        self.stats = TokenStats()
+        self.created = self.last_used = time.monotonic()
+        self.services = 0
+
+    def http(self, priority: str = INTERACTIVE) -> GHAsyncClient:
+        """
+        Async client of the token. Clients are cheap (connections live in the shared pool), each
+        caller gets its own so the priority it sets only applies to its own requests.
+        """
+        return GHAsyncClient(self.token, priority=priority, stats=self.stats)
+
+    def close(self) -> None:
+        try:
+            self.github.close()
+        except Exception as e:
+            logging.debug(f"Failed to close GitHub client of token {self.scope}: {e}")
+
+
+class GHClientPool:
+    """
+    Process-wide pool of GitHub clients keyed by a hash of their token, so every task and request
+    of a tenant reuses the same client instead of building one (and its session) each time, and
+    each tenant is paced and cached under its own token. Bounded to `max_clients` tokens, least
+    recently used first out, and clients idle for `idle_seconds` are dropped.
+    """
+    def __init__(self, max_clients: int = GH_CLIENT_POOL_MAX, idle_seconds: float = GH_CLIENT_POOL_IDLE_SECONDS):
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        self._clients: "OrderedDict[str, PooledClient]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "reused": 0, "evicted_idle": 0, "evicted_lru": 0}
+
+    def get(self, token: Optional[str] = None) -> PooledClient:
+        """Client of `token` (the GH_TOKEN_TEST one when None), created on first use"""
+        if not token:
+            token = os.getenv("GH_TOKEN_TEST")
+        scope = HTTPCache.scope(token)
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            # Oldest first, the idle ones are at the front
+            while self._clients:
+                oldest = next(iter(self._clients.values()))
+                if now - oldest.last_used < self.idle_seconds:
+                    break
+                evicted.append(self._clients.pop(oldest.scope))
+                self.stats["evicted_idle"] += 1
+            client = self._clients.get(scope)
+            if client is None:
+                client = self._clients[scope] = PooledClient(token)
+                self.stats["created"] += 1
+                while len(self._clients) > self.max_clients:
+                    evicted.append(self._clients.popitem(last=False)[1])
+                    self.stats["evicted_lru"] += 1
+            else:
+                self._clients.move_to_end(scope)
+                self.stats["reused"] += 1
+            client.last_used = now
+            client.services += 1
+        for stale in evicted:
+            logging.info(f"Dropping GitHub client of token {stale.scope} (idle {now - stale.last_used:.0f}s)")
+            stale.close()
+        return client
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), OrderedDict()
+        for client in clients:
+            client.close()
+
+    def get_stats(self) -> dict:
+        """Pool counters, and the request counters of each pooled token (by token hash, never the token)"""
+        now = time.monotonic()
+        with self._lock:
+            clients = list(self._clients.values())
+            pool = {**self.stats, "size": len(clients), "max_clients": self.max_clients}
+        return {
+            "pool": pool,
+            "tokens": {
+                client.scope: {
+                    "services": client.services,
+                    "idle_seconds": round(now - client.last_used, 1),
+                    "age_seconds": round(now - client.created, 1),
+                    **client.stats.snapshot(),
+                } for client in clients
+            },
+        }
+
+
+gh_client_pool = GHClientPool()
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from app.db.redis_app import loop_redis_client
+
+load_dotenv()
+
+GH_RATE_LIMIT_ENABLED = os.getenv("GH_RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Sustained requests per second and burst per token, under GitHub's secondary limit (900 REST points a minute).
+# Its hourly budget (5000 requests per token) is followed from the X-RateLimit headers instead
+GH_RATE_LIMIT_PER_SECOND = float(os.getenv("GH_RATE_LIMIT_PER_SECOND", 10))
+GH_RATE_LIMIT_BURST = float(os.getenv("GH_RATE_LIMIT_BURST", 60))
+# Share of the burst only interactive requests may take, bulk requests wait while the bucket is below it
+GH_RATE_LIMIT_INTERACTIVE_RESERVE = float(os.getenv("GH_RATE_LIMIT_INTERACTIVE_RESERVE", 0.25))
+# Bulk requests stop when the hourly budget GitHub reports falls to this, until it resets
+GH_RATE_LIMIT_BULK_MIN_REMAINING = int(os.getenv("GH_RATE_LIMIT_BULK_MIN_REMAINING", 250))
+# After a rate limited answer the request rate is halved, and recovers linearly over this many seconds
+GH_RATE_LIMIT_RECOVERY_SECONDS = float(os.getenv("GH_RATE_LIMIT_RECOVERY_SECONDS", 300))
+# PRs with more changed files than this are reviewed at bulk priority
+GH_RATE_LIMIT_SMALL_PR_FILES = int(os.getenv("GH_RATE_LIMIT_SMALL_PR_FILES", 30))
+# Longest single sleep while waiting for a token, the bucket is checked again after it
+GH_RATE_LIMIT_MAX_SLEEP = float(os.getenv("GH_RATE_LIMIT_MAX_SLEEP", 5))
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Token bucket of one GitHub token, refilled at the configured rate, once half of the hourly budget is
+# spent no faster than what is left of it allows until its reset, and slowed down by the adaptive factor
+# after rate limited answers.
+# Returns the seconds to wait before trying again, "0" when a token was taken.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[4])
+local min_remaining = tonumber(ARGV[5])
+local recovery = tonumber(ARGV[6])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked_until', 'factor', 'factor_ts', 'remaining', 'reset', 'limit')
+local blocked_until = tonumber(state[3]) or 0
+if blocked_until > now then
+  return tostring(blocked_until - now)
+end
+local remaining = tonumber(state[6])
+local reset = tonumber(state[7])
+local limit = tonumber(state[8])
+if remaining and reset and reset > now then
+  if remaining <= math.max(min_remaining, 0) then
+    return tostring(reset - now)
+  end
+  if not limit or remaining < limit / 2 then
+    rate = math.min(rate, remaining / (reset - now))
+  end
+end
+local factor = tonumber(state[4])
+if factor then
+  factor = math.min(1, factor + (now - (tonumber(state[5]) or now)) / recovery)
+  rate = rate * factor
+end
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens - 1 >= reserve then
+  tokens = tokens - 1
+else
+  wait = (reserve + 1 - tokens) / math.max(rate, 0.001)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 7200)
+return tostring(wait)
+"""
+
+# A rate limited answer: stop every worker of the token until `blocked_until`, halve the rate
+PENALIZE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local recovery = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'factor', 'factor_ts', 'blocked_until')
+local factor = math.min(1, (tonumber(state[1]) or 1) + (now - (tonumber(state[2]) or now)) / recovery)
+local blocked_until = math.max(tonumber(state[3]) or 0, tonumber(ARGV[2]))
+redis.call('HSET', KEYS[1], 'factor', tostring(math.max(0.05, factor / 2)), 'factor_ts', tostring(now),
+           'blocked_until', tostring(blocked_until))
+redis.call('EXPIRE', KEYS[1], 7200)
+return tostring(blocked_until)
+"""
+
+
+class RateLimiter:
+    """
+    Paces GitHub requests per token across every worker with a token bucket kept in Redis and
+    updated by Lua scripts, so concurrent workers never race on it. The bucket follows the budget
+    GitHub reports (X-RateLimit-Limit / Remaining / Reset) so once half of it is spent, what is left
+    is spread until its reset instead of spent in a burst, interactive requests get a reserved share of the burst ahead of
+    bulk ones (blob fetches, large PRs), and a rate limited answer (403 or 429 with Retry-After,
+    or an exhausted budget) pauses the token everywhere and halves its rate, which then recovers
+    gradually. When Redis is unreachable requests are let through.
+    """
+    PREFIX = "gh_rate"
+
+    def __init__(self, rate: float = GH_RATE_LIMIT_PER_SECOND, burst: float = GH_RATE_LIMIT_BURST,
+                 interactive_reserve: float = GH_RATE_LIMIT_INTERACTIVE_RESERVE,
+                 bulk_min_remaining: int = GH_RATE_LIMIT_BULK_MIN_REMAINING,
+                 recovery_seconds: float = GH_RATE_LIMIT_RECOVERY_SECONDS, redis_factory=loop_redis_client):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = burst * interactive_reserve
+        self.bulk_min_remaining = bulk_min_remaining
+        self.recovery_seconds = recovery_seconds
+        self._redis = redis_factory
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "rate_limited": 0}
+        self._stats_lock = threading.Lock()
+
+    def _key(self, scope: str) -> str:
+        return f"{self.PREFIX}:{scope}"
+
+    async def acquire(self, scope: str, priority: str = INTERACTIVE) -> float:
+        """Wait for a request slot of the token, returns the seconds waited"""
+        bulk = priority == BULK
+        waited = 0.0
+        while True:
+            try:
+                wait = float(await self._redis().eval(
+                    ACQUIRE_SCRIPT, 1, self._key(scope), time.time(), self.rate, self.burst,
+                    self.reserve if bulk else 0, self.bulk_min_remaining if bulk else 0, self.recovery_seconds,
+                ))
+            except Exception as e:
+                logging.debug(f"GitHub rate limiter unavailable, not pacing: {e}")
+                wait = 0.0
+            if wait <= 0:
+                break
+            # Jittered so the waiting workers do not all come back at the same instant
+            sleep = min(wait, GH_RATE_LIMIT_MAX_SLEEP) * random.uniform(1.0, 1.2)
+            await asyncio.sleep(sleep)
+            waited += sleep
+        with self._stats_lock:
+            self.stats["acquired"] += 1
+            if waited:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += waited
+        return waited
+
+    async def observe(self, scope: str, response: httpx.Response, retry_after: Optional[float] = None) -> None:
+        """
+        Record the budget GitHub reports in a response, and pause the token for `retry_after`
+        seconds when the response is rate limited.
+        """
+        remaining, reset = response.headers.get("X-RateLimit-Remaining"), response.headers.get("X-RateLimit-Reset")
+        # GraphQL (and search) queries count against budgets of their own, the bucket follows the REST one
+        core = response.headers.get("X-RateLimit-Resource", "core") == "core"
+        try:
+            if core and remaining is not None and reset is not None:
+                budget = {"remaining": remaining, "reset": reset}
+                if "X-RateLimit-Limit" in response.headers:
+                    budget["limit"] = response.headers["X-RateLimit-Limit"]
+                await self._redis().hset(self._key(scope), mapping=budget)
+            if retry_after is not None:
+                with self._stats_lock:
+                    self.stats["rate_limited"] += 1
+                await self._redis().eval(PENALIZE_SCRIPT, 1, self._key(scope),
+                                         time.time(), time.time() + retry_after, self.recovery_seconds)
+                logging.warning(f"GitHub rate limited token {scope}, pausing it for {retry_after:.1f}s")
+        except Exception as e:
+            logging.debug(f"Failed to update the GitHub rate limiter: {e}")
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats)
+
+
+gh_rate_limiter = RateLimiter() if GH_RATE_LIMIT_ENABLED else None
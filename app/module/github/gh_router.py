@@ -15,3 +15,11 @@ async def get_pr_meta(request: PRMetaRequest):
 @gh_router.post("/pr/files")
 async def get_pr_files(request: PRFilesRequest):
     return await GHController.get_pr_files(request.repo_url, request.pr_number)
+
+@gh_router.get("/github/cache/stats")
+async def get_cache_stats():
+    return await GHController.get_cache_stats()
+
+@gh_router.get("/github/clients/stats")
+async def get_client_stats():
+    return await GHController.get_client_stats()
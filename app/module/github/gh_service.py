@@ -1,54 +1,183 @@
-import base64
+import asyncio
 import json
-import httpx
+import math
 import os
 import logging
-from typing import Optional
-from github import Github
-from github import Auth
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, NamedTuple, Optional
+from github.Comparison import Comparison
+from github.File import File
+from github.GitTree import GitTree
+from github.PullRequest import PullRequest
+from github.Repository import Repository
 
 from dotenv import load_dotenv
 
+from app.module.github.gh_async import GH_API_URL, GH_HTTP_TIMEOUT, GHAsyncClient, is_binary, run_sync
+from app.module.github.gh_cache import BlobCache, blob_cache
+from app.module.github.gh_graphql import GH_GRAPHQL_ENABLED, GHGraphQLClient
+from app.module.github.gh_mirror import GitMirror, MirrorError, gh_mirror
+from app.module.github.gh_pool import GHClientPool, gh_client_pool
+from app.module.github.gh_rate_limit import BULK, GH_RATE_LIMIT_SMALL_PR_FILES
+
 load_dotenv()
 
+# Subtrees listed concurrently when a recursive tree listing comes back truncated
+GH_TREE_FETCH_CONCURRENCY = int(os.getenv("GH_TREE_FETCH_CONCURRENCY", 4))
+# Blobs downloaded at once by get_blob_contents
+GH_BLOB_FETCH_CONCURRENCY = int(os.getenv("GH_BLOB_FETCH_CONCURRENCY", 16))
+# Larger files are not read at all, as context they would not fit in a prompt anyway
+GH_BLOB_MAX_BYTES = int(os.getenv("GH_BLOB_MAX_BYTES", 1024 * 1024))
+# The compare API lists at most this many files, a comparison reaching it may be incomplete
+GH_COMPARE_MAX_FILES = 300
+BLOB_URL = re.compile(rf"^{re.escape(GH_API_URL)}/repos/([^/]+/[^/]+)/git/blobs/([0-9a-f]{{40}})$")
+
+
+def blob_text(content: Optional[bytes], max_bytes: int = GH_BLOB_MAX_BYTES) -> Optional[str]:
+    """Text of a blob, None for binary content and blobs over `max_bytes`"""
+    if content is None or len(content) > max_bytes or is_binary(content):
+        return None
+    return content.decode("utf-8", errors="replace")
+
+
+class GitTreeEntry(NamedTuple):
+    path: str
+    type: str
+    sha: str
+    size: Optional[int]
+    url: str
+
+
+class GitTreeListing(NamedTuple):
+    """Recursive tree assembled from several listings, shaped like a PyGithub GitTree"""
+    sha: str
+    tree: List[GitTreeEntry]
+
+
 class GHService:
-    def __init__(self , gh_token : Optional[str] = None):
-        if not gh_token:
-            gh_token = os.getenv("GH_TOKEN_TEST")
-        self.client = Github(auth=Auth.Token(gh_token))
+    def __init__(self , gh_token : Optional[str] = None, mirror : GitMirror = gh_mirror,
+                 pool : GHClientPool = gh_client_pool, graphql : bool = GH_GRAPHQL_ENABLED):
+        # Clients of the token (GH_TOKEN_TEST when None) come from the process-wide pool, shared by every task of it
+        pooled = pool.get(gh_token)
+        self.client = pooled.github
+        self.token = pooled.token
+        # Reads go through the pooled async client: connections are kept alive across calls and threads,
+        # and JSON reads are revalidated against the shared HTTP cache. The PyGithub client builds the objects.
+        self.http: GHAsyncClient = pooled.http()
+        # Local git mirror serving trees, blobs and diffs of the repos it is enabled for
+        self.mirror = mirror
+        # PR metadata and batches of blobs in single GraphQL queries, REST serves whatever it cannot
+        self.graphql = GHGraphQLClient(self.http) if graphql else None
+
+    def _from_mirror(self, repo_url: str, read: Callable, *args) -> Optional[Any]:
+        """Result of a mirror read, None when the repo is not mirrored or the mirror cannot serve it"""
+        if not self.mirror.serves(repo_url):
+            return None
+        try:
+            return read(repo_url, *args, token=self.token)
+        except MirrorError as e:
+            logging.warning(f"Mirror of {repo_url} could not serve {read.__name__}, using the API: {e}")
+            return None
             
+    def _run(self, coroutine: Coroutine, rounds: int = 1) -> Any:
+        """Result of a call of the async client, waited for from this (synchronous) thread"""
+        # The pool bounds each attempt, this bounds all the retries of `rounds` calls made one after the other
+        return run_sync(coroutine, timeout=GH_HTTP_TIMEOUT * (self.http.retries + 1) * 2 * rounds)
+
+    def _wrap(self, klass: type, raw_data: dict) -> Any:
+        """PyGithub object of an API payload, so callers keep the objects they always had"""
+        return self.client.create_from_raw_data(klass, raw_data)
+
     def get_repo_meta(self, repo_url: str):
         """Fetch metadata for a repository."""
         # return self.get_repo_file_structure
         logging.info(f"Fetching repo metadata for {repo_url}")
-        repo_path = repo_url.replace("https://github.com/", "")
         try:
-            repo = self.client.get_repo(repo_path)
-            return repo
+            return self._wrap(Repository, self._run(self.http.get_repo_meta(repo_url)))
         except Exception as e:
             logging.error(f"Failed to fetch repo metadata: {e}")
             raise
     
-    def get_repo_file_structure(self, repo_url: str):
-        """Fetch file structure for a repository."""
-        logging.info(f"Fetching file structure for {repo_url}")
+    def get_repo_file_structure(self, repo_url: str, sha: Optional[str] = None):
+        """
+        Fetch file structure for a repository, at tree or commit `sha` (the default branch when None).
+        GitHub truncates recursive listings of very large trees, those are listed subtree by subtree instead.
+        """
+        logging.info(f"Fetching file structure for {repo_url} at {sha or 'default branch'}")
         repo_path = repo_url.replace("https://github.com/", "")
+        mirrored = self._from_mirror(repo_url, self.mirror.list_tree, sha)
+        if mirrored is not None:
+            tree_sha, entries = mirrored
+            return GitTreeListing(sha=tree_sha, tree=[
+                GitTreeEntry(path, kind, entry_sha, size, f"{GH_API_URL}/repos/{repo_path}/git/{kind}s/{entry_sha}")
+                for path, kind, entry_sha, size in entries
+            ])
         try:
-            repo = self.client.get_repo(repo_path)
-            tree = repo.get_git_tree(sha=repo.default_branch, recursive=True)
-            return tree
+            if sha is None:
+                sha = self._run(self.http.get_repo_meta(repo_url))["default_branch"]
+            tree = self._get_git_tree(repo_url, sha, recursive=True)
+            if not tree.raw_data.get("truncated"):
+                return tree
+            logging.warning(f"Tree of {repo_url} is truncated ({len(tree.tree)} entries), listing it per subtree")
+            return GitTreeListing(sha=tree.sha, tree=self._list_tree_paged(repo_url, tree.sha))
         except Exception as e:
             logging.error(f"Failed to fetch file structure: {e}")
             raise
-    
+
+    def _get_git_tree(self, repo_url: str, sha: str, recursive: bool = False) -> GitTree:
+        return self._wrap(GitTree, self._run(self.http.get_tree(repo_url, sha, recursive=recursive)))
+
+    def _list_tree_paged(self, repo_url: str, sha: str, prefix: str = "") -> List[GitTreeEntry]:
+        """Entries of a tree listed one level at a time, each subtree recursively (and paged again if truncated)"""
+        top = self._get_git_tree(repo_url, sha)
+        subtrees = [entry for entry in top.tree if entry.type == "tree"]
+        with ThreadPoolExecutor(max_workers=max(1, min(GH_TREE_FETCH_CONCURRENCY, len(subtrees)))) as executor:
+            listings = executor.map(lambda entry: self._list_subtree(repo_url, entry.sha, f"{prefix}{entry.path}/"), subtrees)
+            listings = dict(zip((entry.path for entry in subtrees), listings))
+        entries = []
+        for entry in top.tree:
+            entries.append(GitTreeEntry(f"{prefix}{entry.path}", entry.type, entry.sha, entry.size, entry.url))
+            if entry.type == "tree":
+                entries.extend(listings[entry.path])
+        return entries
+
+    def _list_subtree(self, repo_url: str, sha: str, prefix: str) -> List[GitTreeEntry]:
+        tree = self._get_git_tree(repo_url, sha, recursive=True)
+        if tree.raw_data.get("truncated"):
+            return self._list_tree_paged(repo_url, sha, prefix)
+        return [GitTreeEntry(f"{prefix}{entry.path}", entry.type, entry.sha, entry.size, entry.url) for entry in tree.tree]
+
+    def get_blob_url(self, repo_url: str, sha: str) -> str:
+        """API URL of a blob, the form get_blob expects"""
+        repo_path = repo_url.replace("https://github.com/", "")
+        return f"{GH_API_URL}/repos/{repo_path}/git/blobs/{sha}"
+
+    def get_tree_sha(self, repo_url: str, commit_sha: Optional[str] = None) -> str:
+        """Resolve a commit (the default branch head when None) to its tree SHA, without listing the tree."""
+        logging.info(f"Resolving the tree of {repo_url} at {commit_sha or 'default branch'}")
+        tree_sha = self._from_mirror(repo_url, self.mirror.tree_sha, commit_sha)
+        if tree_sha is not None:
+            return tree_sha
+        try:
+            if commit_sha is None:
+                branch = self._run(self.http.get_repo_meta(repo_url))["default_branch"]
+                return self._run(self.http.get_branch(repo_url, branch))["commit"]["commit"]["tree"]["sha"]
+            return self._run(self.http.get_git_commit(repo_url, commit_sha))["tree"]["sha"]
+        except Exception as e:
+            logging.error(f"Failed to resolve tree SHA: {e}")
+            raise
+
     def get_pr_meta(self, repo_url: str, pr_number: int):
         """Fetch metadata for a pull request."""
         logging.info(f"Fetching PR metadata for {repo_url}#{pr_number}")
-        repo_path = repo_url.replace("https://github.com/", "")
+        if self.graphql is not None:
+            try:
+                return self._wrap(PullRequest, self._run(self.graphql.get_pull_request(repo_url, pr_number)))
+            except Exception as e:
+                logging.warning(f"GraphQL could not fetch {repo_url}#{pr_number}, using the REST API: {e}")
         try:
-            repo = self.client.get_repo(repo_path)
-            pr = repo.get_pull(pr_number)
-            return pr
+            return self._wrap(PullRequest, self._run(self.http.get_pr_meta(repo_url, pr_number)))
         except Exception as e:
             logging.error(f"Failed to fetch PR metadata: {e}")
             raise
@@ -56,23 +185,95 @@ class GHService:
     def get_pr_files(self, repo_url: str, pr_number: int):
         """Fetch files changed in a pull request."""
         logging.info(f"Fetching PR files for {repo_url}#{pr_number}")
-        repo_path = repo_url.replace("https://github.com/", "")
+        return self.get_pr_meta(repo_url, pr_number)
+
+    def get_pr_changed_files(self, repo_url: str, pr) -> List[Any]:
+        """Files changed by a pull request (from get_pr_meta), diffed in the mirror when the repo has one"""
+        files = self._from_mirror(repo_url, self.mirror.pr_files, pr.number, pr.base.sha, pr.head.sha)
+        if files is not None:
+            return files
+        files = [self._wrap(File, file) for file in self._run(self.http.get_pr_files(repo_url, pr.number))]
+        if len(files) > GH_RATE_LIMIT_SMALL_PR_FILES:
+            # Reviewing a large PR is bulk work, interactive requests and small PRs go first
+            self.http.priority = BULK
+        return files
+    
+    def compare_commits(self, repo_url: str, base_sha: str, head_sha: str):
+        """Fetch the comparison (changed files) between two commits."""
+        logging.info(f"Comparing {base_sha}...{head_sha} for {repo_url}")
+        comparison = self._from_mirror(repo_url, self.mirror.compare, base_sha, head_sha)
+        if comparison is not None:
+            return comparison
         try:
-            repo = self.client.get_repo(repo_path)
-            pr = repo.get_pull(pr_number)
-            return pr
+            return self._wrap(Comparison, self._run(self.http.compare(repo_url, base_sha, head_sha)))
         except Exception as e:
-            logging.error(f"Failed to fetch PR files: {e}")
+            logging.error(f"Failed to compare commits: {e}")
             raise
-    
-    def get_file_content(self, file_blob_url : str):
-        """Fetch data for a file."""
+
+    def get_blob(self, file_blob_url : str) -> Optional[bytes]:
+        """Fetch the raw bytes of a blob, None when it cannot be read or is over GH_BLOB_MAX_BYTES."""
+        match = BLOB_URL.match(file_blob_url)
+        if match:
+            repo_url = f"https://github.com/{match.group(1)}"
+            content = self._from_mirror(repo_url, self._read_mirrored_blobs, [match.group(2)], GH_BLOB_MAX_BYTES)
+            if content and match.group(2) in content:
+                return content[match.group(2)]
         logging.info(f"Fetching file data for {file_blob_url}")
         try:
-            file_base64 = httpx.get(file_blob_url).json()
-            file_content_base64 = file_base64["content"]
-            file_content_decoded = base64.b64decode(file_content_base64).decode('utf-8')
-            return file_content_decoded
+            return self._run(self.http.get_blob(file_blob_url, max_bytes=GH_BLOB_MAX_BYTES))
         except Exception as e:
             logging.error(f"Failed to fetch file data: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def get_blob_contents(self, repo_url: str, shas: Iterable[str], max_bytes: int = GH_BLOB_MAX_BYTES,
+                          blobs: BlobCache = blob_cache) -> Dict[str, Optional[str]]:
+        """
+        Text of many blobs of a repo by SHA, None for the binary, too large or unreadable ones.
+        Identical SHAs are read once, and only the ones the blob cache misses are fetched (then
+        cached): from the mirror, else in batched GraphQL queries, and the rest from the REST API,
+        GH_BLOB_FETCH_CONCURRENCY at a time, streamed so binary or oversized blobs are dropped early.
+        """
+        shas = [sha for sha in dict.fromkeys(shas) if sha]
+        contents = blobs.get_or_fetch_many(shas, lambda missing: self._fetch_blobs(repo_url, missing, max_bytes))
+        return {sha: blob_text(contents.get(sha), max_bytes) for sha in shas}
+
+    def _fetch_blobs(self, repo_url: str, shas: List[str], max_bytes: int) -> Dict[str, bytes]:
+        # Blobs the mirror found over max_bytes are None, there is no point asking the API for them
+        fetched = self._from_mirror(repo_url, self._read_mirrored_blobs, shas, max_bytes) or {}
+        missing = [sha for sha in shas if sha not in fetched]
+        if missing and self.graphql is not None and not self.mirror.serves(repo_url):
+            try:
+                fetched.update(self._run(self.graphql.get_blobs(repo_url, missing, priority=BULK),
+                                         rounds=math.ceil(len(missing) / self.graphql.blob_batch)))
+            except Exception as e:
+                logging.warning(f"GraphQL could not fetch {len(missing)} blobs of {repo_url}, using the REST API: {e}")
+            missing = [sha for sha in missing if sha not in fetched]
+        if missing:
+            fetched.update(self._run(self._fetch_blobs_rest(repo_url, missing, max_bytes),
+                                     rounds=math.ceil(len(missing) / GH_BLOB_FETCH_CONCURRENCY)))
+        fetched = {sha: content for sha, content in fetched.items() if content is not None}
+        logging.info(f"Fetched {len(fetched)}/{len(shas)} blobs of {repo_url}")
+        return fetched
+
+    async def _fetch_blobs_rest(self, repo_url: str, shas: List[str], max_bytes: int) -> Dict[str, bytes]:
+        semaphore = asyncio.Semaphore(GH_BLOB_FETCH_CONCURRENCY)
+
+        async def _fetch(sha: str) -> Optional[bytes]:
+            async with semaphore:
+                try:
+                    return await self.http.get_blob(self.get_blob_url(repo_url, sha), max_bytes=max_bytes, skip_binary=True)
+                except Exception as e:
+                    logging.error(f"Failed to fetch blob {sha} of {repo_url}: {e}")
+                    return None
+
+        contents = await asyncio.gather(*(_fetch(sha) for sha in shas))
+        return {sha: content for sha, content in zip(shas, contents) if content is not None}
+
+    def _read_mirrored_blobs(self, repo_url: str, shas: List[str], max_bytes: int = GH_BLOB_MAX_BYTES,
+                             token: Optional[str] = None) -> Dict[str, Optional[bytes]]:
+        # Blobs are never fetched into the mirror one by one, the ones it does not hold are read through the API
+        return self.mirror.read_blobs(repo_url, shas, max_bytes)
+
+    def get_file_content(self, file_blob_url : str) -> Optional[str]:
+        """Fetch the text of a file, None when it is binary, too large or cannot be read."""
+        return blob_text(self.get_blob(file_blob_url))
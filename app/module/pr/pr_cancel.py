@@ -0,0 +1,55 @@
+import logging
+import os
+import threading
+import time
+
+from redis import Redis
+from celery.worker import state as worker_state
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PR_CANCEL_TTL = int(os.getenv("PR_CANCEL_TTL", 24 * 3600))
+# How often a running review looks for a cancel request in Redis
+PR_CANCEL_POLL_SECONDS = float(os.getenv("PR_CANCEL_POLL_SECONDS", 2))
+
+
+def get_cancel_key(task_id: str) -> str:
+    return f"pr_cancel:{task_id}"
+
+
+def request_cancel(cache: Redis, task_id: str) -> None:
+    """Ask the worker running `task_id` to stop, it finishes with partial results"""
+    cache.set(get_cancel_key(task_id), 1, ex=PR_CANCEL_TTL)
+
+
+class CancelFlag():
+    """
+    Callable telling whether a review task was cancelled, either through a cancel request in
+    Redis (visible from any worker process) or a revoke received by this worker process.
+    Redis is polled at most every `poll_seconds`.
+    """
+    def __init__(self, cache: Redis, task_id: str, poll_seconds: float = PR_CANCEL_POLL_SECONDS):
+        self.cache = cache
+        self.task_id = task_id
+        self.poll_seconds = poll_seconds
+        self.cancelled = False
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> bool:
+        if self.cancelled:
+            return True
+        if self.task_id in worker_state.revoked:
+            self.cancelled = True
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.poll_seconds:
+                return False
+            self._checked_at = now
+        try:
+            self.cancelled = bool(self.cache.exists(get_cancel_key(self.task_id)))
+        except Exception as e:
+            logging.warning(f"Could not check the cancel flag of task {self.task_id}: {e}")
+        return self.cancelled
@@ -1,6 +1,7 @@
+import asyncio
 import json
 import logging
-from typing import Any
+from typing import Any, AsyncIterator, Optional
 from fastapi import HTTPException
 from app.module.pr.pr_helper import celery_status_convert
 from app.module.pr.pr_schema import (
@@ -8,11 +9,14 @@ from app.module.pr.pr_schema import (
     AnalyzePRResponse,
     AnalyzePRStatus,
     AnalyzePRResults,
+    CancelPRResponse,
 )
 from app.module.pr.pr_service import PRService
 from app.module.pr.pr_model import PRReview
+from app.module.pr.pr_cancel import request_cancel
+from app.module.pr.pr_stream import format_sse, get_stream_key, read_stream_events
 from app.worker.celery_app import celery_app
-from app.db.redis_app import redis_app
+from app.db.redis_app import async_redis_app, redis_app
 
 class PRController:
     @staticmethod
@@ -24,11 +28,37 @@ class PRController:
                 redis_result = redis_app.get(task_id)
                 if(redis_result):
                     result = json.loads(redis_result.decode('utf-8'))
-            return {"task_id": result["task_id"], "status": celery_status_convert(result["status"]), "results": result["results"]}
+            return {"task_id": result["task_id"], "status": celery_status_convert(result["status"]), "results": result["results"],
+                    "report": result.get("report")}
         except Exception as e:
             logging.error(f"Unexpected error retrieving task status for task_id={task_id}: {e}")
             raise HTTPException(status_code=404, detail="Result not found")
 
+    @staticmethod
+    async def pr_results_stream(task_id: str, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        """Relay the per-file events of a task as server-sent events"""
+        try:
+            if not await async_redis_app.exists(get_stream_key(task_id)):
+                # Stream already expired (or the task ran inline), answer with the stored results if any
+                stored = await async_redis_app.get(task_id)
+                if stored:
+                    yield format_sse("done", stored.decode('utf-8'))
+                    return
+
+            async for item in read_stream_events(async_redis_app, task_id, last_event_id or "0-0"):
+                if item is None:
+                    status = await asyncio.to_thread(lambda: celery_app.AsyncResult(task_id).status)
+                    if status in ('FAILURE', 'REVOKED'):
+                        yield format_sse("error", json.dumps({"status": celery_status_convert(status)}))
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                event_id, event, data = item
+                yield format_sse(event, data, event_id)
+        except Exception as e:
+            logging.error(f"Unexpected error streaming results for task_id={task_id}: {e}")
+            yield format_sse("error", json.dumps({"detail": "Failed to stream results"}))
+
     @staticmethod
     def pr_status(task_id: str) -> AnalyzePRStatus:
         try:
@@ -39,6 +69,18 @@ class PRController:
             raise HTTPException(status_code=404, detail="Task not found")
 
 
+    @staticmethod
+    def cancel_pr(task_id: str) -> CancelPRResponse:
+        try:
+            # A queued task is dropped by the revoke, a running one sees the flag and stops with partial results
+            request_cancel(redis_app, task_id)
+            celery_app.control.revoke(task_id)
+            task = celery_app.AsyncResult(task_id)
+            return {"task_id": task_id, "status": celery_status_convert(task.status)}
+        except Exception as e:
+            logging.error(f"Unexpected error cancelling task_id={task_id}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to cancel task")
+
     @staticmethod
     def analyze_pr(request: AnalyzePRRequest) -> AnalyzePRResponse:
         try:
@@ -0,0 +1,72 @@
+import hashlib
+import re
+from typing import List
+
+from pydantic import BaseModel
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class Hunk(BaseModel):
+    header: str
+    old_start: int
+    old_lines: int
+    new_start: int
+    new_lines: int
+    body: str
+    fingerprint: str = ""
+
+    @property
+    def new_end(self) -> int:
+        return self.new_start + max(self.new_lines, 1)
+
+    def contains_line(self, line: int) -> bool:
+        return self.new_start <= line < self.new_end
+
+    def to_patch(self) -> str:
+        return f"{self.header}\n{self.body}" if self.body else self.header
+
+
+def parse_hunks(patch: str) -> List[Hunk]:
+    """
+    Split a unified diff patch (as returned by GitHub for a PR file) into hunks.
+    Each hunk gets a fingerprint of its content only, so a hunk that merely moved
+    keeps its fingerprint when lines above it change.
+    """
+    hunks: List[Hunk] = []
+    header = None
+    body: List[str] = []
+    seen: dict = {}
+
+    def _flush():
+        if header is None:
+            return
+        match = HUNK_HEADER.match(header)
+        text = "\n".join(body)
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        hunks.append(Hunk(
+            header=header,
+            old_start=int(match.group(1)),
+            old_lines=int(match.group(2) or 1),
+            new_start=int(match.group(3)),
+            new_lines=int(match.group(4) or 1),
+            body=text,
+            fingerprint=f"{digest}:{occurrence}",
+        ))
+
+    for line in (patch or "").split("\n"):
+        if HUNK_HEADER.match(line):
+            _flush()
+            header = line
+            body = []
+        elif header is not None:
+            body.append(line)
+    _flush()
+    return hunks
+
+
+def join_hunks(hunks: List[Hunk]) -> str:
+    """Build a patch out of a subset of hunks"""
+    return "\n".join(hunk.to_patch() for hunk in hunks)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from app.module.pr.pr_schema import (
     PRTaskStatus
 )
@@ -11,4 +13,20 @@ def celery_status_convert(status: str) -> PRTaskStatus:
         return PRTaskStatus.pending
     if status in ('STARTED', 'REVOKED'):
         return PRTaskStatus.processing
-    return status
\ No newline at end of file
+    return status
+
+
+def get_issues(output: Optional[dict]) -> list:
+    """Pull the issue list out of a final_answer_tool output, tolerating model formatting"""
+    file = (output or {}).get("file") if isinstance(output, dict) else None
+    if isinstance(file, dict) and isinstance(file.get("issues"), list):
+        return [issue for issue in file["issues"] if isinstance(issue, dict)]
+    return []
+
+
+def summarize_issues(issues: list) -> dict:
+    critical = sum(
+        1 for issue in issues
+        if any(word in str(issue.get("type", "")).lower() for word in ("critical", "bug", "error"))
+    )
+    return {"total_files": 1, "total_issues": len(issues), "critical_issues": critical}
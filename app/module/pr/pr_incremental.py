@@ -0,0 +1,182 @@
+import logging
+import os
+from typing import Callable, List, Optional, Set
+
+from redis import Redis
+from dotenv import load_dotenv
+
+from app.module.ai.agents.review_budget import ReviewBudget
+from app.module.github.gh_service import GHService
+from app.module.pr.pr_diff import Hunk, join_hunks, parse_hunks
+from app.module.pr.pr_helper import get_issues, summarize_issues
+from app.module.pr.pr_review_store import PRReviewStore
+
+load_dotenv()
+
+INCREMENTAL_REVIEW = os.getenv("INCREMENTAL_REVIEW", "true").lower() == "true"
+
+
+def get_issue_line(issue: dict) -> Optional[int]:
+    try:
+        return int(issue.get("line_number", issue.get("line")))
+    except (TypeError, ValueError):
+        return None
+
+
+def shift_issue(issue: dict, delta: int) -> dict:
+    """Move an issue found on an older head to where its hunk sits now"""
+    line = get_issue_line(issue)
+    if line is None or delta == 0:
+        return issue
+    key = "line_number" if "line_number" in issue else "line"
+    return {**issue, key: line + delta}
+
+
+class IncrementalReview:
+    """
+    Reviews a PR while remembering the last reviewed head SHA and the findings of each hunk.
+    On a follow-up push only files touched between the two heads are re-diffed, and only
+    their new or modified hunks go to the agent. Findings of untouched hunks are reused.
+    """
+    def __init__(self, gh: GHService, cache: Redis, agent_factory: Callable):
+        self.gh = gh
+        self.store = PRReviewStore(cache)
+        self.agent_factory = agent_factory
+
+    def review(self, repo_url: str, pr_number: int, on_result: Optional[Callable] = None,
+               on_token: Optional[Callable] = None, budget: Optional[ReviewBudget] = None) -> List[dict]:
+        """
+        Review the PR, calling `on_result(index, result)` as soon as each file is settled:
+        right away for files whose findings are fully reused, after the agent otherwise.
+        """
+        pr = self.gh.get_pr_meta(repo_url, pr_number)
+        head_sha = pr.head.sha
+        previous = self.store.load(repo_url, pr_number) or {}
+        previous_files = previous.get("files", {})
+        changed_paths = self._get_changed_paths(repo_url, previous.get("head_sha"), head_sha)
+
+        plans, files_by_path = [], {}
+        for file in self.gh.get_pr_changed_files(repo_url, pr):
+            if not file.patch:
+                continue
+            files_by_path[file.filename] = file
+            previous_file = previous_files.get(file.filename)
+            stored_hunks = (previous_file or {}).get("hunks", {})
+            if (changed_paths is not None and file.filename not in changed_paths
+                    and previous_file is not None and previous_file.get("complete", True)):
+                # Not touched since the last reviewed head, the stored findings are still exact
+                plans.append((file.filename, dict(stored_hunks), []))
+                continue
+
+            reused, new_hunks = {}, []
+            for hunk in parse_hunks(file.patch):
+                stored = stored_hunks.get(hunk.fingerprint)
+                if stored is None:
+                    new_hunks.append(hunk)
+                    continue
+                delta = hunk.new_start - stored["new_start"]
+                reused[hunk.fingerprint] = {
+                    "new_start": hunk.new_start,
+                    "issues": [shift_issue(issue, delta) for issue in stored["issues"]],
+                }
+            plans.append((file.filename, reused, new_hunks))
+
+        results: List[dict] = [None] * len(plans)
+        files_state = {}
+
+        def _settle(index: int, agent_result: Optional[dict]) -> None:
+            path, reused, new_hunks = plans[index]
+            results[index], files_state[path] = self._build_file_result(path, reused, new_hunks, agent_result)
+            if on_result:
+                on_result(index, results[index])
+
+        to_review, review_index = [], []
+        for index, (path, _, new_hunks) in enumerate(plans):
+            if new_hunks:
+                to_review.append((path, join_hunks(new_hunks)))
+                review_index.append(index)
+            else:
+                _settle(index, None)
+
+        logging.info(
+            f"Incremental review of {repo_url}#{pr_number} at {head_sha}: "
+            f"{len(to_review)} of {len(plans)} files have new hunks"
+        )
+        if to_review:
+            agent = self.agent_factory()
+            review_files = [files_by_path[path] for path, _ in to_review]
+            agent.checkout(pr, review_files)
+            agent.prefetch_context(pr, review_files)
+            agent.get_agent_response_for_file_parallel(
+                to_review,
+                on_result=lambda index, result: _settle(review_index[index], result),
+                on_token=on_token,
+                budget=budget,
+            )
+
+        self.store.save(repo_url, pr_number, {"head_sha": head_sha, "files": files_state})
+        return results
+
+    def _build_file_result(self, path: str, reused: dict, new_hunks: List[Hunk], agent_result: Optional[dict]) -> tuple[dict, dict]:
+        """Merge reused and newly found issues of a file, returning its result and its stored state"""
+        hunks_state = dict(reused)
+        reviewed = agent_result is not None and not agent_result.get("error") and not agent_result.get("partial")
+        if reviewed:
+            new_issues = self._assign_issues(new_hunks, get_issues(agent_result.get("output")))
+            for hunk in new_hunks:
+                hunks_state[hunk.fingerprint] = {"new_start": hunk.new_start, "issues": new_issues[hunk.fingerprint]}
+
+        issues = [
+            issue
+            for hunk_state in sorted(hunks_state.values(), key=lambda hunk_state: hunk_state["new_start"])
+            for issue in hunk_state["issues"]
+        ]
+        file_result = {
+            "file_path": path,
+            "output": {"file": {"name": path, "issues": issues}, "summary": summarize_issues(issues)},
+            "reused_hunks": len(reused),
+            "reviewed_hunks": len(new_hunks),
+        }
+        for key in ("triage", "cost"):
+            if agent_result is not None and key in agent_result:
+                file_result[key] = agent_result[key]
+        if agent_result is not None and agent_result.get("error"):
+            # New hunks are left out of the stored state so the next run retries them
+            file_result["error"] = agent_result["error"]
+        if agent_result is not None and agent_result.get("partial"):
+            # Same for hunks whose review was cut short
+            file_result["partial"] = agent_result["partial"]
+        file_state = {"hunks": hunks_state}
+        if new_hunks and not reviewed:
+            file_state["complete"] = False
+        return file_result, file_state
+
+    def _get_changed_paths(self, repo_url: str, old_sha: Optional[str], new_sha: str) -> Optional[Set[str]]:
+        """Paths touched between the last reviewed head and the new one, None when unknown"""
+        if not old_sha:
+            return None
+        if old_sha == new_sha:
+            return set()
+        try:
+            comparison = self.gh.compare_commits(repo_url, old_sha, new_sha)
+            paths = set()
+            for file in comparison.files:
+                paths.add(file.filename)
+                if file.previous_filename:
+                    paths.add(file.previous_filename)
+            return paths
+        except Exception as e:
+            # e.g. the old head was force-pushed away, fall back to per-hunk fingerprints only
+            logging.warning(f"Could not compare {old_sha}...{new_sha}: {e}")
+            return None
+
+    def _assign_issues(self, hunks: List[Hunk], issues: list) -> dict:
+        """Attach each new issue to the reviewed hunk its line falls in"""
+        assigned = {hunk.fingerprint: [] for hunk in hunks}
+        if not hunks:
+            return assigned
+        for issue in issues:
+            line = get_issue_line(issue)
+            owner = next((hunk for hunk in hunks if line is not None and hunk.contains_line(line)), hunks[0])
+            assigned[owner.fingerprint].append(issue)
+        return assigned
@@ -0,0 +1,49 @@
+import json
+import logging
+import os
+from typing import Optional
+
+from redis import Redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PR_REVIEW_STATE_TTL = int(os.getenv("PR_REVIEW_STATE_TTL", 30 * 24 * 3600))
+
+
+class PRReviewStore:
+    """
+    Persists what was last reviewed for a PR: the head SHA and, per file,
+    the findings of every hunk keyed by hunk fingerprint.
+
+    Stored shape:
+        {
+            "head_sha": "<sha>",
+            "files": {
+                "<path>": {
+                    "hunks": {"<fingerprint>": {"new_start": int, "issues": [...]}}
+                }
+            }
+        }
+    """
+    def __init__(self, cache: Redis, ttl: int = PR_REVIEW_STATE_TTL):
+        self.cache = cache
+        self.ttl = ttl
+
+    def get_cache_key(self, repo_url: str, pr_number: int) -> str:
+        return f"pr_review:{repo_url}#{pr_number}"
+
+    def load(self, repo_url: str, pr_number: int) -> Optional[dict]:
+        try:
+            cached_data = self.cache.get(self.get_cache_key(repo_url, pr_number))
+            if cached_data:
+                return json.loads(cached_data)
+        except Exception as e:
+            logging.error(f"Failed to load review state for {repo_url}#{pr_number}: {e}")
+        return None
+
+    def save(self, repo_url: str, pr_number: int, state: dict) -> None:
+        try:
+            self.cache.set(self.get_cache_key(repo_url, pr_number), json.dumps(state), ex=self.ttl)
+        except Exception as e:
+            logging.error(f"Failed to save review state for {repo_url}#{pr_number}: {e}")
@@ -1,4 +1,6 @@
-from fastapi import APIRouter
+from typing import Optional
+from fastapi import APIRouter, Header
+from fastapi.responses import StreamingResponse
 
 from app.module.ai.llm.ollama_llm import OllamaLLM
 from app.module.ai.llm.gemini_llm import GeminiLLM
@@ -14,7 +16,8 @@ from app.module.pr.pr_schema import (
     AnalyzePRRequest,
     AnalyzePRResponse,
     AnalyzePRStatus,
-    AnalyzePRResults
+    AnalyzePRResults,
+    CancelPRResponse
 )
 from app.module.pr.pr_controller import PRController
 from app.module.pr.pr_service import PRService
@@ -42,10 +45,23 @@ async def get_pr_results(task_id: str):
     return PRController.pr_results(task_id=task_id)
 
 
+@pr_router.get("/results/{task_id}/stream")
+async def stream_pr_results(task_id: str, last_event_id: Optional[str] = Header(default=None)):
+    return StreamingResponse(
+        PRController.pr_results_stream(task_id=task_id, last_event_id=last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @pr_router.get("/status/{task_id}", response_model=AnalyzePRStatus)
 async def get_pr_status(task_id: str):
     return PRController.pr_status(task_id=task_id)
 
+@pr_router.post("/cancel/{task_id}", response_model=CancelPRResponse)
+async def cancel_pr(task_id: str):
+    return PRController.cancel_pr(task_id=task_id)
+
 @pr_router.post("/analyze-pr", response_model=AnalyzePRResponse)
 async def analyze_pr(request: AnalyzePRRequest):
     return PRController.analyze_pr(request=request)
@@ -21,12 +21,19 @@ class AnalyzePRResponse(BaseModel):
     
 class AnalyzePRStatus(BaseModel):
     status: PRTaskStatus
+
+
+class CancelPRResponse(BaseModel):
+    task_id: str
+    status: PRTaskStatus
     
 #TODO: Remove Any
 class AnalyzePRResults(BaseModel):
     task_id: str
     status: PRTaskStatus
     results: Any
+    # Where the LLM budget went per triage label, see summarize_triage
+    report: Optional[Any] = None
 
 
 """Input / OutPut of LangChain LLM API"""
@@ -10,26 +10,61 @@ from app.worker.celery_app import celery_app
 from app.db.redis_app import redis_app
 from app.module.pr.pr_schema import PRAnalyzeLLMInput , PRAnalyzeLLMOutput
 from app.module.ai.agents.pr_agent import PRAgent
+from app.module.ai.agents.review_budget import REVIEW_PR_TIMEOUT, ReviewBudget
+from app.module.pr.pr_cancel import CancelFlag
+from app.module.pr.pr_triage import summarize_triage
+from app.module.pr.pr_incremental import INCREMENTAL_REVIEW, IncrementalReview
+from app.module.pr.pr_stream import PRStreamPublisher
 
 class PRService:
     
     @staticmethod
     @celery_app.task(name='tasks_analyze_pr')
     def analyze_pr_v2(repo_url : str, pr_number : int, github_token : str):
+        publisher = None
         try:
-            # task_id = celery_app.current_task.request.id
-            # logging.info(f"Analyzing PR  V2 ({task_id} {repo_url}, {pr_number})")   
+            # task_id is only set when running as a Celery task, /analyze-pr-v2 calls this inline
+            current_task = celery_app.current_task
+            task_id = current_task.request.id if current_task else None
+            logging.info(f"Analyzing PR V2 ({task_id} {repo_url}, {pr_number})")
             logging.info(f"Creating Knowledge that tools can use")
-            
-            gh = GHService()
+
+            gh = GHService(github_token)
             db = redis_app;
-            agent = PRAgent(gh , repo_url , db)
-            result = agent.get_pr_review(pr_number)
+            if task_id:
+                publisher = PRStreamPublisher(db, task_id)
+            on_result = publisher.publish_file if publisher else None
+            on_token = publisher.publish_token if publisher and publisher.stream_tokens else None
+            # Stops the agent cooperatively on the PR deadline or when the task is cancelled / revoked
+            budget = ReviewBudget(timeout=REVIEW_PR_TIMEOUT, cancelled=CancelFlag(db, task_id) if task_id else None)
+
+            if INCREMENTAL_REVIEW:
+                # The agent (and its repo tree) is only built when some hunk actually needs a review
+                result = IncrementalReview(gh, db, lambda: PRAgent(gh, repo_url, db)).review(
+                    repo_url, pr_number, on_result=on_result, on_token=on_token, budget=budget
+                )
+            else:
+                agent = PRAgent(gh , repo_url , db)
+                result = agent.get_pr_review(pr_number, on_result=on_result, on_token=on_token, budget=budget)
+
+            report = summarize_triage(result)
+            logging.info(f"Review budget of {repo_url}#{pr_number}: {report}")
+            if publisher:
+                db.set(
+                    name=f"{task_id}",
+                    value=json.dumps({"task_id": task_id, "status": "completed", "results": result, "report": report}, default=str)
+                )
+                publisher.publish("done", {
+                    "total_files": len(result),
+                    "report": report,
+                    "partial_files": sum(1 for file_result in result if file_result and file_result.get("partial")),
+                    "cancelled": budget.is_cancelled(),
+                })
             return result
-            pass
         except Exception as e:
-            # logging.error(f"Unexpected error while analyzing PR with task_id {task_id} : {e}")
-            pass
+            logging.error(f"Unexpected error while analyzing PR {repo_url}#{pr_number} : {e}")
+            if publisher:
+                publisher.publish("error", {"detail": str(e)})
     
     @staticmethod
     @celery_app.task(name='tasks_analyze_pr_old')
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Optional
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PR_STREAM_TTL = int(os.getenv("PR_STREAM_TTL", 24 * 3600))
+PR_STREAM_MAXLEN = int(os.getenv("PR_STREAM_MAXLEN", 10000))
+# Publish raw LLM tokens next to per-file results
+PR_STREAM_TOKENS = os.getenv("PR_STREAM_TOKENS", "false").lower() == "true"
+PR_STREAM_KEEPALIVE_MS = int(os.getenv("PR_STREAM_KEEPALIVE_MS", 15000))
+
+END_EVENTS = ("done", "error")
+
+
+def get_stream_key(task_id: str) -> str:
+    return f"pr_stream:{task_id}"
+
+
+class PRStreamPublisher:
+    """
+    Publishes the progress of a review task to a Redis stream so clients can follow it
+    before the whole task finishes. Events: file, token, done, error.
+    """
+    def __init__(self, cache: Redis, task_id: str, stream_tokens: bool = PR_STREAM_TOKENS):
+        self.cache = cache
+        self.task_id = task_id
+        self.stream_tokens = stream_tokens
+        self.key = get_stream_key(task_id)
+
+    def publish(self, event: str, data: Any) -> None:
+        try:
+            pipe = self.cache.pipeline()
+            pipe.xadd(self.key, {"event": event, "data": json.dumps(data, default=str)},
+                      maxlen=PR_STREAM_MAXLEN, approximate=True)
+            pipe.expire(self.key, PR_STREAM_TTL)
+            pipe.execute()
+        except Exception as e:
+            logging.error(f"Failed to publish {event} event for task {self.task_id}: {e}")
+
+    def publish_file(self, index: int, result: dict) -> None:
+        self.publish("file", {"index": index, **result})
+
+    def publish_token(self, file_paths: list[str], token: str) -> None:
+        if self.stream_tokens and token:
+            self.publish("token", {"file_paths": file_paths, "token": token})
+
+
+def format_sse(event: str, data: str, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+async def read_stream_events(cache: AsyncRedis, task_id: str, last_event_id: str = "0-0",
+                             block_ms: int = PR_STREAM_KEEPALIVE_MS) -> AsyncIterator[Optional[tuple[str, str, str]]]:
+    """
+    Yield (event_id, event, data) from the task stream, starting after last_event_id.
+    Yields None whenever nothing arrived for block_ms so callers can keep the connection alive.
+    Stops after an end event.
+    """
+    key = get_stream_key(task_id)
+    while True:
+        response = await cache.xread({key: last_event_id}, block=block_ms, count=100)
+        if not response:
+            yield None
+            continue
+        for _, entries in response:
+            for entry_id, fields in entries:
+                last_event_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                event = fields[b"event"].decode()
+                yield last_event_id, event, fields[b"data"].decode()
+                if event in END_EVENTS:
+                    return
@@ -0,0 +1,242 @@
+import fnmatch
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from pydantic import BaseModel
+from dotenv import load_dotenv
+
+from app.module.ai.llm.ollama_llm import OllamaLLM
+
+load_dotenv()
+
+SKIP = "skip"
+LIGHT = "light"
+FULL = "full"
+LABELS = (SKIP, LIGHT, FULL)
+
+DEFAULT_SKIP_GLOBS = ",".join([
+    # lockfiles
+    "*package-lock.json", "*yarn.lock", "*pnpm-lock.yaml", "*poetry.lock", "*Pipfile.lock", "*Cargo.lock",
+    "*go.sum", "*composer.lock", "*Gemfile.lock", "*uv.lock",
+    # generated / minified
+    "*.min.js", "*.min.css", "*.map", "*.pb.go", "*_pb2.py", "*_pb2_grpc.py", "*.generated.*",
+    # vendored and build output
+    "vendor/*", "*/vendor/*", "node_modules/*", "*/node_modules/*", "third_party/*", "dist/*", "build/*",
+    # snapshots
+    "*__snapshots__/*", "*.snap",
+])
+DEFAULT_LIGHT_GLOBS = "*.md,*.rst,*.txt,docs/*,*.json,*.yaml,*.yml,*.toml,*.ini,*.cfg"
+
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "true").lower() == "true"
+TRIAGE_SKIP_GLOBS = [glob for glob in os.getenv("TRIAGE_SKIP_GLOBS", DEFAULT_SKIP_GLOBS).split(",") if glob]
+TRIAGE_LIGHT_GLOBS = [glob for glob in os.getenv("TRIAGE_LIGHT_GLOBS", DEFAULT_LIGHT_GLOBS).split(",") if glob]
+# Diffs with at most this many added + removed lines get a single shot review
+TRIAGE_LIGHT_MAX_CHANGES = int(os.getenv("TRIAGE_LIGHT_MAX_CHANGES", 8))
+# Small Ollama model asked to label the files the rules are not sure about, empty disables it
+TRIAGE_MODEL = os.getenv("TRIAGE_MODEL", "")
+TRIAGE_MODEL_PATCH_CHARS = int(os.getenv("TRIAGE_MODEL_PATCH_CHARS", 2000))
+TRIAGE_MODEL_CONCURRENCY = int(os.getenv("TRIAGE_MODEL_CONCURRENCY", 4))
+
+# Looked for in the comments of the first lines of a file, "@generated" anywhere and as written
+GENERATED_MARKERS = ("do not edit", "code generated by", "auto-generated", "autogenerated")
+GENERATED_TAG = "@generated"
+GENERATED_HEADER_LINES = 20
+# Hunk starting at line 1 of the new file, the one showing the file header
+FIRST_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+1(?:,\d+)? @@")
+# Comment text of a line: after a comment opener, or the whole line in block comment bodies
+COMMENT = re.compile(r"(?:#|//|/\*|<!--)(.*)|^\s*(?:\*|--|;)(.*)")
+# Files where leading whitespace is syntax, a re-indent there is a real change
+INDENT_SENSITIVE_GLOBS = ["*.py", "*.pyi", "*.pyx", "*.yaml", "*.yml", "Makefile", "*.mk", "*.sass", "*.pug",
+                          "*.haml", "*.coffee", "*.nim", "*.fs"]
+
+
+class FileTriage(BaseModel):
+    file_path: str
+    label: str
+    reason: str
+    additions: int
+    deletions: int
+    # Decided by a rule that the classifier must not override
+    decisive: bool = False
+
+
+def get_changed_lines(patch: str) -> tuple[list[str], list[str]]:
+    """Added and removed lines of a unified diff"""
+    added, removed = [], []
+    for line in patch.splitlines():
+        if line.startswith("+"):
+            added.append(line[1:])
+        elif line.startswith("-"):
+            removed.append(line[1:])
+    return added, removed
+
+
+def get_change_blocks(patch: str) -> list[tuple[list[str], list[str]]]:
+    """(removed, added) lines of each run of changes between context lines of a unified diff"""
+    blocks, removed, added = [], [], []
+    for line in patch.splitlines():
+        if line.startswith("-"):
+            removed.append(line[1:])
+        elif line.startswith("+"):
+            added.append(line[1:])
+        elif not line.startswith("\\"):
+            # Context line or hunk header ("\ No newline at end of file" belongs to the run)
+            if removed or added:
+                blocks.append((removed, added))
+            removed, added = [], []
+    if removed or added:
+        blocks.append((removed, added))
+    return blocks
+
+
+def is_whitespace_only(file_path: str, patch: str) -> bool:
+    """
+    True when every run of changes only adds or strips blank lines and trailing whitespace (and
+    re-indents, where indentation is not syntax). Lines are compared in order, within their run,
+    so moved or reordered lines and changes inside a line are real changes.
+    """
+    keep_indent = match_glob(file_path, INDENT_SENSITIVE_GLOBS) is not None
+
+    def normalize(lines: list[str]) -> list[str]:
+        return [line for line in (line.rstrip() if keep_indent else line.strip() for line in lines) if line]
+    blocks = get_change_blocks(patch)
+    return bool(blocks) and all(normalize(removed) == normalize(added) for removed, added in blocks)
+
+
+def get_file_header(patch: str, lines: int = GENERATED_HEADER_LINES) -> list[str]:
+    """First lines of the new file when the diff shows them (a hunk starting at line 1), else none"""
+    header, in_first_hunk = [], False
+    for line in patch.splitlines():
+        if line.startswith("@@"):
+            if in_first_hunk:
+                break
+            in_first_hunk = FIRST_HUNK.match(line) is not None
+        elif in_first_hunk and not line.startswith(("-", "\\")):
+            header.append(line[1:])
+            if len(header) >= lines:
+                break
+    return header
+
+
+def is_generated(header: list[str]) -> bool:
+    """True when the file header carries a generated-code marker in its comments"""
+    for line in header:
+        if GENERATED_TAG in line:
+            return True
+        comment = COMMENT.search(line)
+        text = (comment.group(1) or comment.group(2) or "").lower() if comment else ""
+        if any(marker in text for marker in GENERATED_MARKERS):
+            return True
+    return False
+
+
+def match_glob(file_path: str, globs: List[str]) -> Optional[str]:
+    for glob in globs:
+        if fnmatch.fnmatch(file_path, glob) or fnmatch.fnmatch(os.path.basename(file_path), glob):
+            return glob
+    return None
+
+
+class PRTriage:
+    """
+    Labels each file of a PR before the review:
+    skip (not reviewed), light (single LLM call without tools) or full (agent loop with tools).
+    Deterministic rules run first, an optional small model labels the files they are not sure about.
+    """
+    def __init__(self, classifier: Optional[OllamaLLM] = None, skip_globs: List[str] = TRIAGE_SKIP_GLOBS,
+                 light_globs: List[str] = TRIAGE_LIGHT_GLOBS, light_max_changes: int = TRIAGE_LIGHT_MAX_CHANGES):
+        self.classifier = classifier
+        self.skip_globs = skip_globs
+        self.light_globs = light_globs
+        self.light_max_changes = light_max_changes
+
+    def triage(self, path_and_content: List[tuple[str, str]]) -> List[FileTriage]:
+        results = [self.apply_rules(file_path, patch) for file_path, patch in path_and_content]
+        undecided = [index for index, result in enumerate(results) if not result.decisive]
+        if self.classifier and undecided:
+            with ThreadPoolExecutor(max_workers=max(1, min(TRIAGE_MODEL_CONCURRENCY, len(undecided)))) as executor:
+                classified = executor.map(lambda index: self.classify(results[index], path_and_content[index][1]), undecided)
+                for index, result in zip(undecided, classified):
+                    results[index] = result
+        return results
+
+    def apply_rules(self, file_path: str, patch: str) -> FileTriage:
+        added, removed = get_changed_lines(patch)
+
+        def _label(label: str, reason: str, decisive: bool = True) -> FileTriage:
+            return FileTriage(file_path=file_path, label=label, reason=reason, additions=len(added),
+                              deletions=len(removed), decisive=decisive)
+
+        glob = match_glob(file_path, self.skip_globs)
+        if glob:
+            return _label(SKIP, f"path matches {glob}")
+        if not added and not removed:
+            return _label(SKIP, "no content change")
+        if is_whitespace_only(file_path, patch):
+            return _label(SKIP, "whitespace only")
+        if is_generated(get_file_header(patch)):
+            return _label(SKIP, "generated file")
+        glob = match_glob(file_path, self.light_globs)
+        if glob:
+            return _label(LIGHT, f"path matches {glob}")
+        if len(added) + len(removed) <= self.light_max_changes:
+            return _label(LIGHT, f"{len(added) + len(removed)} changed lines", decisive=False)
+        return _label(FULL, f"{len(added) + len(removed)} changed lines", decisive=False)
+
+    def classify(self, triage: FileTriage, patch: str) -> FileTriage:
+        """Ask the classifier model for a label, keeping the rule based one on any failure"""
+        messages = [
+            {"role": "system", "content": (
+                "You triage files of a pull request before a code review. Answer in JSON as "
+                '{"label": "skip" | "light" | "full", "reason": "<few words>"}. '
+                "skip: nothing worth reviewing (generated, data, trivial). "
+                "light: small or low risk change. full: logic changes that need careful review."
+            )},
+            {"role": "user", "content": (
+                f"file: {triage.file_path}\n+{triage.additions} -{triage.deletions}\n"
+                f"{patch[:TRIAGE_MODEL_PATCH_CHARS]}"
+            )},
+        ]
+        try:
+            response = self.classifier.chat(messages=messages, format="json", options={"num_ctx": 2048})
+            answer = json.loads(response["message"]["content"])
+            label = str(answer.get("label", "")).lower()
+            if label in LABELS:
+                return triage.model_copy(update={"label": label, "reason": f"classifier: {answer.get('reason', '')}".strip()})
+        except Exception as e:
+            logging.warning(f"Triage classifier failed for {triage.file_path}: {e}")
+        return triage
+
+
+def summarize_triage(results: List[dict]) -> dict:
+    """
+    Per PR report of where the LLM budget went: files, patch tokens, LLM calls and seconds per
+    triage label, plus the review time saved by skipped and light files, estimated from the
+    average cost of the files fully reviewed in the same PR.
+    """
+    tiers = {label: {"files": 0, "tokens": 0, "llm_calls": 0, "seconds": 0.0} for label in LABELS}
+    for result in results:
+        triage = (result or {}).get("triage")
+        if not triage:
+            continue
+        tier = tiers[triage["label"]]
+        cost = result.get("cost") or {}
+        tier["files"] += 1
+        tier["tokens"] += triage.get("tokens", 0)
+        tier["llm_calls"] += cost.get("llm_calls", 0)
+        tier["seconds"] += cost.get("seconds", 0.0)
+    for tier in tiers.values():
+        tier["llm_calls"] = round(tier["llm_calls"], 2)
+        tier["seconds"] = round(tier["seconds"], 3)
+
+    full, light, skip = tiers[FULL], tiers[LIGHT], tiers[SKIP]
+    seconds_saved = None
+    if full["files"]:
+        full_per_file = full["seconds"] / full["files"]
+        light_per_file = light["seconds"] / light["files"] if light["files"] else 0.0
+        seconds_saved = round(skip["files"] * full_per_file + light["files"] * max(0.0, full_per_file - light_per_file), 3)
+    return {"tiers": tiers, "estimated_seconds_saved": seconds_saved}
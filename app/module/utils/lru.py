@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """Thread safe LRU cache bounded by entry count and/or total size"""
+    def __init__(self, max_items: Optional[int] = None, max_bytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = len):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.size_bytes = 0
+        self._data: OrderedDict = OrderedDict()
+        self._sizes: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Larger than the whole cache, storing it would only flush everything else
+            return
+        with self._lock:
+            if key in self._data:
+                self.size_bytes -= self._sizes.pop(key)
+                del self._data[key]
+            self._data[key] = value
+            self._sizes[key] = size
+            self.size_bytes += size
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.size_bytes -= self._sizes.pop(key)
+            return self._data.pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.size_bytes = 0
+
+    def _evict(self) -> None:
+        while self._data and (
+            (self.max_items is not None and len(self._data) > self.max_items)
+            or (self.max_bytes is not None and self.size_bytes > self.max_bytes)
+        ):
+            key, _ = self._data.popitem(last=False)
+            self.size_bytes -= self._sizes.pop(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
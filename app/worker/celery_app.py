@@ -1,6 +1,7 @@
 import logging
 import os
 from celery import Celery
+from celery.signals import task_revoked, worker_process_init
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -27,3 +28,23 @@ def create_celery_app() -> Celery:
     return celery_app
 
 celery_app = create_celery_app()
+
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    """Build the reusable agent runtime once per worker process and warm up the model in the background"""
+    try:
+        from app.module.ai.agents.pr_agent import PRAgentRuntime
+        PRAgentRuntime.get().warm_up()
+    except Exception as e:
+        logging.error(f"Failed to warm up agent runtime: {e}")
+
+
+@task_revoked.connect
+def flag_revoked_task(request=None, **kwargs):
+    """Let a revoked review running in another worker process stop cooperatively"""
+    try:
+        from app.db.redis_app import redis_app
+        from app.module.pr.pr_cancel import request_cancel
+        request_cancel(redis_app, request.id)
+    except Exception as e:
+        logging.error(f"Failed to flag revoked task: {e}")
@@ -0,0 +1,273 @@
+"""
+Local stand-in for the GitHub REST API serving synthetic repos (see synthetic.py).
+
+Repos are named `<owner>/<profile>`, e.g. https://github.com/bench/medium, and any PR
+number exists. Request counts per route are served on GET /__stats and reset on POST /__reset.
+Responses carry an ETag, and a request revalidating it gets a 304 (counted as not_modified).
+With --truncate-above N, recursive tree listings longer than N entries come back truncated
+like GitHub's do for very large repositories. --latency-ms adds a delay to every API request,
+the round trip to api.github.com that a local server does not have.
+POST /graphql answers the two queries the GraphQL client sends (by operationName): PullRequest
+and Blobs, counted as graphql_pull and graphql_blobs.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from benchmark.synthetic import PROFILES, SyntheticRepo, fake_sha
+
+PER_PAGE = 30
+
+
+class FakeGitHub:
+    def __init__(self, base_url: str, truncate_above: Optional[int] = None, latency_ms: float = 0):
+        self.base_url = base_url.rstrip("/")
+        self.truncate_above = truncate_above
+        self.latency_ms = latency_ms
+        self.repos: Dict[str, SyntheticRepo] = {}
+        self.stats = Counter()
+        self.not_modified = 0
+        self.lock = threading.Lock()
+        self.routes = [
+            ("repo", re.compile(r"^/repos/([^/]+)/([^/]+)$"), self.get_repo),
+            ("pull", re.compile(r"^/repos/([^/]+)/([^/]+)/pulls/(\d+)$"), self.get_pull),
+            ("pull_files", re.compile(r"^/repos/([^/]+)/([^/]+)/pulls/(\d+)/files$"), self.get_pull_files),
+            ("tree", re.compile(r"^/repos/([^/]+)/([^/]+)/git/trees/([^/]+)$"), self.get_tree),
+            ("commit", re.compile(r"^/repos/([^/]+)/([^/]+)/git/commits/([0-9a-f]+)$"), self.get_commit),
+            ("branch", re.compile(r"^/repos/([^/]+)/([^/]+)/branches/([^/]+)$"), self.get_branch),
+            ("blob", re.compile(r"^/repos/([^/]+)/([^/]+)/git/blobs/([0-9a-f]+)$"), self.get_blob),
+            ("compare", re.compile(r"^/repos/([^/]+)/([^/]+)/compare/([^.]+)\.\.\.(.+)$"), self.get_compare),
+        ]
+
+    def repo(self, owner: str, name: str) -> Optional[SyntheticRepo]:
+        if name not in PROFILES:
+            return None
+        with self.lock:
+            key = f"{owner}/{name}"
+            if key not in self.repos:
+                self.repos[key] = SyntheticRepo(owner, name, name)
+            return self.repos[key]
+
+    def repo_url(self, repo: SyntheticRepo) -> str:
+        return f"{self.base_url}/repos/{repo.full_name}"
+
+    def handle(self, path: str, query: dict):
+        """Return (status, body, headers) for a GET request"""
+        for route, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match:
+                with self.lock:
+                    self.stats[route] += 1
+                if self.latency_ms:
+                    time.sleep(self.latency_ms / 1000)
+                repo = self.repo(match.group(1), match.group(2))
+                if repo is None:
+                    return 404, {"message": "Not Found"}, {}
+                return handler(repo, *match.groups()[2:], query=query)
+        return 404, {"message": "Not Found"}, {}
+
+    def get_repo(self, repo: SyntheticRepo, query: dict):
+        return 200, {
+            "id": abs(hash(repo.full_name)) % 10 ** 8,
+            "name": repo.name,
+            "full_name": repo.full_name,
+            "owner": {"login": repo.owner, "id": 1, "type": "User"},
+            "private": False,
+            "url": self.repo_url(repo),
+            "html_url": f"https://github.com/{repo.full_name}",
+            "default_branch": "main",
+        }, {}
+
+    def get_pull(self, repo: SyntheticRepo, number: str, query: dict):
+        url = f"{self.repo_url(repo)}/pulls/{number}"
+        return 200, {
+            "id": int(number),
+            "number": int(number),
+            "title": f"Synthetic PR {number}",
+            "state": "open",
+            "url": url,
+            "html_url": f"https://github.com/{repo.full_name}/pull/{number}",
+            "head": {"sha": repo.head_sha, "ref": f"pr-{number}", "repo": {"url": self.repo_url(repo)}},
+            "base": {"sha": repo.tree_sha, "ref": "main", "repo": {"url": self.repo_url(repo)}},
+            "changed_files": repo.config["pr_files"],
+        }, {}
+
+    def get_pull_files(self, repo: SyntheticRepo, number: str, query: dict):
+        files = repo.pr_files(int(number))
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", [str(PER_PAGE)])[0])
+        chunk = files[(page - 1) * per_page: page * per_page]
+        for file in chunk:
+            file["blob_url"] = f"{self.repo_url(repo)}/git/blobs/{file['sha']}"
+            file["contents_url"] = f"{self.repo_url(repo)}/contents/{file['filename']}"
+        headers = {}
+        if page * per_page < len(files):
+            next_url = f"{self.repo_url(repo)}/pulls/{number}/files?page={page + 1}&per_page={per_page}"
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return 200, chunk, headers
+
+    def get_tree(self, repo: SyntheticRepo, sha: str, query: dict):
+        recursive = query.get("recursive", ["0"])[0] not in ("0", "false")
+        # A directory SHA lists that subtree, anything else the root
+        prefix = next((f"{path}/" for path in repo.dirs if fake_sha(repo.full_name, path) == sha), "")
+        tree_sha = sha if prefix else repo.tree_sha
+        tree = []
+        for entry in repo.tree_entries():
+            if not entry["path"].startswith(prefix):
+                continue
+            entry = dict(entry, path=entry["path"][len(prefix):])
+            if not recursive and "/" in entry["path"]:
+                continue
+            kind = "blobs" if entry["type"] == "blob" else "trees"
+            entry["url"] = f"{self.repo_url(repo)}/git/{kind}/{entry['sha']}"
+            tree.append(entry)
+        truncated = bool(recursive and self.truncate_above and len(tree) > self.truncate_above)
+        if truncated:
+            tree = tree[:self.truncate_above]
+        return 200, {"sha": tree_sha, "url": f"{self.repo_url(repo)}/git/trees/{tree_sha}",
+                     "tree": tree, "truncated": truncated}, {}
+
+    def get_commit(self, repo: SyntheticRepo, sha: str, query: dict):
+        # Base and head of every PR share the synthetic tree
+        return 200, {"sha": sha, "url": f"{self.repo_url(repo)}/git/commits/{sha}", "message": "synthetic",
+                     "tree": {"sha": repo.tree_sha, "url": f"{self.repo_url(repo)}/git/trees/{repo.tree_sha}"},
+                     "parents": []}, {}
+
+    def get_branch(self, repo: SyntheticRepo, name: str, query: dict):
+        sha = fake_sha(repo.full_name, "branch", name)
+        tree = {"sha": repo.tree_sha, "url": f"{self.repo_url(repo)}/git/trees/{repo.tree_sha}"}
+        return 200, {"name": name, "protected": False, "commit": {
+            "sha": sha, "url": f"{self.repo_url(repo)}/commits/{sha}",
+            "commit": {"message": "synthetic", "tree": tree},
+        }}, {}
+
+    def get_blob(self, repo: SyntheticRepo, sha: str, query: dict):
+        content = repo.find_blob(sha)
+        if content is None:
+            return 404, {"message": "Not Found"}, {}
+        return 200, {"sha": sha, "size": len(content), "encoding": "base64",
+                     "content": base64.b64encode(content).decode()}, {}
+
+    def get_compare(self, repo: SyntheticRepo, base: str, head: str, query: dict):
+        return 200, {"status": "identical" if base == head else "ahead", "files": []}, {}
+
+    def graphql(self, request: dict):
+        """Return (status, body, headers) for a GraphQL query, only the shapes gh_graphql sends are understood"""
+        operation, variables = request.get("operationName"), request.get("variables") or {}
+        route = {"PullRequest": "graphql_pull", "Blobs": "graphql_blobs"}.get(operation)
+        if route is None:
+            return 200, {"errors": [{"message": f"Unknown operation {operation}"}]}, {}
+        with self.lock:
+            self.stats[route] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        repo = self.repo(variables.get("owner", ""), variables.get("name", ""))
+        if repo is None:
+            return 200, {"data": {"repository": None},
+                         "errors": [{"type": "NOT_FOUND", "message": "Could not resolve to a Repository"}]}, {}
+        if operation == "PullRequest":
+            number = variables["number"]
+            files = repo.pr_files(number)
+            return 200, {"data": {"repository": {"nameWithOwner": repo.full_name, "pullRequest": {
+                "number": number, "title": f"Synthetic PR {number}", "body": None, "state": "OPEN",
+                "url": f"https://github.com/{repo.full_name}/pull/{number}",
+                "headRefName": f"pr-{number}", "headRefOid": repo.head_sha,
+                "baseRefName": "main", "baseRefOid": repo.tree_sha,
+                "changedFiles": len(files),
+                "additions": sum(file["additions"] for file in files),
+                "deletions": sum(file["deletions"] for file in files),
+                "headRepository": {"nameWithOwner": repo.full_name},
+                "baseRepository": {"nameWithOwner": repo.full_name},
+            }}}}, {"X-RateLimit-Resource": "graphql"}
+        blobs = {}
+        for alias, sha in variables.items():
+            if not re.fullmatch(r"o\d+", alias):
+                continue
+            content = repo.find_blob(sha)
+            binary = content is not None and b"\0" in content[:8000]
+            blobs[alias] = None if content is None else {
+                "oid": sha, "byteSize": len(content), "isBinary": binary, "isTruncated": False,
+                "text": None if binary else content.decode("utf-8", errors="replace"),
+            }
+        return 200, {"data": {"repository": blobs}}, {"X-RateLimit-Resource": "graphql"}
+
+
+def make_handler(fake: FakeGitHub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body, headers: dict):
+            payload = json.dumps(body).encode()
+            if status == 200 and self.command == "GET":
+                etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+                headers = {**headers, "ETag": etag}
+                if self.headers.get("If-None-Match") == etag:
+                    with fake.lock:
+                        fake.not_modified += 1
+                    status, payload = 304, b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("X-RateLimit-Limit", "5000")
+            self.send_header("X-RateLimit-Remaining", "4999")
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/__stats":
+                with fake.lock:
+                    stats, not_modified = dict(fake.stats), fake.not_modified
+                return self._send(200, {"total": sum(stats.values()), "routes": stats, "not_modified": not_modified}, {})
+            self._send(*fake.handle(url.path, parse_qs(url.query)))
+
+        def do_POST(self):
+            # Read even when unused, what is left of it would be parsed as the next request of the connection
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if urlparse(self.path).path == "/__reset":
+                with fake.lock:
+                    fake.stats.clear()
+                    fake.not_modified = 0
+                return self._send(200, {}, {})
+            if urlparse(self.path).path == "/graphql":
+                return self._send(*fake.graphql(json.loads(body or b"{}")))
+            self._send(404, {"message": "Not Found"}, {})
+
+    return Handler
+
+
+def start_fake_github(host: str = "127.0.0.1", port: int = 8765,
+                      truncate_above: Optional[int] = None, latency_ms: float = 0) -> ThreadingHTTPServer:
+    """Start the server in a daemon thread and return it"""
+    fake = FakeGitHub(f"http://{host}:{port}", truncate_above=truncate_above, latency_ms=latency_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--truncate-above", type=int, default=None)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    fake = FakeGitHub(f"http://{args.host}:{args.port}", truncate_above=args.truncate_above,
+                      latency_ms=args.latency_ms)
+    print(f"Fake GitHub API on http://{args.host}:{args.port}")
+    ThreadingHTTPServer((args.host, args.port), make_handler(fake)).serve_forever()
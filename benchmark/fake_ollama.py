@@ -0,0 +1,161 @@
+"""
+Local stand-in for the Ollama chat API with configurable latency and scripted tool calls.
+
+Every conversation first calls `--tool-steps` tools (file content, then tree structure, ...)
+and then answers with final_answer_tool for every `file_path:` found in the user input.
+Call counts are served on GET /__stats and reset on POST /__reset.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+FILE_PATH_LINE = re.compile(r"^file_path: (\S+)", re.MULTILINE)
+
+
+class FakeOllama:
+    def __init__(self, latency_ms: float = 200, latency_per_kchar_ms: float = 5, jitter: float = 0.1,
+                 parallel: int = 4, tool_steps: int = 1):
+        self.latency_ms = latency_ms
+        self.latency_per_kchar_ms = latency_per_kchar_ms
+        self.jitter = jitter
+        self.tool_steps = tool_steps
+        self.slots = threading.Semaphore(parallel)
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def answer(self, messages: list) -> str:
+        user_input = next((message["content"] for message in messages if message["role"] == "user"), "")
+        file_paths = list(dict.fromkeys(FILE_PATH_LINE.findall(user_input)))
+        step = sum(1 for message in messages if message["role"] == "assistant")
+        if step < self.tool_steps:
+            if step % 2 == 0 and file_paths:
+                call = {"name": "repo_file_content_tool", "parameters": {"file_path": file_paths[0]}}
+            else:
+                call = {"name": "repo_file_tree_structure_tool", "parameters": {}}
+            return json.dumps(call)
+
+        files = [
+            {"name": path, "issues": [{"type": "style", "line_number": 5, "description": "synthetic finding",
+                                       "suggestion": "synthetic suggestion"}]}
+            for path in file_paths
+        ]
+        return json.dumps({
+            "name": "final_answer_tool",
+            "parameters": {
+                "file": files[0] if len(files) == 1 else files,
+                "summary": {"total_files": len(files), "total_issues": len(files), "critical_issues": 0},
+            },
+        })
+
+    def chat(self, request: dict) -> tuple[dict, float]:
+        """Return the response body and the simulated prompt eval time"""
+        messages = request.get("messages", [])
+        prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        delay = (self.latency_ms + self.latency_per_kchar_ms * prompt_chars / 1000) / 1000
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        with self.slots:
+            time.sleep(max(delay, 0))
+        with self.lock:
+            self.stats["chat"] += 1
+            self.stats["prompt_chars"] += prompt_chars
+        content = self.answer(messages)
+        return {
+            "model": request.get("model", "llama3.1"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(delay * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_chars // 4,
+            "prompt_eval_duration": int(delay * 0.7 * 1e9),
+            "eval_count": len(content) // 4,
+            "eval_duration": int(delay * 0.3 * 1e9),
+        }, delay
+
+
+def make_handler(fake: FakeOllama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self, response: dict):
+            """Stream the answer as NDJSON chunks like Ollama does with stream=true"""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            content = response["message"]["content"]
+            pieces = [content[index:index + 16] for index in range(0, len(content), 16)] or [""]
+            lines = [{**response, "message": {"role": "assistant", "content": piece}, "done": False}
+                     for piece in pieces]
+            lines.append({**response, "message": {"role": "assistant", "content": ""}})
+            for line in lines:
+                data = json.dumps(line).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/__stats":
+                with fake.lock:
+                    return self._send_json(200, dict(fake.stats))
+            self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if path == "/__reset":
+                with fake.lock:
+                    fake.stats.clear()
+                return self._send_json(200, {})
+            if path == "/api/chat":
+                response, _ = fake.chat(request)
+                if request.get("stream", True):
+                    return self._send_stream(response)
+                return self._send_json(200, response)
+            self._send_json(404, {"error": "not found"})
+
+    return Handler
+
+
+def start_fake_ollama(host: str = "127.0.0.1", port: int = 11435, **kwargs) -> ThreadingHTTPServer:
+    """Start the server in a daemon thread and return it"""
+    fake = FakeOllama(**kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--latency-per-kchar-ms", type=float, default=5)
+    parser.add_argument("--parallel", type=int, default=4)
+    parser.add_argument("--tool-steps", type=int, default=1)
+    args = parser.parse_args()
+    fake = FakeOllama(latency_ms=args.latency_ms, latency_per_kchar_ms=args.latency_per_kchar_ms,
+                      parallel=args.parallel, tool_steps=args.tool_steps)
+    print(f"Fake Ollama API on http://{args.host}:{args.port}")
+    ThreadingHTTPServer((args.host, args.port), make_handler(fake)).serve_forever()
@@ -0,0 +1,135 @@
+"""
+Local git mirror against the REST API for the repository data a review reads.
+
+    python -m benchmark.mirror_bench --profiles small,medium --latency-ms 50
+
+For every profile a local git repository is built from the synthetic repo and mirrored through
+a file:// remote, while the fake GitHub server serves the same synthetic repo over REST with
+--latency-ms added to each request (the round trip to api.github.com). A PR is read the way a
+review reads it: the tree of its head, its changed files with their patches, then the content
+of each changed file. Mirror runs are timed cold (the clone), right after a new PR is pushed
+(an incremental fetch) and warm. PR metadata comes from the API in both cases and is not timed.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Tuple
+
+from benchmark.fake_github import start_fake_github
+from benchmark.synthetic import SyntheticRepo
+
+
+def _git(work: str, *args: str) -> str:
+    return subprocess.run(["git", "-C", work, "-c", "user.name=bench", "-c", "user.email=bench@localhost", *args],
+                          check=True, capture_output=True).stdout.decode().strip()
+
+
+def build_remote(repo: SyntheticRepo, root: str) -> Tuple[str, str]:
+    """Git repository of the synthetic files at <root>/<owner>/<name>.git, returns the commit of its main branch"""
+    work = os.path.join(root, f"{repo.full_name}.git")
+    for path in repo.files:
+        os.makedirs(os.path.join(work, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(work, path), "wb") as file:
+            file.write(repo.blob(path))
+    subprocess.run(["git", "init", "-q", "-b", "main", work], check=True)
+    _git(work, "add", "-A")
+    _git(work, "commit", "-q", "-m", "synthetic")
+    return work, _git(work, "rev-parse", "HEAD")
+
+
+def push_pr(work: str, repo: SyntheticRepo, number: int) -> str:
+    """Commit the changes of PR `number` on top of main as refs/pull/<number>/head, like GitHub keeps PR heads"""
+    _git(work, "checkout", "-q", "--detach", "main")
+    for file in repo.pr_files(number):
+        path = os.path.join(work, file["filename"])
+        with open(path, "rb") as handle:
+            content = handle.read()
+        for hunk in range(repo.config["hunks"]):
+            line = f"    return value * {hunk} + len(os.sep)\n".encode()
+            content = content.replace(line, f"    # changed by PR {number}\n".encode() + line, 1)
+        with open(path, "wb") as handle:
+            handle.write(content)
+    _git(work, "commit", "-q", "-a", "-m", f"PR {number}")
+    head = _git(work, "rev-parse", "HEAD")
+    _git(work, "update-ref", f"refs/pull/{number}/head", head)
+    _git(work, "checkout", "-q", "main")
+    return head
+
+
+def read_pr(gh, repo_url: str, pr) -> dict:
+    """What a review reads of a PR, timed per step"""
+    started = time.perf_counter()
+    tree = gh.get_repo_file_structure(repo_url, gh.get_tree_sha(repo_url, pr.head.sha))
+    tree_done = time.perf_counter()
+    files = [file for file in gh.get_pr_changed_files(repo_url, pr) if file.patch]
+    files_done = time.perf_counter()
+    contents = [gh.get_blob(gh.get_blob_url(repo_url, file.sha)) for file in files]
+    finished = time.perf_counter()
+    return {
+        "tree_entries": len(tree.tree),
+        "files": len(files),
+        "blob_bytes": sum(len(content or b"") for content in contents),
+        "tree_seconds": round(tree_done - started, 4),
+        "files_seconds": round(files_done - tree_done, 4),
+        "blobs_seconds": round(finished - files_done, 4),
+        "total_seconds": round(finished - started, 4),
+    }
+
+
+def measure(profile: str, server, root: str) -> list:
+    # Imported here so GH_API_URL already points at the fake server
+    from app.module.github.gh_mirror import GitMirror
+    from app.module.github.gh_service import GHService
+
+    repo = SyntheticRepo("bench", profile, profile)
+    repo_url = f"https://github.com/{repo.full_name}"
+    work, base = build_remote(repo, os.path.join(root, "remotes"))
+    mirror = GitMirror(root=os.path.join(root, "mirrors"), remote=f"file://{root}/remotes/{{repo}}.git",
+                       repos=["*"], enabled=True)
+    rest = GHService("bench", mirror=GitMirror(enabled=False))
+    local = GHService("bench", mirror=mirror)
+
+    def _run(backend: str, phase: str, gh, pr) -> dict:
+        server.fake.stats.clear()
+        result = read_pr(gh, repo_url, pr)
+        return {"profile": profile, "backend": backend, "phase": phase, **result,
+                "api_calls": sum(server.fake.stats.values())}
+
+    results = []
+    for number in (1, 2):
+        results.append(_run("rest", f"pr {number}", rest, rest.get_pr_meta(repo_url, number)))
+
+    pr = SimpleNamespace(number=1, base=SimpleNamespace(sha=base), head=SimpleNamespace(sha=push_pr(work, repo, 1)))
+    results.append(_run("mirror", "cold (clone)", local, pr))
+    pr = SimpleNamespace(number=2, base=SimpleNamespace(sha=base), head=SimpleNamespace(sha=push_pr(work, repo, 2)))
+    results.append(_run("mirror", "new push (fetch)", local, pr))
+    results.append(_run("mirror", "warm", local, pr))
+    size = sum(size for _, size, _, _ in mirror.mirrors())
+    for result in results:
+        if result["backend"] == "mirror":
+            result["mirror_mb"] = round(size / 2 ** 20, 2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="small,medium")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    server = start_fake_github(port=args.port, latency_ms=args.latency_ms)
+    os.environ["GH_API_URL"] = f"http://127.0.0.1:{args.port}"
+    root = tempfile.mkdtemp(prefix="mirror-bench-")
+    try:
+        for profile in args.profiles.split(","):
+            for result in measure(profile, server, root):
+                print(json.dumps(result), flush=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        server.shutdown()
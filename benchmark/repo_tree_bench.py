@@ -0,0 +1,173 @@
+"""
+Build time and memory of RepoTree on synthetic GitHub trees.
+
+    python -m benchmark.repo_tree_bench --sizes 10000,100000,1000000
+
+Every size is built twice: once timed, once under tracemalloc for the peak and retained memory.
+Then a task start from the cached tree is timed: loading it and looking one path up,
+materializing the whole tree, and rendering it around a few files as the tree tool does. The Redis cache is replaced by an in-memory
+dict so only the tree itself is measured (plus the bytes it is cached as, reported separately).
+"""
+import argparse
+import gc
+import hashlib
+import json
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from benchmark.synthetic import DIRS_PER_DIR, FILES_PER_DIR
+from app.module.ai.knowledge.repo_tree import RepoTree
+
+
+class MemoryCache:
+    """The Redis calls RepoTree makes, kept in dicts. Pipelines run their commands right away"""
+    def __init__(self):
+        self.data = {}
+        self.sorted_sets = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, **kwargs):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def expire(self, key, seconds):
+        pass
+
+    def zadd(self, key, mapping):
+        self.sorted_sets.setdefault(key, {}).update(mapping)
+
+    def zrange(self, key, start, end):
+        members = sorted(self.sorted_sets.get(key, {}).items(), key=lambda item: item[1])
+        return [member for member, _ in members][start:len(members) + end + 1 if end < 0 else end + 1]
+
+    def zrevrange(self, key, start, end):
+        return list(reversed(self.zrange(key, 0, -1)))[start:end + 1]
+
+    def zremrangebyrank(self, key, start, end):
+        self.zrem(key, *self.zrange(key, start, end))
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.sorted_sets.get(key, {}).pop(member, None)
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+class SyntheticGitHub:
+    """Serves a recursive git tree of `entries` entries (files and the dirs holding them), sorted like GitHub"""
+    def __init__(self, entries: int, files_per_dir: int = FILES_PER_DIR):
+        self.files_per_dir = files_per_dir
+        self.tree = self._build(entries)
+
+    def _dir_for(self, index: int) -> str:
+        parts = []
+        bucket = index // self.files_per_dir
+        while bucket:
+            parts.append(f"pkg{bucket % DIRS_PER_DIR}")
+            bucket //= DIRS_PER_DIR
+        return "/".join(["src"] + parts)
+
+    def _build(self, entries: int):
+        dirs, files = set(), []
+        index = 0
+        while len(dirs) + len(files) < entries:
+            directory = self._dir_for(index)
+            parts = directory.split("/")
+            for depth in range(1, len(parts) + 1):
+                dirs.add("/".join(parts[:depth]))
+            files.append(f"{directory}/module_{index}.py")
+            index += 1
+
+        def _entry(path: str, kind: str):
+            sha = hashlib.sha1(path.encode()).hexdigest()
+            return SimpleNamespace(path=path, type=kind, sha=sha, size=1024 if kind == "blob" else None,
+                                   url=f"https://api.github.com/repos/bench/tree/git/{kind}s/{sha}")
+
+        tree = [_entry(path, "tree") for path in dirs] + [_entry(path, "blob") for path in files]
+        tree.sort(key=lambda entry: entry.path)
+        return SimpleNamespace(sha=hashlib.sha1(b"root").hexdigest(), tree=tree)
+
+    def get_tree_sha(self, repo_url: str, commit_sha=None) -> str:
+        return self.tree.sha
+
+    def get_repo_file_structure(self, repo_url: str, sha=None):
+        return self.tree
+
+
+def measure(entries: int, files_per_dir: int = FILES_PER_DIR) -> dict:
+    gh = SyntheticGitHub(entries, files_per_dir)
+    probe = next(entry.path for entry in reversed(gh.tree.tree) if entry.type == "blob")
+
+    gc.collect()
+    started = time.perf_counter()
+    repo_tree = RepoTree(gh, MemoryCache(), "https://github.com/bench/tree")
+    repo_tree.load()
+    build_seconds = time.perf_counter() - started
+
+    lookups = 1000
+    started = time.perf_counter()
+    for _ in range(lookups):
+        _find_node(repo_tree, probe)
+    lookup_us = (time.perf_counter() - started) / lookups * 1e6
+
+    cache = MemoryCache()
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    repo_tree = RepoTree(gh, cache, "https://github.com/bench/tree")
+    repo_tree.load()
+    cached_bytes = sum(len(value) for value in cache.data.values())
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del repo_tree
+
+    gc.collect()
+    started = time.perf_counter()
+    repo_tree = RepoTree(gh, cache, "https://github.com/bench/tree")
+    _find_node(repo_tree, probe)
+    cached_lookup_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    repo_tree.get_tree()
+    materialize_seconds = time.perf_counter() - started
+    # What the tree tool sends: the tree around a handful of PR files, within the tool result budget
+    focus = [entry.path for entry in gh.tree.tree if entry.type == "blob"][::max(1, len(gh.tree.tree) // 5)]
+    started = time.perf_counter()
+    rendered = repo_tree.get_tree_readable_for_llm(focus, max_tokens=1536)
+    render_seconds = time.perf_counter() - started
+    return {
+        "entries": len(gh.tree.tree),
+        "build_seconds": round(build_seconds, 3),
+        "lookup_us": round(lookup_us, 2),
+        "retained_mb": round((retained - baseline - cached_bytes) / 2 ** 20, 1),
+        "peak_mb": round((peak - baseline) / 2 ** 20, 1),
+        "cached_mb": round(cached_bytes / 2 ** 20, 1),
+        "cached_load_and_lookup_seconds": round(cached_lookup_seconds, 4),
+        "cached_materialize_seconds": round(materialize_seconds, 3),
+        "focused_render_seconds": round(render_seconds, 4),
+        "focused_render_lines": rendered.count("\n"),
+    }
+
+
+def _find_node(repo_tree: RepoTree, path: str):
+    """Path lookup without fetching the blob, what get_file_content does before its GitHub call"""
+    return repo_tree.get_node(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--files-per-dir", type=int, default=FILES_PER_DIR,
+                        help="Wide directories (vendored code, generated fixtures) are where linear scans hurt most")
+    args = parser.parse_args()
+    for size in args.sizes.split(","):
+        print(json.dumps({**measure(int(size), args.files_per_dir), "files_per_dir": args.files_per_dir}), flush=True)
@@ -0,0 +1,208 @@
+"""
+End-to-end throughput benchmark of /analyze-pr against fake GitHub and fake Ollama servers.
+
+Starts both fakes in-process and, with --spawn, the FastAPI app and a Celery worker wired to
+them (Redis must be running). Each profile submits --prs PRs, waits for every task and reports
+throughput, p50/p95/p99 task latency, LLM calls per file and GitHub calls per PR.
+
+    python -m benchmark.run_benchmark --spawn --profiles small,medium --prs 20
+    python -m benchmark.run_benchmark --spawn --compare benchmark/results/<previous>.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import httpx
+
+from benchmark.fake_github import start_fake_github
+from benchmark.fake_ollama import start_fake_ollama
+from benchmark.synthetic import PROFILES
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def spawn_services(args, github_url: str, ollama_url: str) -> List[subprocess.Popen]:
+    env = {
+        **os.environ,
+        "GH_API_URL": github_url,
+        "OLLAMA_HOST": ollama_url,
+        "GH_TOKEN_TEST": os.getenv("GH_TOKEN_TEST") or "bench-token",
+    }
+    if not args.keep_caches:
+        # Measure the review pipeline itself, not cache hits from an earlier run
+        env.update({"LLM_CACHE_ENABLED": "false", "INCREMENTAL_REVIEW": "false"})
+    port = httpx.URL(args.api_url).port or 8000
+    processes = [
+        subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"], env=env),
+        subprocess.Popen([sys.executable, "-m", "celery", "-A", "app.worker.celery_app.celery_app", "worker",
+                          "--include=app.module.pr.pr_service", "--loglevel=warning",
+                          f"--pool={args.pool}", f"--concurrency={args.worker_concurrency}"], env=env),
+    ]
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{args.api_url}/openapi.json", timeout=2).status_code == 200:
+                break
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    else:
+        raise RuntimeError("API did not start within 60s")
+    # Give the worker time to connect and warm up
+    time.sleep(args.worker_warmup)
+    return processes
+
+
+def run_pr(client: httpx.Client, api_url: str, repo_url: str, pr_number: int, timeout: float, poll: float) -> dict:
+    started = time.perf_counter()
+    task_id = client.post(f"{api_url}/analyze-pr", json={"repo_url": repo_url, "pr_number": pr_number}).json()["task_id"]
+    status = "pending"
+    while time.perf_counter() - started < timeout:
+        status = client.get(f"{api_url}/status/{task_id}").json()["status"]
+        if status in ("completed", "failed"):
+            break
+        time.sleep(poll)
+    latency = time.perf_counter() - started
+    files = 0
+    if status == "completed":
+        response = client.get(f"{api_url}/results/{task_id}")
+        if response.status_code == 200:
+            files = len(response.json().get("results") or [])
+    return {"task_id": task_id, "pr_number": pr_number, "status": status, "latency": latency, "files": files}
+
+
+def run_profile(args, profile: str, github, ollama) -> dict:
+    httpx.post(f"{github.url}/__reset")
+    httpx.post(f"{ollama.url}/__reset")
+    repo_url = f"https://github.com/bench/{profile}"
+
+    started = time.perf_counter()
+    with httpx.Client(timeout=30) as client, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        runs = list(executor.map(
+            lambda number: run_pr(client, args.api_url, repo_url, number, args.timeout, args.poll),
+            range(1, args.prs + 1),
+        ))
+    wall = time.perf_counter() - started
+
+    github_stats = httpx.get(f"{github.url}/__stats").json()
+    ollama_stats = httpx.get(f"{ollama.url}/__stats").json()
+    completed = [run for run in runs if run["status"] == "completed"]
+    latencies = [run["latency"] for run in completed]
+    files = sum(run["files"] for run in completed) or len(completed) * PROFILES[profile]["pr_files"]
+    return {
+        "prs": len(runs),
+        "completed": len(completed),
+        "failed": len(runs) - len(completed),
+        "wall_seconds": wall,
+        "throughput_prs_per_sec": len(completed) / wall if wall else None,
+        "throughput_files_per_sec": files / wall if wall else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+        "llm_calls": ollama_stats.get("chat", 0),
+        "llm_calls_per_file": ollama_stats.get("chat", 0) / files if files else None,
+        "github_calls": github_stats["total"],
+        "github_calls_per_pr": github_stats["total"] / len(runs) if runs else None,
+        "github_routes": github_stats["routes"],
+    }
+
+
+def compare(current: dict, previous_path: str) -> None:
+    with open(previous_path) as file:
+        previous = json.load(file)
+    print(f"\nComparison with {previous_path} ({previous.get('label')})")
+    for profile, metrics in current["profiles"].items():
+        before = previous.get("profiles", {}).get(profile)
+        if not before:
+            continue
+        print(f"  {profile}")
+        for metric in ("throughput_prs_per_sec", "latency_p50", "latency_p95", "latency_p99",
+                       "llm_calls_per_file", "github_calls_per_pr"):
+            old, new = before.get(metric), metrics.get(metric)
+            if old in (None, 0) or new is None:
+                continue
+            print(f"    {metric:<24} {old:>10.3f} -> {new:>10.3f} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="start uvicorn and a celery worker wired to the fakes")
+    parser.add_argument("--pool", default="prefork")
+    parser.add_argument("--worker-concurrency", type=int, default=4)
+    parser.add_argument("--worker-warmup", type=float, default=5)
+    parser.add_argument("--keep-caches", action="store_true", help="leave LLM cache and incremental review enabled")
+    parser.add_argument("--profiles", default="small,medium")
+    parser.add_argument("--prs", type=int, default=10, help="PRs submitted per profile")
+    parser.add_argument("--concurrency", type=int, default=10, help="PRs in flight at once")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--poll", type=float, default=0.2)
+    parser.add_argument("--github-port", type=int, default=8765)
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-parallel", type=int, default=4)
+    parser.add_argument("--llm-tool-steps", type=int, default=1)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="previous result JSON to compare against")
+    args = parser.parse_args()
+
+    github = start_fake_github(port=args.github_port)
+    github.url = f"http://127.0.0.1:{args.github_port}"
+    ollama = start_fake_ollama(port=args.ollama_port, latency_ms=args.llm_latency_ms,
+                               parallel=args.llm_parallel, tool_steps=args.llm_tool_steps)
+    ollama.url = f"http://127.0.0.1:{args.ollama_port}"
+
+    processes = spawn_services(args, github.url, ollama.url) if args.spawn else []
+    try:
+        report = {
+            "label": args.label,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output_dir")},
+            "profiles": {},
+        }
+        for profile in args.profiles.split(","):
+            print(f"Running profile {profile} ({args.prs} PRs)")
+            report["profiles"][profile] = metrics = run_profile(args, profile, github, ollama)
+            print(json.dumps({key: value for key, value in metrics.items() if key != "github_routes"}, indent=2))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.label}.json")
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {path}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Deterministic synthetic repositories and pull requests for the fake GitHub server."""
+import hashlib
+import random
+from typing import Dict, List, Optional
+
+# name -> (files in the repo, files changed per PR, hunks per changed file)
+PROFILES = {
+    "small": {"repo_files": 200, "pr_files": 5, "hunks": 1},
+    "medium": {"repo_files": 2000, "pr_files": 20, "hunks": 2},
+    "large": {"repo_files": 20000, "pr_files": 60, "hunks": 3},
+}
+
+FILES_PER_DIR = 20
+DIRS_PER_DIR = 8
+
+
+def git_blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def fake_sha(*parts) -> str:
+    return hashlib.sha1("/".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def file_content(path: str, lines: int = 12) -> bytes:
+    body = [f"# {path}", "import os", ""]
+    for index in range(lines):
+        body.append(f"def function_{index}(value):")
+        body.append(f"    return value * {index} + len(os.sep)")
+        body.append("")
+    return "\n".join(body).encode()
+
+
+class SyntheticRepo:
+    """A repo of `repo_files` python files spread over a balanced directory tree"""
+    def __init__(self, owner: str, name: str, profile: str):
+        self.owner = owner
+        self.name = name
+        self.profile = profile
+        self.config = PROFILES[profile]
+        self.files: List[str] = []
+        self.dirs: List[str] = []
+        self._blobs: Dict[str, bytes] = {}
+        self._paths_by_sha: Optional[Dict[str, str]] = None
+        self._build()
+        self.tree_sha = fake_sha(owner, name, "tree")
+        self.head_sha = fake_sha(owner, name, "head")
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.owner}/{self.name}"
+
+    def _dir_for(self, index: int) -> str:
+        parts = []
+        bucket = index // FILES_PER_DIR
+        while bucket:
+            parts.append(f"pkg{bucket % DIRS_PER_DIR}")
+            bucket //= DIRS_PER_DIR
+        return "/".join(["src"] + parts)
+
+    def _build(self) -> None:
+        dirs = set()
+        for index in range(self.config["repo_files"]):
+            directory = self._dir_for(index)
+            self.files.append(f"{directory}/module_{index}.py")
+            parts = directory.split("/")
+            for depth in range(1, len(parts) + 1):
+                dirs.add("/".join(parts[:depth]))
+        self.dirs = sorted(dirs)
+
+    def blob(self, path: str) -> bytes:
+        if path not in self._blobs:
+            self._blobs[path] = file_content(path)
+        return self._blobs[path]
+
+    def blob_sha(self, path: str) -> str:
+        return git_blob_sha(self.blob(path))
+
+    def find_blob(self, sha: str) -> Optional[bytes]:
+        if self._paths_by_sha is None:
+            self._paths_by_sha = {self.blob_sha(path): path for path in self.files}
+        path = self._paths_by_sha.get(sha)
+        return self.blob(path) if path else None
+
+    def tree_entries(self) -> List[dict]:
+        entries = [{"path": path, "mode": "040000", "type": "tree", "sha": fake_sha(self.full_name, path)}
+                   for path in self.dirs]
+        entries += [{"path": path, "mode": "100644", "type": "blob", "sha": self.blob_sha(path),
+                     "size": len(self.blob(path))} for path in self.files]
+        return sorted(entries, key=lambda entry: entry["path"])
+
+    def pr_files(self, number: int) -> List[dict]:
+        """Files changed by PR `number`, different PR numbers touch different files"""
+        rng = random.Random(f"{self.full_name}#{number}")
+        paths = rng.sample(self.files, min(self.config["pr_files"], len(self.files)))
+        files = []
+        for path in paths:
+            hunks = []
+            for hunk in range(self.config["hunks"]):
+                start = 4 + hunk * 30
+                hunks.append(
+                    f"@@ -{start},3 +{start},4 @@ def function_{hunk}(value):\n"
+                    f"     return value * {hunk} + len(os.sep)\n"
+                    f"-\n"
+                    f"+    # changed by PR {number}\n"
+                    f"+    value = value or {rng.randint(1, 99)}\n"
+                    f" def function_{hunk + 1}(value):"
+                )
+            files.append({
+                "sha": self.blob_sha(path),
+                "filename": path,
+                "status": "modified",
+                "additions": 2 * len(hunks),
+                "deletions": len(hunks),
+                "changes": 3 * len(hunks),
+                "patch": "\n".join(hunks),
+            })
+        return files